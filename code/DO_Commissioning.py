@@ -10,19 +10,21 @@
 # In[2]:
 
 
-import pandas as pd
-import matplotlib.pyplot as plt
-import matplotlib as mpl
-import seaborn as sns
-import seawater as sw
-import scipy.stats as sci_st
+from data_access import read_dataset
+from group_stats import describe_groups, group_medians
+from instrument_drift import drift_summary
+from pairwise_tests import pairwise_ttests
+from profile_alignment import compare_profiles
+from resampling import resample_pairs
+from saturation_qc import saturation_qc
+from variance_components import homogeneity_tests, variance_components
+from figures import FIGURE_SPECS, build_figure # Plot styling (whitegrid, serif font, A4 friendly size) lives in figures.py
 
-sns.set(style="whitegrid") # I like this
-mpl.rc('font', family='serif') # Cast serif as the font
-mpl.rc('figure', figsize=[8, 5]) # Set fig size to something more fitting for A4 word doc
+# Run with DO_COMMISSIONING_PROFILE=1 to get the time and peak memory of every fetch, stats block and figure (see profiling.py)
 
 
 # ### Variables for locations of datafiles (in same order as headings)
+# These are resolved through a local cache by read_dataset, set DO_COMMISSIONING_OFFLINE=1 to never hit the network
 
 # In[3]:
 
@@ -45,7 +47,7 @@ COMBINED_DATA = 'https://raw.githubusercontent.com/kendall-s/do_commissioning/ma
 # In[4]:
 
 
-iodate_df = pd.read_csv(INDEPENDENT_IODATE_DATA)
+iodate_df = read_dataset(INDEPENDENT_IODATE_DATA)
 
 
 # In[5]:
@@ -59,29 +61,25 @@ iodate_df.head()
 # In[6]:
 
 
-sns.boxplot(iodate_df['Instrument'], iodate_df['O2µmol/L'])
+build_figure(FIGURE_SPECS['independent_iodate_standards'], iodate_df, out_dir='.')
 
-plt.xlabel("Instrument", fontsize=16)
-plt.ylabel("Concentration (uM)", fontsize=16)
-plt.xticks(fontsize=14)
-plt.yticks(fontsize=12)
-plt.title('Independent Iodate Standard', fontsize=18)
 
-plt.tight_layout()
+# ### 3.1.2 Iodate Standards Descriptive Statistics
 
-# Comment or include next two lines if wanting to scale chart for all
-#data_mean = iodate_df['O2µmol/L'].mean()
-#plt.ylim(data_mean-2, data_mean+2)
+# In[7]:
 
-plt.savefig('independent_iodate_standards.svg', format='svg')
 
+describe_groups(iodate_df, by=['Instrument'])
 
-# ### 3.1.2 Iodate Standards Descriptive Statistics
 
-# In[7]:
+# ### 3.1.3 Drift Through the Iodate Session
+
+# In[ ]:
 
 
-iodate_df.groupby(['Instrument'])['O2µmol/L'].describe()
+# Straight line through each instrument's standards in the order they were titrated (from TitreTime), the slope is
+# per hour. rolling_drift() gives the same thing over a moving window for longer sessions
+drift_summary(iodate_df)
 
 
 # ---
@@ -93,7 +91,7 @@ iodate_df.groupby(['Instrument'])['O2µmol/L'].describe()
 # In[8]:
 
 
-deep_reps_single_df = pd.read_csv(DEP_1_DEEP_REPLICATES_SINGLE_NISKINS_DATA)
+deep_reps_single_df = read_dataset(DEP_1_DEEP_REPLICATES_SINGLE_NISKINS_DATA)
 
 
 # In[9]:
@@ -107,21 +105,7 @@ deep_reps_single_df.head()
 # In[10]:
 
 
-sns.boxplot(deep_reps_single_df['Instrument'], deep_reps_single_df['O2µmol/L'])
-
-plt.xlabel("Instrument", fontsize=16)
-plt.ylabel("Concentration (uM)", fontsize=16)
-plt.xticks(fontsize=14)
-plt.yticks(fontsize=12)
-plt.title('D1 Replicate Samples: 1 Niskin ea', fontsize=18)
-
-plt.tight_layout()
-
-# Comment or include next two lines if wanting to scale chart for all
-#data_mean = deep_reps_single_df['O2µmol/L'].mean()
-#plt.ylim(data_mean-2, data_mean+2)
-
-plt.savefig('replicate_deep_samples_1_single.svg', format='svg')
+build_figure(FIGURE_SPECS['replicate_deep_samples_1_single'], deep_reps_single_df, out_dir='.')
 
 
 # #### 3.2.1.2 Descriptive Statistics
@@ -129,7 +113,7 @@ plt.savefig('replicate_deep_samples_1_single.svg', format='svg')
 # In[11]:
 
 
-deep_reps_single_df.groupby(['Instrument'])['O2µmol/L'].describe()
+describe_groups(deep_reps_single_df, by=['Instrument'])
 
 
 # #### 3.2.1.3 T-Test Comparison of Means
@@ -137,9 +121,9 @@ deep_reps_single_df.groupby(['Instrument'])['O2µmol/L'].describe()
 # In[12]:
 
 
-deep_reps_single_newa = deep_reps_single_df.loc[deep_reps_single_df['Instrument'] == 'New A']
-deep_reps_single_newb = deep_reps_single_df.loc[deep_reps_single_df['Instrument'] == 'New B']
-deep_reps_single_old = deep_reps_single_df.loc[deep_reps_single_df['Instrument'] == 'Old']
+# Every instrument pair is tested in one go, rows are looked up by (instrument_a, instrument_b) in the next cells
+deep_reps_single_tests = pairwise_ttests(deep_reps_single_df, by=None, correction=None)
+deep_reps_single_tests = deep_reps_single_tests.set_index(['instrument_a', 'instrument_b'])
 
 
 # ##### Compare New A to Old instrument
@@ -147,9 +131,9 @@ deep_reps_single_old = deep_reps_single_df.loc[deep_reps_single_df['Instrument']
 # In[13]:
 
 
-result = sci_st.ttest_ind(deep_reps_single_newa['O2µmol/L'], deep_reps_single_old['O2µmol/L'])
-print(f'Comparison of the New A instrument to Old, p-value: {result[1]}')
-if result[1] < 0.05:
+result = deep_reps_single_tests.loc[('New A', 'Old')]
+print(f'Comparison of the New A instrument to Old, p-value: {result["p_value"]}')
+if result['p_value'] < 0.05:
     print('Significance !')
 
 
@@ -158,9 +142,9 @@ if result[1] < 0.05:
 # In[14]:
 
 
-result = sci_st.ttest_ind(deep_reps_single_newb['O2µmol/L'], deep_reps_single_old['O2µmol/L'])
-print(f'Comparison of the New B instrument to Old, p-value: {result[1]}')
-if result[1] < 0.05:
+result = deep_reps_single_tests.loc[('New B', 'Old')]
+print(f'Comparison of the New B instrument to Old, p-value: {result["p_value"]}')
+if result['p_value'] < 0.05:
     print('Significance !')
 
 
@@ -169,7 +153,7 @@ if result[1] < 0.05:
 # In[15]:
 
 
-deep_reps_shared_df = pd.read_csv(DEP_1_DEEP_REPLICATES_SHARED_NISKINS_DATA)
+deep_reps_shared_df = read_dataset(DEP_1_DEEP_REPLICATES_SHARED_NISKINS_DATA)
 
 
 # In[16]:
@@ -183,29 +167,25 @@ deep_reps_shared_df.head()
 # In[17]:
 
 
-sns.boxplot(deep_reps_shared_df['Instrument'], deep_reps_shared_df['O2µmol/L'])
+build_figure(FIGURE_SPECS['replicate_deep_samples_1_shared'], deep_reps_shared_df, out_dir='.')
 
-plt.xlabel("Instrument", fontsize=16)
-plt.ylabel("Concentration (uM)", fontsize=16)
-plt.xticks(fontsize=14)
-plt.yticks(fontsize=12)
-plt.title('D1 Replicate Samples: 2 Niskin shared', fontsize=18)
 
-plt.tight_layout()
+# #### 3.2.2.2 Descriptive Statistics
 
-# Comment or include next two lines if wanting to scale chart for all
-#data_mean = deep_reps_shared_df['O2µmol/L'].mean()
-#plt.ylim(data_mean-2, data_mean+2)
+# In[18]:
 
-plt.savefig('replicate_deep_samples_1_shared.svg', format='svg')
 
+describe_groups(deep_reps_shared_df, by=['Instrument'])
 
-# #### 3.2.2.2 Descriptive Statistics
 
-# In[18]:
+# #### 3.2.2.3 Bootstrap and Permutation Comparison
+
+# In[ ]:
 
 
-deep_reps_shared_df.groupby(['Instrument'])['O2µmol/L'].describe()
+# Only 4 samples per instrument, so compare them without assuming normality: bootstrap 95% intervals for the
+# difference in mean and std, and permutation p-values, for every instrument pair
+resample_pairs(deep_reps_shared_df, by=None, n_resamples=100_000)
 
 
 # ---
@@ -215,7 +195,7 @@ deep_reps_shared_df.groupby(['Instrument'])['O2µmol/L'].describe()
 # In[19]:
 
 
-atmospheric_all_df = pd.read_csv(ATMOSPHERIC_DIFF_INSTRUMENTS_DATA)
+atmospheric_all_df = read_dataset(ATMOSPHERIC_DIFF_INSTRUMENTS_DATA)
 
 
 # In[20]:
@@ -231,21 +211,7 @@ atmospheric_all_df.head()
 # In[21]:
 
 
-sns.boxplot(atmospheric_all_df['Instrument'], atmospheric_all_df['O2µmol/L'])
-
-plt.xlabel("Instrument", fontsize=16)
-plt.ylabel("Concentration (uM)", fontsize=16)
-plt.xticks(fontsize=14)
-plt.yticks(fontsize=12)
-plt.title('Atmospheric Saturated Sample', fontsize=18)
-
-plt.tight_layout()
-
-# Comment or include next two lines if wanting to scale chart for all
-#data_mean = atmospheric_all_df['O2µmol/L'].mean()
-#plt.ylim(data_mean-2, data_mean+2)
-
-plt.savefig('atmospheric_diff_instruments.svg', format='svg')
+build_figure(FIGURE_SPECS['atmospheric_diff_instruments'], atmospheric_all_df, out_dir='.')
 
 
 # ### 3.3.2 Atmospheric Saturated Sample Boxplot (QC Control Lines)
@@ -255,53 +221,22 @@ plt.savefig('atmospheric_diff_instruments.svg', format='svg')
 # In[22]:
 
 
-sns.boxplot(atmospheric_all_df['Instrument'], atmospheric_all_df['O2µmol/L'])
+build_figure(FIGURE_SPECS['atmospheric_diff_instruments_with_bars'], atmospheric_all_df, out_dir='.')
 
-plt.xlabel("Instrument", fontsize=16)
-plt.ylabel("Concentration (uM)", fontsize=16)
-plt.xticks(fontsize=14)
-plt.yticks(fontsize=12)
-plt.title('Atmospheric Saturated Sample w/QC Bars', fontsize=18)
 
-# Calculate the theoretical saturation
-MEASURED_SALINITY = 0
-MEASURED_TEMPERATURE = 21.5
-max_saturation = sw.satO2(MEASURED_SALINITY, MEASURED_TEMPERATURE)
-max_saturation_mol = max_saturation * 44.66
-
-max_saturation_mol_1pct = max_saturation_mol * 0.01
-
-# Plot the calculated saturation as a line on the chart
-plt.plot([-0.5, 2.5], [max_saturation_mol, max_saturation_mol], color="#32a858")
-
-# Plot the 1% upper and lower lines
-plt.plot([-0.5, 2.5], [max_saturation_mol-max_saturation_mol_1pct, max_saturation_mol-max_saturation_mol_1pct], color="#2c5aa3")
-plt.plot([-0.5, 2.5], [max_saturation_mol+max_saturation_mol_1pct, max_saturation_mol+max_saturation_mol_1pct], color="#2c5aa3")
-
-# Plot the +- 1uM upper and lower lines
-plt.plot([-0.5, 2.5], [max_saturation_mol-1, max_saturation_mol-1], color="#2c9fa3")
-plt.plot([-0.5, 2.5], [max_saturation_mol+1, max_saturation_mol+1], color="#2c9fa3")
-
-# Plot the annotations
-plt.annotate('+1µM', xy=(2.28, max_saturation_mol+1-0.25))
-plt.annotate('+1%', xy=(2.32, max_saturation_mol+max_saturation_mol_1pct-0.25))
-plt.annotate('Calc. Sat.', xy=(2.14, max_saturation_mol-0.25))
+# ### 3.3.3 Descriptive Statistics
 
-plt.tight_layout()
+# In[23]:
 
-# Comment or include next two lines if wanting to scale chart for all
-#data_mean = atmospheric_all_df['O2µmol/L'].mean()
-#plt.ylim(data_mean-2, data_mean+2)
 
-plt.savefig('atmospheric_diff_instruments_with_bars.svg', format='svg')
+describe_groups(atmospheric_all_df, by=['Instrument'])
 
 
-# ### 3.3.3 Descriptive Statistics
-
-# In[23]:
+# In[ ]:
 
 
-atmospheric_all_df.groupby(['Instrument'])['O2µmol/L'].describe()
+# Deviation of each sample from the saturation at its own draw temperature, and whether it is inside the QC limits
+atmospheric_all_df.join(saturation_qc(atmospheric_all_df))
 
 
 # ---
@@ -311,7 +246,7 @@ atmospheric_all_df.groupby(['Instrument'])['O2µmol/L'].describe()
 # In[24]:
 
 
-atmospheric_one_df = pd.read_csv(ATMOSPHERIC_ONE_INSTRUMENT_DATA)
+atmospheric_one_df = read_dataset(ATMOSPHERIC_ONE_INSTRUMENT_DATA)
 
 
 # In[25]:
@@ -325,17 +260,7 @@ atmospheric_one_df.head()
 # In[26]:
 
 
-sns.lineplot(atmospheric_one_df.index, atmospheric_one_df['O2µmol/L'], lw=0, marker="o", ms=10)
-
-plt.xlabel("Sample", fontsize=16)
-plt.ylabel("Concentration (uM)", fontsize=16)
-plt.xticks(fontsize=14)
-plt.yticks(fontsize=12)
-plt.title('Atmospheric Saturated Sample: Instrument New B', fontsize=18)
-
-plt.tight_layout()
-
-plt.savefig('atmospheric_one_instrument.svg', format='svg')
+build_figure(FIGURE_SPECS['atmospheric_one_instrument'], atmospheric_one_df, out_dir='.')
 
 
 # ### 3.4.2 Atmospheric Saturated Sample: Instrument New B (QC Control Limits)
@@ -343,43 +268,7 @@ plt.savefig('atmospheric_one_instrument.svg', format='svg')
 # In[27]:
 
 
-sns.lineplot(atmospheric_one_df.index, atmospheric_one_df['O2µmol/L'], lw=0, marker="o", ms=10)
-
-plt.xlabel("Sample", fontsize=16)
-plt.ylabel("Concentration (uM)", fontsize=16)
-plt.xticks(fontsize=14)
-plt.yticks(fontsize=12)
-plt.title('Atmospheric Saturated Sample: Instrument New B', fontsize=18)
-
-plt.tight_layout()
-
-# Calculate the theoretical saturation
-MEASURED_SALINITY = 0
-MEASURED_TEMPERATURE = 21.5
-max_saturation = sw.satO2(MEASURED_SALINITY, MEASURED_TEMPERATURE)
-max_saturation_mol = max_saturation * 44.66
-
-max_saturation_mol_1pct = max_saturation_mol * 0.01
-
-# Plot the calculated saturation as a line on the chart
-plt.plot([-1, 13], [max_saturation_mol, max_saturation_mol], color="#32a858")
-
-# Plot the 1% upper and lower lines
-plt.plot([-1, 13], [max_saturation_mol-max_saturation_mol_1pct, max_saturation_mol-max_saturation_mol_1pct], color="#2c5aa3")
-plt.plot([-1, 13], [max_saturation_mol+max_saturation_mol_1pct, max_saturation_mol+max_saturation_mol_1pct], color="#2c5aa3")
-
-# Plot the +- 1uM upper and lower lines
-plt.plot([-1, 13], [max_saturation_mol-1, max_saturation_mol-1], color="#2c9fa3")
-plt.plot([-1, 13], [max_saturation_mol+1, max_saturation_mol+1], color="#2c9fa3")
-
-# Plot the annotations
-plt.annotate('+1µM', xy=(12, max_saturation_mol+1-0.25))
-plt.annotate('+1%', xy=(12.18, max_saturation_mol+max_saturation_mol_1pct-0.25))
-plt.annotate('Calc. Sat.', xy=(11.4, max_saturation_mol-0.25))
-
-plt.xlim(-1, 13)
-
-plt.savefig('atmospheric_one_instrument_with_bars.svg', format='svg')
+build_figure(FIGURE_SPECS['atmospheric_one_instrument_with_bars'], atmospheric_one_df, out_dir='.')
 
 
 # ### 3.4.3 Atmospheric Saturated Sample: Instrument New B Boxplot (QC Control Limits)
@@ -387,53 +276,21 @@ plt.savefig('atmospheric_one_instrument_with_bars.svg', format='svg')
 # In[28]:
 
 
-sns.boxplot(atmospheric_one_df['Instrument'], atmospheric_one_df['O2µmol/L'])
-
-plt.xlabel("Sample", fontsize=16)
-plt.ylabel("Concentration (uM)", fontsize=16)
-plt.xticks(fontsize=14)
-plt.yticks(fontsize=12)
-plt.title('Atmospheric Saturated Sample: Instrument New B', fontsize=18)
-
-plt.tight_layout()
-
-# Calculate the theoretical saturation
-MEASURED_SALINITY = 0
-MEASURED_TEMPERATURE = 21.5
-max_saturation = sw.satO2(MEASURED_SALINITY, MEASURED_TEMPERATURE)
-max_saturation_mol = max_saturation * 44.66
-
-max_saturation_mol_1pct = max_saturation_mol * 0.01
-
-# Plot the calculated saturation as a line on the chart
-plt.plot([-0.5, 0.5], [max_saturation_mol, max_saturation_mol], color="#32a858")
+build_figure(FIGURE_SPECS['atmospheric_one_instrument_with_bars-boxplot-version'], atmospheric_one_df, out_dir='.')
 
-# Plot the 1% upper and lower lines
-plt.plot([-0.5, 0.5], [max_saturation_mol-max_saturation_mol_1pct, max_saturation_mol-max_saturation_mol_1pct], color="#2c5aa3")
-plt.plot([-0.5, 0.5], [max_saturation_mol+max_saturation_mol_1pct, max_saturation_mol+max_saturation_mol_1pct], color="#2c5aa3")
 
-# Plot the +- 1uM upper and lower lines
-plt.plot([-0.5, 0.5], [max_saturation_mol-1, max_saturation_mol-1], color="#2c9fa3")
-plt.plot([-0.5, 0.5], [max_saturation_mol+1, max_saturation_mol+1], color="#2c9fa3")
-
-# Plot the annotations
-plt.annotate('+1µM', xy=(0.42, max_saturation_mol+1-0.25))
-plt.annotate('+1%', xy=(0.44, max_saturation_mol+max_saturation_mol_1pct-0.25))
-plt.annotate('Calc. Sat.', xy=(0.38, max_saturation_mol-0.23))
+# ### 3.4.4 Descriptive Statistics
 
-# Comment or include next two lines if wanting to scale chart for all
-#data_mean = atmospheric_one_df['O2µmol/L'].mean()
-#plt.ylim(data_mean-2, data_mean+2)
+# In[29]:
 
-plt.savefig('atmospheric_one_instrument_with_bars-boxplot-version.svg', format='svg')
 
+atmospheric_one_df['O2µmol/L'].describe()
 
-# ### 3.4.4 Descriptive Statistics
 
-# In[29]:
+# In[ ]:
 
 
-atmospheric_one_df['O2µmol/L'].describe()
+atmospheric_one_df.join(saturation_qc(atmospheric_one_df))
 
 
 # ---
@@ -443,7 +300,7 @@ atmospheric_one_df['O2µmol/L'].describe()
 # In[30]:
 
 
-profile_comparison_df = pd.read_csv(PROFILE_COMPARISON_DATA)
+profile_comparison_df = read_dataset(PROFILE_COMPARISON_DATA)
 
 
 # In[31]:
@@ -457,29 +314,7 @@ profile_comparison_df.head()
 # In[32]:
 
 
-instrument_new_a_df = profile_comparison_df.loc[profile_comparison_df['Instrument'] == 'New A']
-instrument_old_df = profile_comparison_df.loc[profile_comparison_df['Instrument'] == 'Old']
-
-plt.plot(instrument_new_a_df['O2µmol/L'], instrument_new_a_df['Pressure'], lw=0, marker="o", ms=14, mfc="none", mew=1.5, label="New A")
-
-plt.plot(instrument_old_df['O2µmol/L'], instrument_old_df['Pressure'], lw=0, marker=".", ms=16, mfc="none", mew=1.5, label="Old")
-
-plt.xlabel("Concentration (uM)", fontsize=16)
-plt.ylabel("Pressure (db)", fontsize=16)
-plt.xticks(fontsize=14)
-plt.yticks(fontsize=12)
-plt.title('Profile Comparison', fontsize=18)
-
-plt.legend()
-
-plt.gca().invert_yaxis()
-
-fig = mpl.pyplot.gcf()
-fig.set_size_inches(5, 8)
-
-plt.tight_layout()
-
-plt.savefig('profile_comparison.svg', format='svg')
+build_figure(FIGURE_SPECS['profile_comparison'], profile_comparison_df, out_dir='.')
 
 
 # ### 3.5.2 T-Test Comparison of means
@@ -487,19 +322,26 @@ plt.savefig('profile_comparison.svg', format='svg')
 # In[33]:
 
 
-results_dict = {}
+# Test New A against Old at every depth level at once (pressures within 2 db are one level), then pull out the
+# depths of interest
+depth_tests = compare_profiles(profile_comparison_df)
 depths_to_test = [5, 40, 800, 1000]
-for depth in depths_to_test:
-    instrument_a_depth_subset = instrument_new_a_df.loc[instrument_new_a_df['Pressure'] == depth]
-    instrument_old_depth_subset = instrument_old_df.loc[instrument_old_df['Pressure'] == depth]
-    result = sci_st.ttest_ind(instrument_a_depth_subset['O2µmol/L'], instrument_old_depth_subset['O2µmol/L'])
-    results_dict[depth] = result[1]
+depth_tests = depth_tests.loc[depth_tests['PressureLevel'].isin(depths_to_test)]
+results_dict = dict(zip(depth_tests['PressureLevel'].astype(int), depth_tests['p_value']))
 
 print("For the tested depths, the t-test p-value is shown")
 for key in results_dict:
     print(f'At depth: {key} the p-value is: {results_dict[key]}')
 
 
+# In[ ]:
+
+
+# Samples drawn from the same Niskin (matched on RP) compared directly, every level
+compare_profiles(profile_comparison_df)[['PressureLevel', 'instrument_a', 'instrument_b', 'difference', 'n_paired',
+                                         'paired_mean', 'paired_std', 'paired_p_value']]
+
+
 # ---
 
 # ## 3.6 Repeated Deep Sample Measurements: 2
@@ -507,7 +349,7 @@ for key in results_dict:
 # In[34]:
 
 
-deep_reps_two_df = pd.read_csv(DEP_2_DEEP_REPLICATES_DATA)
+deep_reps_two_df = read_dataset(DEP_2_DEEP_REPLICATES_DATA)
 
 
 # In[35]:
@@ -521,21 +363,7 @@ deep_reps_two_df.head()
 # In[36]:
 
 
-sns.boxplot(deep_reps_two_df['Instrument'], deep_reps_two_df['O2µmol/L'])
-
-plt.xlabel("Instrument", fontsize=16)
-plt.ylabel("Concentration (uM)", fontsize=16)
-plt.xticks(fontsize=14)
-plt.yticks(fontsize=12)
-plt.title('D2 Replicate Samples', fontsize=18)
-
-plt.tight_layout()
-
-# Comment or include next two lines if wanting to scale chart for all
-#data_mean = deep_reps_two_df['O2µmol/L'].mean()
-#plt.ylim(data_mean-2, data_mean+2)
-
-plt.savefig('replicate_deep_samples_2.svg', format='svg')
+build_figure(FIGURE_SPECS['replicate_deep_samples_2'], deep_reps_two_df, out_dir='.')
 
 
 # ### 3.6.2 Descriptive Statistics
@@ -543,7 +371,7 @@ plt.savefig('replicate_deep_samples_2.svg', format='svg')
 # In[37]:
 
 
-deep_reps_two_df.groupby(['Instrument'])['O2µmol/L'].median()
+group_medians(deep_reps_two_df, by=['Instrument'])
 
 
 # ### 3.6.3 T-Test Comparison of Means
@@ -551,10 +379,9 @@ deep_reps_two_df.groupby(['Instrument'])['O2µmol/L'].median()
 # In[38]:
 
 
-# Subset by instrument into new dataframes just for simplicity in next cells
-deep_reps_two_newa = deep_reps_two_df.loc[deep_reps_two_df['Instrument'] == 'New A']
-deep_reps_two_newb = deep_reps_two_df.loc[deep_reps_two_df['Instrument'] == 'New B']
-deep_reps_two_old = deep_reps_two_df.loc[deep_reps_two_df['Instrument'] == 'Old']
+# Every instrument pair is tested in one go, rows are looked up by (instrument_a, instrument_b) in the next cells
+deep_reps_two_tests = pairwise_ttests(deep_reps_two_df, by=None, correction=None)
+deep_reps_two_tests = deep_reps_two_tests.set_index(['instrument_a', 'instrument_b'])
 
 
 # #### Compare New A to the Old instrument
@@ -562,9 +389,9 @@ deep_reps_two_old = deep_reps_two_df.loc[deep_reps_two_df['Instrument'] == 'Old'
 # In[39]:
 
 
-result = sci_st.ttest_ind(deep_reps_two_newa['O2µmol/L'], deep_reps_two_old['O2µmol/L'])
-print(f'Comparison of the New A instrument to Old, p-value: {result[1]}')
-if result[1] < 0.05:
+result = deep_reps_two_tests.loc[('New A', 'Old')]
+print(f'Comparison of the New A instrument to Old, p-value: {result["p_value"]}')
+if result['p_value'] < 0.05:
     print('Significance!')
 
 
@@ -573,9 +400,9 @@ if result[1] < 0.05:
 # In[40]:
 
 
-result = sci_st.ttest_ind(deep_reps_two_newb['O2µmol/L'], deep_reps_two_old['O2µmol/L'])
-print(f'Comparison of the New B instrument to Old, p-value: {result[1]}')
-if result[1] < 0.05:
+result = deep_reps_two_tests.loc[('New B', 'Old')]
+print(f'Comparison of the New B instrument to Old, p-value: {result["p_value"]}')
+if result['p_value'] < 0.05:
     print('Significance!')
 
 
@@ -584,9 +411,9 @@ if result[1] < 0.05:
 # In[48]:
 
 
-result = sci_st.ttest_ind(deep_reps_two_newa['O2µmol/L'], deep_reps_two_newb['O2µmol/L'])
-print(f'Comparison of the New A instrument to New B, p-value: {result[1]}')
-if result[1] < 0.05:
+result = deep_reps_two_tests.loc[('New A', 'New B')]
+print(f'Comparison of the New A instrument to New B, p-value: {result["p_value"]}')
+if result['p_value'] < 0.05:
     print('Significance!')
 
 
@@ -597,7 +424,7 @@ if result[1] < 0.05:
 # In[41]:
 
 
-combined_df = pd.read_csv(COMBINED_DATA)
+combined_df = read_dataset(COMBINED_DATA)
 
 
 # In[42]:
@@ -611,42 +438,44 @@ combined_df.head()
 # In[43]:
 
 
+# Stats for every Instrument + Experiment group are worked out once here and reused by 3.7.1 and 3.7.2
+combined_stats = describe_groups(combined_df, by=['Instrument', 'Experiment'])
+
 # Take out the profile experiment as it will skew the data, unless pressure is included as an additional "groupby"
-excl_profile = combined_df.loc[combined_df['Experiment'] != "Profile_Comp"]
-# Group by Instrument then Experiment type then show descriptive stats 
-excl_profile.groupby(['Instrument', 'Experiment'])['O2µmol/L'].describe()
+excl_profile_stats = combined_stats.drop('Profile_Comp', level='Experiment')
+# Grouped by Instrument then Experiment type, show descriptive stats 
+excl_profile_stats
 
 
 # In[44]:
 
 
 # Get final standard deviation 
-excl_profile.groupby(['Instrument', 'Experiment'])['O2µmol/L'].std().groupby(['Instrument']).mean()
+excl_profile_stats['std'].groupby(['Instrument']).mean()
 
 
-# ### 3.7.2 F-Test for Difference in Variances
+# ### 3.7.2 Variance Components and Tests for Equal Variances
 
 # In[45]:
 
 
-# Take out the profile experiment as it will skew the data, unless pressure is included as an additional "groupby"
-excl_profile = combined_df.loc[combined_df['Experiment'] != "Profile_Comp"]
-excl_atmosB = excl_profile.loc[excl_profile['Experiment'] != "Atmos_NewB"]
-
-# Group by Instrument then Experiment type then show descriptive stats 
-grouped_st_devs = excl_atmosB.groupby(['Instrument', 'Experiment'])['O2µmol/L'].std()
+# Without the profile or the one instrument atmospheric experiment
+replicate_df = combined_df.loc[~combined_df['Experiment'].isin(['Profile_Comp', 'Atmos_NewB'])]
 
 
 # In[46]:
 
 
-grouped_st_devs
+# Split each experiment's variance into instrument, Niskin (RP) and replicate parts from the individual samples,
+# rather than an F-test on the per-experiment standard deviations
+variance_components(replicate_df)
 
 
 # In[47]:
 
 
-sci_st.f_oneway(grouped_st_devs['New A'].values, grouped_st_devs['New B'].values, grouped_st_devs['Old'].values)
+# Levene's (Brown-Forsythe) and Bartlett's tests for equal variances across the instruments in each experiment
+homogeneity_tests(replicate_df)
 
 
 # In[ ]:
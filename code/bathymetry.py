@@ -0,0 +1,249 @@
+"""
+Windowed, tile cached reader for the GEBCO bathymetry grid
+
+The deployment map only needs a few degrees of the ~1.8 GB GEBCO NetCDF. GEBCO is a regular grid, so the row and
+column of any latitude/longitude can be worked out from the first coordinate and the spacing instead of reading
+and searching the full lat/lon arrays. BathymetryReader.window() reads just the block covering the map extent,
+widened to whole NetCDF chunks (a partly used chunk has to be decompressed in full anyway), and keeps it in the
+cache as a .npy tile. Any later extent that falls inside a cached tile is served from it as a memory mapped
+slice, without opening the NetCDF file at all.
+
+Cache layout:
+    <cache dir>/bathymetry/<hash>.npy      - elevation block, rows are latitude, columns longitude
+    <cache dir>/bathymetry/index.json      - source file, index window and grid spacing of every tile
+
+"""
+
+import hashlib
+import json
+import math
+import os
+import tempfile
+
+import numpy as np
+
+from data_access import cache_dir
+
+LAT_VARIABLE = 'lat'
+LON_VARIABLE = 'lon'
+ELEVATION_VARIABLE = 'elevation'
+
+# Relative tolerance on the coordinate spacing for an axis to be treated as regular
+REGULAR_TOLERANCE = 1e-6
+
+
+def tile_dir(root=None):
+    return os.path.join(root or cache_dir(), 'bathymetry')
+
+
+def extent_bounds(extent):
+    """(lon_min, lon_max, lat_min, lat_max) from a cartopy style [x0, x1, y0, y1] extent in any order"""
+    lon_a, lon_b, lat_a, lat_b = extent
+    return min(lon_a, lon_b), max(lon_a, lon_b), min(lat_a, lat_b), max(lat_a, lat_b)
+
+
+class GridAxis:
+    """
+    One coordinate axis of the grid.
+
+    Regular axes are described by their first value, spacing and size only. Irregular ones keep their values and
+    are searched with searchsorted.
+    """
+
+    def __init__(self, first, step, size, values=None):
+        self.first = first
+        self.step = step
+        self.size = size
+        self.values = values
+
+    @classmethod
+    def from_variable(cls, variable):
+        """Work out the axis from a NetCDF coordinate variable, reading 3 values when it is regular"""
+        size = len(variable)
+        if size < 3:
+            values = np.asarray(variable[:], dtype=np.float64)
+            return cls(float(values[0]), float(values[-1] - values[0]) / max(size - 1, 1), size)
+        first, second, last = float(variable[0]), float(variable[1]), float(variable[size - 1])
+        step = (last - first) / (size - 1)
+        if abs((second - first) - step) <= REGULAR_TOLERANCE * abs(step):
+            return cls(first, step, size)
+        values = np.asarray(variable[:], dtype=np.float64)
+        return cls(first, step, size, values)
+
+    def index_range(self, low, high):
+        """Slice bounds (start, stop) of the points covering low to high, one point of margin either side"""
+        if self.values is not None:
+            start = int(np.searchsorted(self.values, low, side='right')) - 1
+            stop = int(np.searchsorted(self.values, high, side='left')) + 1
+        else:
+            start = math.floor((low - self.first) / self.step)
+            stop = math.ceil((high - self.first) / self.step) + 1
+        return max(start, 0), min(stop, self.size)
+
+    def coordinates(self, start, stop):
+        if self.values is not None:
+            return self.values[start:stop]
+        return self.first + self.step * np.arange(start, stop, dtype=np.float64)
+
+    def to_dict(self):
+        return {'first': self.first, 'step': self.step, 'size': self.size,
+                'values': None if self.values is None else self.values.tolist()}
+
+    @classmethod
+    def from_dict(cls, entry):
+        values = None if entry['values'] is None else np.asarray(entry['values'])
+        return cls(entry['first'], entry['step'], entry['size'], values)
+
+
+def _align(start, stop, chunk, size):
+    return (start // chunk) * chunk, min(-(-stop // chunk) * chunk, size)
+
+
+def read_window(dataset, extent, elevation=ELEVATION_VARIABLE, lat=LAT_VARIABLE, lon=LON_VARIABLE,
+                align_chunks=True):
+    """
+    Read the block of an open NetCDF dataset covering extent.
+
+    Returns (lat_axis, lon_axis, (lat_start, lat_stop), (lon_start, lon_stop), elevation block). With align_chunks
+    the window is widened to whole chunks of the elevation variable.
+    """
+    lon_min, lon_max, lat_min, lat_max = extent_bounds(extent)
+    lat_axis = GridAxis.from_variable(dataset.variables[lat])
+    lon_axis = GridAxis.from_variable(dataset.variables[lon])
+    lat_range = lat_axis.index_range(lat_min, lat_max)
+    lon_range = lon_axis.index_range(lon_min, lon_max)
+
+    variable = dataset.variables[elevation]
+    chunking = variable.chunking() if align_chunks and hasattr(variable, 'chunking') else 'contiguous'
+    if chunking != 'contiguous':
+        lat_range = _align(*lat_range, chunking[0], lat_axis.size)
+        lon_range = _align(*lon_range, chunking[1], lon_axis.size)
+
+    if hasattr(variable, 'set_auto_mask'):
+        variable.set_auto_mask(False)
+    block = np.asarray(variable[lat_range[0]:lat_range[1], lon_range[0]:lon_range[1]])
+    return lat_axis, lon_axis, lat_range, lon_range, block
+
+
+def source_key(path):
+    """Identity of a bathymetry file for the tile cache, changes if the file is replaced"""
+    status = os.stat(path)
+    return f'{os.path.basename(path)}:{status.st_size}:{status.st_mtime_ns}'
+
+
+class BathymetryReader:
+    """
+    Elevation for a map extent from a GEBCO style NetCDF file, through a cache of memory mapped tiles.
+
+        lon, lat, height = BathymetryReader(GEBCO_PATH).window([146, 149, -45, -40])
+
+    lon and lat are 1D, height is (lat, lon) and read only when it comes from the cache.
+    """
+
+    def __init__(self, path, root=None, cache=True, elevation=ELEVATION_VARIABLE, lat=LAT_VARIABLE,
+                 lon=LON_VARIABLE):
+        self.path = path
+        self.root = tile_dir(root)
+        self.cache = cache
+        self.variables = (elevation, lat, lon)
+        self._source = None
+
+    @property
+    def source(self):
+        if self._source is None:
+            self._source = source_key(self.path)
+        return self._source
+
+    def _index_path(self):
+        return os.path.join(self.root, 'index.json')
+
+    def _read_index(self):
+        try:
+            with open(self._index_path(), 'r', encoding='utf-8') as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return []
+
+    def _write_index(self, index):
+        os.makedirs(self.root, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=self.root, suffix='.json')
+        with os.fdopen(fd, 'w', encoding='utf-8') as file:
+            json.dump(index, file)
+        os.replace(temp_path, self._index_path())
+
+    def _cached_window(self, extent):
+        lon_min, lon_max, lat_min, lat_max = extent_bounds(extent)
+        for entry in self._read_index():
+            if entry['source'] != self.source or entry['variables'] != list(self.variables):
+                continue
+            lat_axis, lon_axis = GridAxis.from_dict(entry['lat_axis']), GridAxis.from_dict(entry['lon_axis'])
+            lat_range = lat_axis.index_range(lat_min, lat_max)
+            lon_range = lon_axis.index_range(lon_min, lon_max)
+            (lat_start, lat_stop), (lon_start, lon_stop) = entry['lat'], entry['lon']
+            if lat_start <= lat_range[0] and lat_range[1] <= lat_stop and \
+                    lon_start <= lon_range[0] and lon_range[1] <= lon_stop:
+                path = os.path.join(self.root, entry['file'])
+                if not os.path.exists(path):
+                    continue
+                tile = np.load(path, mmap_mode='r')
+                height = tile[lat_range[0] - lat_start:lat_range[1] - lat_start,
+                              lon_range[0] - lon_start:lon_range[1] - lon_start]
+                return lon_axis.coordinates(*lon_range), lat_axis.coordinates(*lat_range), height
+        return None
+
+    def _store_tile(self, lat_axis, lon_axis, lat_range, lon_range, block):
+        key = json.dumps([self.source, self.variables, lat_range, lon_range])
+        file_name = hashlib.sha256(key.encode('utf-8')).hexdigest()[:32] + '.npy'
+        os.makedirs(self.root, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=self.root, suffix='.npy')
+        with os.fdopen(fd, 'wb') as file:
+            np.save(file, block)
+        os.replace(temp_path, os.path.join(self.root, file_name))
+
+        index = [entry for entry in self._read_index() if entry['file'] != file_name]
+        index.append({'file': file_name, 'source': self.source, 'variables': list(self.variables),
+                      'lat': list(lat_range), 'lon': list(lon_range),
+                      'lat_axis': lat_axis.to_dict(), 'lon_axis': lon_axis.to_dict()})
+        self._write_index(index)
+
+    def read(self, extent):
+        """Read the chunk aligned window straight from the NetCDF file, see read_window()"""
+        from netCDF4 import Dataset
+
+        elevation, lat, lon = self.variables
+        with Dataset(self.path) as dataset:
+            lat_axis, lon_axis, lat_range, lon_range, block = read_window(dataset, extent, elevation, lat, lon)
+        return lat_axis, lon_axis, lat_range, lon_range, block
+
+    def window(self, extent):
+        """Longitudes, latitudes and elevation (lat x lon) covering extent"""
+        if self.cache:
+            cached = self._cached_window(extent)
+            if cached is not None:
+                return cached
+
+        lat_axis, lon_axis, tile_lat, tile_lon, block = self.read(extent)
+        if self.cache:
+            self._store_tile(lat_axis, lon_axis, tile_lat, tile_lon, block)
+
+        # Crop the chunk aligned block back to the extent asked for
+        lon_min, lon_max, lat_min, lat_max = extent_bounds(extent)
+        lat_range = lat_axis.index_range(lat_min, lat_max)
+        lon_range = lon_axis.index_range(lon_min, lon_max)
+        height = block[lat_range[0] - tile_lat[0]:lat_range[1] - tile_lat[0],
+                       lon_range[0] - tile_lon[0]:lon_range[1] - tile_lon[0]]
+        return lon_axis.coordinates(*lon_range), lat_axis.coordinates(*lat_range), height
+
+    def clear(self):
+        """Remove every cached tile of this file"""
+        index = self._read_index()
+        kept = []
+        for entry in index:
+            if entry['source'] == self.source:
+                try:
+                    os.remove(os.path.join(self.root, entry['file']))
+                except FileNotFoundError:
+                    pass
+            else:
+                kept.append(entry)
+        self._write_index(kept)
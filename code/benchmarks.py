@@ -0,0 +1,365 @@
+"""
+Benchmarks for the DO commissioning pipeline
+
+Times each stage (CSV and store loading, grouped statistics, pairwise tests, saturation QC, figure rendering
+and the deployment map) on synthetic titration data from synthetic_data.py at a range of sizes, and appends
+every result as a JSON line to a history file so a slow down shows up against earlier runs:
+
+    python benchmarks.py --sizes 1000 100000 1000000
+    python benchmarks.py --only describe_groups ttests --repeat 5
+    python benchmarks.py --report                  compare the latest run against the one before it
+
+Each record holds the benchmark name, number of rows, best and median time of the repeats (or why it was
+skipped or failed), plus the git commit, python/library versions and host it ran on.
+
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+CODE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_HISTORY = os.path.join(CODE_DIR, os.pardir, 'benchmarks', 'history.jsonl')
+DEFAULT_SIZES = (1_000, 10_000, 100_000)
+DEFAULT_REPEAT = 3
+
+# Libraries whose version is recorded with each result
+RECORDED_LIBRARIES = ('numpy', 'pandas', 'scipy', 'matplotlib', 'seaborn', 'pyarrow', 'seawater')
+
+# A benchmark this much slower than the previous run of the same name and size is reported as a regression
+REGRESSION_RATIO = 1.25
+
+# Rendering a figure doesn't get more informative past this many points, larger sizes are subsampled
+FIGURE_ROWS = 20_000
+
+
+class SkipBenchmark(Exception):
+    """Raised by a benchmark's setup when it can't run here, e.g. an optional library isn't installed"""
+
+
+def _time_call(func, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return times
+
+
+""" Benchmarks. Each setup function takes (df, work_dir) and returns the zero argument callable to time """
+
+
+def _setup_read_csv(df, work_dir):
+    import pandas as pd
+
+    path = os.path.join(work_dir, 'titrations.csv')
+    if not os.path.exists(path):
+        df.to_csv(path, index=False, encoding='utf-8-sig')
+    return lambda: pd.read_csv(path, encoding='utf-8-sig')
+
+
+def _setup_read_typed_csv(df, work_dir):
+    from titration_store import read_titration_csv
+
+    path = os.path.join(work_dir, 'titrations.csv')
+    if not os.path.exists(path):
+        df.to_csv(path, index=False, encoding='utf-8-sig')
+    return lambda: read_titration_csv(path)
+
+
+def _store_for(df, work_dir):
+    from titration_store import apply_schema, store_path, write_store
+
+    path = store_path(work_dir, 'titrations')
+    if not os.path.exists(path):
+        write_store(apply_schema(df), path)
+    return path
+
+
+def _setup_read_store(df, work_dir):
+    from titration_store import read_store
+
+    path = _store_for(df, work_dir)
+    return lambda: read_store(path)
+
+
+def _setup_read_store_filtered(df, work_dir):
+    from titration_store import read_store
+
+    path = _store_for(df, work_dir)
+    return lambda: read_store(path, columns=['Instrument', 'O2µmol/L'],
+                              filters=[('Experiment', 'in', ['Atmos_All', 'Atmos_NewB'])])
+
+
+def _setup_pandas_describe(df, work_dir):
+    return lambda: df.groupby(['Experiment', 'Instrument'], observed=True)['O2µmol/L'].describe()
+
+
+def _setup_describe_groups(df, work_dir):
+    from group_stats import describe_groups
+
+    return lambda: describe_groups(df)
+
+
+def _setup_group_summary(df, work_dir):
+    from group_stats import GroupSummary
+
+    return lambda: GroupSummary.from_frame(df).describe()
+
+
+def _setup_ttests(df, work_dir):
+    from pairwise_tests import pairwise_ttests
+
+    return lambda: pairwise_ttests(df)
+
+
+def _setup_saturation_qc(df, work_dir):
+    from saturation_qc import saturation_qc
+
+    return lambda: saturation_qc(df)
+
+
+def _setup_rolling_drift(df, work_dir):
+    from instrument_drift import rolling_drift
+
+    return lambda: rolling_drift(df)
+
+
+def _setup_resample(df, work_dir):
+    from resampling import resample_pairs
+
+    return lambda: resample_pairs(df, n_resamples=200)
+
+
+def _setup_variance_components(df, work_dir):
+    from variance_components import variance_components
+
+    return lambda: variance_components(df)
+
+
+def _setup_recompute(df, work_dir):
+    from titration_calc import fit_calibration, recompute
+
+    calibration = fit_calibration(df)
+    return lambda: recompute(df, calibration)
+
+
+def _setup_figure(df, work_dir):
+    from figures import FIGURE_SPECS, build_figure
+
+    spec = FIGURE_SPECS['atmospheric_diff_instruments_with_bars']
+    subset = df.loc[df['Experiment'] == spec.experiment]
+    if len(subset) > FIGURE_ROWS:
+        subset = subset.sample(FIGURE_ROWS, random_state=0)
+    out_dir = os.path.join(work_dir, 'plots')
+    return lambda: build_figure(spec, subset, out_dir=out_dir)
+
+
+def _setup_map(df, work_dir):
+    from importlib.util import find_spec
+
+    missing = [name for name in ('cartopy', 'shapely') if find_spec(name) is None]
+    if missing:
+        raise SkipBenchmark(f'{", ".join(missing)} not installed')
+    from deployment_maps import STATIONS_FILE, load_voyages, render_voyages
+
+    # GEBCO and the coastline come from DO_COMMISSIONING_GEBCO / DO_COMMISSIONING_COASTLINE when they are set
+    voyages = load_voyages([STATIONS_FILE])
+    return lambda: render_voyages(voyages, os.path.join(work_dir, 'maps'), processes=1)
+
+
+# Name -> setup. The map doesn't depend on the number of rows so it is only run once per invocation
+BENCHMARKS = {
+    'read_csv': _setup_read_csv,
+    'read_typed_csv': _setup_read_typed_csv,
+    'read_store': _setup_read_store,
+    'read_store_filtered': _setup_read_store_filtered,
+    'pandas_describe': _setup_pandas_describe,
+    'describe_groups': _setup_describe_groups,
+    'group_summary': _setup_group_summary,
+    'ttests': _setup_ttests,
+    'saturation_qc': _setup_saturation_qc,
+    'rolling_drift': _setup_rolling_drift,
+    'resample': _setup_resample,
+    'variance_components': _setup_variance_components,
+    'recompute': _setup_recompute,
+    'figure': _setup_figure,
+}
+SIZE_INDEPENDENT = {
+    'map': _setup_map,
+}
+
+
+""" Environment recorded with the results """
+
+
+def git_commit():
+    try:
+        result = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=CODE_DIR, capture_output=True,
+                                text=True, timeout=10)
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return result.stdout.strip() or None
+
+
+def environment():
+    from importlib import metadata
+
+    versions = {}
+    for library in RECORDED_LIBRARIES:
+        try:
+            versions[library] = metadata.version(library)
+        except metadata.PackageNotFoundError:
+            versions[library] = None
+    return {
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'host': platform.node(),
+        'machine': platform.machine(),
+        'libraries': versions,
+    }
+
+
+""" Running and recording """
+
+
+def run_benchmarks(sizes=DEFAULT_SIZES, names=None, repeat=DEFAULT_REPEAT, seed=0, include_map=True):
+    """Run the benchmarks at each size, yielding one record per benchmark and size as it finishes"""
+    from synthetic_data import generate_titrations
+
+    env = environment()
+    started = datetime.now(timezone.utc).isoformat(timespec='seconds')
+    selected = {name: setup for name, setup in BENCHMARKS.items() if names is None or name in names}
+
+    def measure(name, setup, rows, df, work_dir):
+        record = dict(env, run=started, benchmark=name, rows=rows, repeat=repeat)
+        try:
+            func = setup(df, work_dir)
+            times = _time_call(func, repeat)
+        except SkipBenchmark as reason:
+            record['skipped'] = str(reason)
+        except Exception as error:
+            # Recorded rather than raised, so one broken stage doesn't lose the timings of the rest of the run
+            record['failed'] = f'{type(error).__name__}: {error}'
+        else:
+            record.update(best=min(times), median=statistics.median(times))
+        return record
+
+    work_dir = tempfile.mkdtemp(prefix='do_bench_')
+    try:
+        for rows in sizes:
+            df = generate_titrations(rows, seed=seed)
+            size_dir = os.path.join(work_dir, str(rows))
+            os.makedirs(size_dir)
+            for name, setup in selected.items():
+                yield measure(name, setup, rows, df, size_dir)
+        if include_map:
+            for name, setup in SIZE_INDEPENDENT.items():
+                if names is None or name in names:
+                    yield measure(name, setup, None, None, work_dir)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def append_history(records, path=DEFAULT_HISTORY):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'a', encoding='utf-8') as file:
+        for record in records:
+            file.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+
+def read_history(path=DEFAULT_HISTORY):
+    if not os.path.exists(path):
+        return []
+    with open(path, 'r', encoding='utf-8') as file:
+        return [json.loads(line) for line in file if line.strip()]
+
+
+def compare_runs(history, threshold=REGRESSION_RATIO):
+    """
+    Compare the latest run in the history against the run before it.
+
+    Returns a list of dicts (benchmark, rows, previous, latest, ratio, regression) for every benchmark and size
+    that was timed in both runs.
+    """
+    runs = sorted({record['run'] for record in history})
+    if len(runs) < 2:
+        return []
+    previous_run, latest_run = runs[-2:]
+
+    def best_times(run):
+        return {(record['benchmark'], record['rows']): record['best']
+                for record in history if record['run'] == run and 'best' in record}
+
+    previous, latest = best_times(previous_run), best_times(latest_run)
+    comparison = []
+    for key in latest:
+        if key in previous and previous[key] > 0:
+            ratio = latest[key] / previous[key]
+            comparison.append({'benchmark': key[0], 'rows': key[1], 'previous': previous[key],
+                               'latest': latest[key], 'ratio': ratio, 'regression': ratio > threshold})
+    return comparison
+
+
+def format_record(record):
+    rows = '-' if record['rows'] is None else f'{record["rows"]:,}'
+    if 'skipped' in record:
+        return f'{record["benchmark"]:<22}{rows:>12}  skipped: {record["skipped"]}'
+    if 'failed' in record:
+        return f'{record["benchmark"]:<22}{rows:>12}  FAILED: {record["failed"]}'
+    return f'{record["benchmark"]:<22}{rows:>12}  best {record["best"]:9.4f}s  median {record["median"]:9.4f}s'
+
+
+def format_comparison(comparison):
+    lines = []
+    for entry in comparison:
+        rows = '-' if entry['rows'] is None else f'{entry["rows"]:,}'
+        flag = '  REGRESSION' if entry['regression'] else ''
+        lines.append(f'{entry["benchmark"]:<22}{rows:>12}  {entry["previous"]:9.4f}s -> {entry["latest"]:9.4f}s '
+                     f'({entry["ratio"]:.2f}x){flag}')
+    regressions = sum(entry['regression'] for entry in comparison)
+    lines.append(f'{len(comparison)} compared, {regressions} slower than {REGRESSION_RATIO}x the previous run')
+    return '\n'.join(lines)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description='Benchmark the DO commissioning pipeline on synthetic data')
+    parser.add_argument('--sizes', nargs='+', type=int, default=list(DEFAULT_SIZES), help='numbers of rows')
+    parser.add_argument('--only', nargs='+', choices=list(BENCHMARKS) + list(SIZE_INDEPENDENT))
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--no-map', action='store_true', help='skip the deployment map benchmark')
+    parser.add_argument('--history', default=DEFAULT_HISTORY, help='JSON lines file the results are appended to')
+    parser.add_argument('--no-save', action='store_true', help="don't append the results to the history")
+    parser.add_argument('--report', action='store_true', help='only compare the last two runs in the history')
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    failed = False
+    if not args.report:
+        records = []
+        for record in run_benchmarks(args.sizes, args.only, args.repeat, args.seed, include_map=not args.no_map):
+            print(format_record(record), flush=True)
+            records.append(record)
+        failed = any('failed' in record for record in records)
+        if args.no_save:
+            return 1 if failed else 0
+        append_history(records, args.history)
+    comparison = compare_runs(read_history(args.history))
+    if comparison:
+        print(format_comparison(comparison))
+    return 1 if failed or any(entry['regression'] for entry in comparison) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,104 @@
+"""
+Make style build cache for the rendered figures
+
+Keeps a manifest next to the outputs recording, for each figure, a hash of the input rows it was drawn from, a
+hash of its spec/plot parameters and the versions of the plotting libraries (plus the plotting code itself).
+On the next build a figure is only re-rendered when one of those has changed or the file has gone missing,
+and the reason is reported, e.g.
+
+    replicate_deep_samples_2.svg: input data changed
+
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+from dataclasses import asdict, is_dataclass
+
+MANIFEST_NAME = '.build_manifest.json'
+
+# Libraries whose version changes the rendered output
+TRACKED_LIBRARIES = ('matplotlib', 'seaborn', 'pandas', 'numpy')
+
+# Component name -> reason reported when its hash changes
+REASONS = {
+    'data': 'input data changed',
+    'spec': 'plot parameters changed',
+    'versions': 'library or plotting code changed',
+}
+
+
+def _sha256(content):
+    return hashlib.sha256(content).hexdigest()
+
+
+def data_signature(df, columns=None):
+    """Hash of the rows (and only the columns) a figure is drawn from, independent of the frame's index"""
+    import pandas as pd
+
+    subset = df if columns is None else df[list(columns)]
+    row_hashes = pd.util.hash_pandas_object(subset, index=False).to_numpy()
+    return _sha256(row_hashes.tobytes() + json.dumps(list(subset.columns)).encode('utf-8'))
+
+
+def params_signature(*params):
+    """Hash of plot parameters, dataclass specs are hashed by their fields"""
+    normalised = [asdict(param) if is_dataclass(param) else param for param in params]
+    return _sha256(json.dumps(normalised, sort_keys=True, default=str).encode('utf-8'))
+
+
+def versions_signature(source_files=()):
+    """Hash of the tracked library versions and the contents of the given source files"""
+    from importlib import metadata
+
+    parts = []
+    for library in TRACKED_LIBRARIES:
+        try:
+            parts.append(f'{library}=={metadata.version(library)}')
+        except metadata.PackageNotFoundError:
+            parts.append(f'{library}==none')
+    for path in source_files:
+        with open(path, 'rb') as file:
+            parts.append(_sha256(file.read()))
+    return _sha256('\n'.join(parts).encode('utf-8'))
+
+
+class BuildCache:
+    """Manifest of what every output in a folder was last built from"""
+
+    def __init__(self, out_dir):
+        self.out_dir = out_dir
+        self.path = os.path.join(out_dir, MANIFEST_NAME)
+        try:
+            with open(self.path, 'r', encoding='utf-8') as file:
+                self.entries = json.load(file)
+        except (OSError, ValueError):
+            self.entries = {}
+
+    def reasons_to_build(self, output, signature):
+        """Why output needs building (empty list when it is up to date). signature is {component: hash}"""
+        if not os.path.exists(os.path.join(self.out_dir, output)):
+            return ['new output' if output not in self.entries else 'output missing']
+        recorded = self.entries.get(output)
+        if recorded is None:
+            return ['not in build manifest']
+        return [REASONS.get(component, f'{component} changed')
+                for component, value in signature.items() if recorded.get(component) != value]
+
+    def record(self, output, signature):
+        self.entries[output] = dict(signature)
+
+    def save(self):
+        os.makedirs(self.out_dir, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=self.out_dir, suffix='.json')
+        with os.fdopen(fd, 'w', encoding='utf-8') as file:
+            json.dump(self.entries, file, indent=2, sort_keys=True)
+        os.replace(temp_path, self.path)
+
+
+def format_report(rebuilt, skipped):
+    """One line per rebuilt output with the reasons, followed by a count of what was skipped"""
+    lines = [f'{output}: {", ".join(reasons)}' for output, reasons in rebuilt.items()]
+    lines.append(f'{len(rebuilt)} rebuilt, {len(skipped)} up to date')
+    return '\n'.join(lines)
@@ -0,0 +1,110 @@
+"""
+Extent clipped, simplified coastline layer for the maps
+
+The high resolution Australia shapefile used to be added to the map one record at a time, every vertex of the
+whole continent included, even though only a few degrees of Tasmania are visible. Here the shapefile's
+geometries are loaded once per process into an STR-tree, and for a map only the geometries intersecting the
+extent are taken, clipped to it, simplified to half an output pixel and returned ready to go on the axes as a
+single collection. The clipped result is cached on disk keyed by (shapefile, extent, output size), so the next
+map of the same region doesn't read the shapefile at all.
+
+    add_coastline(ax, SHAPEFILE, extent, pixels=axes_pixels(ax), facecolor='#c4c8ce', edgecolor='black', lw=0.5)
+
+Cache layout:
+    <cache dir>/coastline/<hash>.wkb   - the clipped geometries as a WKB geometry collection
+
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+from functools import lru_cache
+
+from bathymetry import extent_bounds, source_key
+from data_access import cache_dir
+from isobaths import DEFAULT_PIXELS
+
+# Fraction of an output pixel the simplified coastline is allowed to move by
+SIMPLIFY_PIXELS = 0.5
+
+
+def coastline_dir(root=None):
+    return os.path.join(root or cache_dir(), 'coastline')
+
+
+def simplify_tolerance(extent, pixels, fraction=SIMPLIFY_PIXELS):
+    """Size of fraction of an output pixel in map units (degrees), along whichever axis has the larger pixels"""
+    lon_min, lon_max, lat_min, lat_max = extent_bounds(extent)
+    width, height = pixels
+    return fraction * max((lon_max - lon_min) / width, (lat_max - lat_min) / height)
+
+
+@lru_cache(maxsize=4)
+def coastline_index(path):
+    """(geometries, STRtree over them) for a shapefile, built once per process"""
+    from cartopy.io import shapereader
+    from shapely import STRtree
+
+    geometries = [geometry for geometry in shapereader.Reader(path).geometries() if geometry is not None]
+    return geometries, STRtree(geometries)
+
+
+def clip_coastline(path, extent, tolerance):
+    """The shapefile's geometries that show in extent, clipped to it and simplified to tolerance"""
+    import shapely
+
+    lon_min, lon_max, lat_min, lat_max = extent_bounds(extent)
+    # Clip a little outside the extent so the clipped edges are never drawn inside the map
+    bounds = (lon_min - tolerance, lat_min - tolerance, lon_max + tolerance, lat_max + tolerance)
+    geometries, tree = coastline_index(path)
+    candidates = [geometries[index] for index in tree.query(shapely.box(*bounds))]
+    clipped = shapely.clip_by_rect(candidates, *bounds)
+    simplified = shapely.simplify(clipped, tolerance, preserve_topology=True)
+
+    kept = []
+    for geometry in simplified:
+        if geometry.is_empty:
+            continue
+        # Islands smaller than the tolerance would be drawn as a dot at best
+        x_min, y_min, x_max, y_max = geometry.bounds
+        if max(x_max - x_min, y_max - y_min) < tolerance:
+            continue
+        kept.append(geometry)
+    return kept
+
+
+def cache_key(source, extent, pixels):
+    content = json.dumps([source, [float(value) for value in extent], list(pixels)])
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()[:32]
+
+
+def coastline_geometries(path, extent, pixels=DEFAULT_PIXELS, root=None, cache=True):
+    """Clipped, simplified coastline geometries for extent, from the cache when this region was drawn before"""
+    import shapely
+
+    cached_path = os.path.join(coastline_dir(root), cache_key(source_key(path), extent, pixels) + '.wkb')
+    if cache and os.path.exists(cached_path):
+        with open(cached_path, 'rb') as file:
+            return list(shapely.from_wkb(file.read()).geoms)
+
+    geometries = clip_coastline(path, extent, simplify_tolerance(extent, pixels))
+    if cache:
+        os.makedirs(os.path.dirname(cached_path), exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(cached_path), suffix='.wkb')
+        with os.fdopen(fd, 'wb') as file:
+            file.write(shapely.to_wkb(shapely.GeometryCollection(geometries)))
+        os.replace(temp_path, cached_path)
+    return geometries
+
+
+def add_coastline(ax, path, extent, pixels=DEFAULT_PIXELS, crs=None, root=None, cache=True, **style):
+    """Add the coastline of extent to a cartopy GeoAxes as one collection, style is passed to add_geometries"""
+    if crs is None:
+        import cartopy.crs as ccrs
+
+        crs = ccrs.PlateCarree()
+    geometries = coastline_geometries(path, extent, pixels, root=root, cache=cache)
+    if not geometries:
+        return None
+    return ax.add_geometries(geometries, crs, **style)
@@ -0,0 +1,293 @@
+"""
+Control charts for the repeated standards
+
+The atmospheric saturation samples and the independent iodate standards are run again and again through a
+voyage, but DO_Commissioning.py only draws the fixed ±1% / ±1 µM lines once on a boxplot. ControlCharts keeps a
+running chart for every (standard, instrument) and updates it one standard at a time, so a new result mid-voyage
+costs the same however long the history is:
+
+    - Shewhart: a point more than 3 sigma from the centre line
+    - EWMA: exponentially weighted moving average beyond its (time varying) limits
+    - CUSUM: tabular upper and lower cumulative sums beyond h sigma
+    - Run rules: 2 of 3 beyond 2 sigma, 4 of 5 beyond 1 sigma, 9 in a row one side, 6 in a row trending
+
+The centre line and sigma either come from the first BASELINE standards an instrument runs (sigma never less
+than MIN_SIGMA), or are given up front. Everything a chart needs (its counts, the EWMA, the CUSUM sums, run
+counters and the last few z scores) is a handful of numbers which are saved to a JSON file between sessions:
+
+    charts = ControlCharts.load()
+    alarms = charts.update(new_rows, 'atmospheric', source='atmospheric_diff_instruments.csv')
+    charts.save()
+
+"""
+
+import json
+import math
+import os
+import tempfile
+from dataclasses import asdict, dataclass, field
+
+import numpy as np
+import pandas as pd
+
+from data_access import cache_dir
+
+VALUE_COLUMN = 'O2µmol/L'
+INSTRUMENT_COLUMN = 'Instrument'
+STANDARDS = ('atmospheric', 'iodate')
+
+# Number of standards an instrument runs to set its centre line and sigma, when they aren't given
+BASELINE = 8
+
+SHEWHART_LIMIT = 3.0
+EWMA_LAMBDA = 0.2
+EWMA_LIMIT = 3.0
+# CUSUM reference value and decision interval, in sigma
+CUSUM_K = 0.5
+CUSUM_H = 5.0
+RUN_LENGTH = 9
+TREND_LENGTH = 6
+
+# Smallest sigma (µmol/L) a baseline is given. O2ml/L is reported to 3 decimal places (~0.045 µmol/L), a baseline
+# of identical values would otherwise have a sigma of 0 and never start charting
+MIN_SIGMA = 0.01
+
+# Z scores kept for the 2 of 3 and 4 of 5 rules
+RECENT_LENGTH = 5
+
+ALARM_COLUMNS = ['standard', 'Instrument', 'sample', 'row', 'value', 'z', 'rule']
+
+# Columns identifying a titration, so a standard is only charted once however its file gets rewritten
+ROW_KEY_COLUMNS = ['Instrument', 'Bottle', 'TitreTime']
+
+
+def default_state_path():
+    return os.path.join(cache_dir(), 'control_charts.json')
+
+
+def standard_values(df, standard):
+    """
+    The value charted for each row.
+
+    iodate charts the O2µmol/L of the standard itself. atmospheric charts the deviation from the saturation at
+    each sample's own DrawTemp (see saturation_qc), so samples drawn at different lab temperatures are comparable.
+    """
+    if standard == 'iodate':
+        return df[VALUE_COLUMN].to_numpy(dtype=np.float64)
+    if standard == 'atmospheric':
+        from saturation_qc import saturation_qc
+
+        return saturation_qc(df)['deviation'].to_numpy()
+    raise ValueError(f'Unknown standard {standard!r}, expected one of {", ".join(STANDARDS)}')
+
+
+def row_keys(df, first_row=0):
+    """
+    Key of each row of df: its instrument, bottle and titration time, or its row number in the source counting
+    from first_row when df doesn't have those columns.
+    """
+    if not all(column in df for column in ROW_KEY_COLUMNS):
+        return np.array([f'row {row}' for row in range(first_row, first_row + len(df))], dtype=object)
+    keys = df[INSTRUMENT_COLUMN].astype(str)
+    for column in ROW_KEY_COLUMNS[1:]:
+        # Through Float64 so an int16 Bottle from the store and a float Bottle from a CSV with blanks agree
+        keys = keys + '/' + pd.to_numeric(df[column], errors='coerce').astype('Float64').astype(str)
+    return keys.to_numpy(dtype=object)
+
+
+def _sign(value):
+    return (value > 0) - (value < 0)
+
+
+@dataclass
+class ChartState:
+    """Running state of one instrument's chart of one standard"""
+
+    centre: float = math.nan
+    sigma: float = math.nan
+    fixed: bool = False
+    # Welford count, mean and sum of squared deviations of the baseline standards
+    baseline_n: int = 0
+    baseline_mean: float = 0.0
+    baseline_m2: float = 0.0
+    n: int = 0
+    ewma: float = 0.0
+    cusum_high: float = 0.0
+    cusum_low: float = 0.0
+    side: int = 0
+    side_run: int = 0
+    last_value: float = math.nan
+    direction: int = 0
+    trend_run: int = 0
+    recent: list = field(default_factory=list)
+
+    @property
+    def charting(self):
+        return self.sigma > 0
+
+    def _add_baseline(self, value, baseline):
+        self.baseline_n += 1
+        delta = value - self.baseline_mean
+        self.baseline_mean += delta / self.baseline_n
+        self.baseline_m2 += delta * (value - self.baseline_mean)
+        if self.baseline_n >= baseline:
+            self.centre = self.baseline_mean
+            self.sigma = max(math.sqrt(self.baseline_m2 / (self.baseline_n - 1)), MIN_SIGMA)
+
+    def update(self, value, baseline=BASELINE):
+        """
+        Add the next standard. Returns (z, ewma, cusum_high, cusum_low, rules broken), z and the rest are NaN
+        while the baseline is still being collected.
+        """
+        if not self.charting:
+            self._add_baseline(value, baseline)
+            return math.nan, math.nan, math.nan, math.nan, []
+
+        z = (value - self.centre) / self.sigma
+        self.n += 1
+        rules = []
+        if abs(z) > SHEWHART_LIMIT:
+            rules.append(f'beyond {SHEWHART_LIMIT:g} sigma')
+
+        self.ewma = EWMA_LAMBDA * z + (1 - EWMA_LAMBDA) * self.ewma
+        ewma_limit = EWMA_LIMIT * math.sqrt(EWMA_LAMBDA / (2 - EWMA_LAMBDA) * (1 - (1 - EWMA_LAMBDA) ** (2 * self.n)))
+        if abs(self.ewma) > ewma_limit:
+            rules.append('ewma')
+
+        self.cusum_high = max(0.0, self.cusum_high + z - CUSUM_K)
+        self.cusum_low = max(0.0, self.cusum_low - z - CUSUM_K)
+        cusums = self.cusum_high, self.cusum_low
+        if self.cusum_high > CUSUM_H:
+            rules.append('cusum high')
+            self.cusum_high = 0.0
+        if self.cusum_low > CUSUM_H:
+            rules.append('cusum low')
+            self.cusum_low = 0.0
+
+        side = _sign(z)
+        self.side_run = self.side_run + 1 if side and side == self.side else int(side != 0)
+        self.side = side
+        if self.side_run >= RUN_LENGTH:
+            rules.append(f'{RUN_LENGTH} in a row one side')
+
+        direction = _sign(value - self.last_value) if not math.isnan(self.last_value) else 0
+        self.trend_run = self.trend_run + 1 if direction and direction == self.direction else int(direction != 0)
+        self.direction = direction
+        self.last_value = value
+        # trend_run counts the steps, there is one more point than steps
+        if self.trend_run >= TREND_LENGTH - 1:
+            rules.append(f'{TREND_LENGTH} in a row trending')
+
+        self.recent = (self.recent + [z])[-RECENT_LENGTH:]
+        for count, of, limit in ((2, 3, 2.0), (4, 5, 1.0)):
+            window = self.recent[-of:]
+            if abs(z) > limit and sum(1 for value in window if value * side > limit) >= count:
+                rules.append(f'{count} of {of} beyond {limit:g} sigma')
+        return z, self.ewma, cusums[0], cusums[1], rules
+
+
+class ControlCharts:
+    """Control charts for every (standard, instrument), with their state saved between sessions"""
+
+    def __init__(self, path=None, baseline=BASELINE):
+        if baseline < 2:
+            raise ValueError(f'baseline has to be at least 2 standards to give a sigma, got {baseline}')
+        self.path = path or default_state_path()
+        self.baseline = baseline
+        self.charts = {}
+        # Keys (see row_keys) of the rows already charted from each source file, so rerunning on a file that has
+        # grown, or been rewritten with its old rows plus new ones, only adds the new rows
+        self.sources = {}
+        # Alarms raised by the last update
+        self.alarms = pd.DataFrame(columns=ALARM_COLUMNS)
+
+    def chart(self, standard, instrument):
+        key = (standard, str(instrument))
+        if key not in self.charts:
+            self.charts[key] = ChartState()
+        return self.charts[key]
+
+    def set_limits(self, standard, instrument, centre, sigma):
+        """Fix an instrument's centre line and sigma rather than taking them from its first standards"""
+        if not sigma > 0:
+            raise ValueError(f'sigma has to be positive, got {sigma}')
+        chart = self.chart(standard, instrument)
+        chart.centre, chart.sigma, chart.fixed = float(centre), float(sigma), True
+
+    def update(self, df, standard, source=None, first_row=0):
+        """
+        Chart new standards, in the order of the rows of df.
+
+        With a source name, rows already charted from that source are skipped. They are recognised by their
+        instrument, bottle and titration time, or by row number when df doesn't have those columns (first_row is
+        then the row number in the source of df's first row, when df is only the end of the file). Returns a frame
+        on the charted rows' index with the value, z, EWMA and CUSUM sums (before any reset) plus the rules
+        broken, and keeps the alarms of this update in self.alarms.
+        """
+        if source is not None:
+            keys = row_keys(df, first_row)
+            seen = self.sources.setdefault(source, set())
+            new = ~pd.Index(keys).isin(seen) & ~pd.Index(keys).duplicated()
+            seen.update(keys[new])
+            df = df.loc[new]
+        values = standard_values(df, standard)
+        instruments = df[INSTRUMENT_COLUMN].astype(str).to_numpy()
+
+        rows = []
+        alarms = []
+        for label, instrument, value in zip(df.index, instruments, values):
+            if math.isnan(value):
+                rows.append((value, math.nan, math.nan, math.nan, math.nan, ''))
+                continue
+            chart = self.chart(standard, instrument)
+            z, ewma, cusum_high, cusum_low, rules = chart.update(float(value), self.baseline)
+            rows.append((value, z, ewma, cusum_high, cusum_low, ', '.join(rules)))
+            alarms.extend((standard, instrument, chart.n, label, value, z, rule) for rule in rules)
+
+        self.alarms = pd.DataFrame(alarms, columns=ALARM_COLUMNS)
+        return pd.DataFrame(rows, index=df.index, columns=['value', 'z', 'ewma', 'cusum high', 'cusum low', 'alarms'])
+
+    def limits(self):
+        """Centre line, sigma and progress of every chart"""
+        rows = [{'standard': standard, 'Instrument': instrument, 'centre': chart.centre, 'sigma': chart.sigma,
+                 'fixed': chart.fixed, 'baseline': chart.baseline_n, 'charted': chart.n}
+                for (standard, instrument), chart in sorted(self.charts.items())]
+        return pd.DataFrame(rows, columns=['standard', 'Instrument', 'centre', 'sigma', 'fixed', 'baseline',
+                                           'charted'])
+
+    def to_dict(self):
+        return {
+            'baseline': self.baseline,
+            'sources': {source: sorted(keys) for source, keys in self.sources.items()},
+            'charts': [{'standard': standard, 'instrument': instrument, **asdict(chart)}
+                       for (standard, instrument), chart in sorted(self.charts.items())],
+        }
+
+    @classmethod
+    def from_dict(cls, state, path=None):
+        charts = cls(path, baseline=state['baseline'])
+        charts.sources = {source: set(keys) for source, keys in state['sources'].items()}
+        for entry in state['charts']:
+            entry = dict(entry)
+            key = (entry.pop('standard'), entry.pop('instrument'))
+            charts.charts[key] = ChartState(**entry)
+        return charts
+
+    def save(self, path=None):
+        # Write to a temp file then move it over, a run killed part way through keeps the previous state
+        path = path or self.path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix='.json')
+        with os.fdopen(fd, 'w') as file:
+            json.dump(self.to_dict(), file, indent=2)
+        os.replace(temp_path, path)
+        return path
+
+    @classmethod
+    def load(cls, path=None, baseline=BASELINE):
+        """Saved charts, or new empty ones if nothing has been saved yet"""
+        path = path or default_state_path()
+        if not os.path.exists(path):
+            return cls(path, baseline)
+        with open(path) as file:
+            return cls.from_dict(json.load(file), path)
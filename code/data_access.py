@@ -0,0 +1,228 @@
+"""
+Data access layer for the DO commissioning datasets
+
+Resolves the raw.githubusercontent URLs used by DO_Commissioning.py to a local, content addressed cache so
+that the data only has to come down the wire once. If the network can't be reached the copies that live in
+the repo data/ folder are used instead. Setting DO_COMMISSIONING_OFFLINE=1 (or passing offline=True) stops
+any network access at all, which is what we want on the ship.
+
+Cache layout:
+    <cache dir>/objects/<sha256>.csv   - file contents, named by their hash
+    <cache dir>/index.json             - maps each source URL to the hash of its last fetched contents
+
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import urllib.request
+from urllib.error import URLError
+
+from profiling import stage
+
+REPO_DATA_URL = 'https://raw.githubusercontent.com/kendall-s/do_commissioning/master/data/'
+
+# Folder holding the repo copies of the data files, used when the network can't be reached
+LOCAL_DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'data')
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'do_commissioning')
+
+# Names of the datasets in the same order as the report headings
+DATASETS = {
+    'INDEPENDENT_IODATE_DATA': REPO_DATA_URL + 'independent_iodate.csv',
+    'DEP_1_DEEP_REPLICATES_SINGLE_NISKINS_DATA': REPO_DATA_URL + 'dep_1_deep_replicates_single_niskins.csv',
+    'DEP_1_DEEP_REPLICATES_SHARED_NISKINS_DATA': REPO_DATA_URL + 'dep_1_deep_replicates_shared_niskins.csv',
+    'ATMOSPHERIC_DIFF_INSTRUMENTS_DATA': REPO_DATA_URL + 'atmospheric_diff_instruments.csv',
+    'ATMOSPHERIC_ONE_INSTRUMENT_DATA': REPO_DATA_URL + 'atmospheric_one_instrument.csv',
+    'PROFILE_COMPARISON_DATA': REPO_DATA_URL + 'profile_comparison.csv',
+    'DEP_2_DEEP_REPLICATES_DATA': REPO_DATA_URL + 'dep_2_deep_replicates.csv',
+    'COMBINED_DATA': REPO_DATA_URL + 'combined.csv',
+}
+
+FETCH_TIMEOUT = 10
+
+# Paths already resolved in this process, so repeated loads don't even touch the index
+_resolved_paths = {}
+
+
+class DataUnavailableError(Exception):
+    """Raised when a dataset can't be found in the cache, on the network or in the repo data folder"""
+
+
+def is_offline():
+    return os.environ.get('DO_COMMISSIONING_OFFLINE', '').lower() in ('1', 'true', 'yes')
+
+
+def cache_dir():
+    return os.environ.get('DO_COMMISSIONING_CACHE', DEFAULT_CACHE_DIR)
+
+
+def source_url(name_or_url):
+    """Turn a dataset name (e.g. 'COMBINED_DATA') into its URL, URLs and paths are passed straight through"""
+    return DATASETS.get(name_or_url, name_or_url)
+
+
+def hash_bytes(content):
+    return hashlib.sha256(content).hexdigest()
+
+
+def _index_path(root):
+    return os.path.join(root, 'index.json')
+
+
+def _object_path(root, digest):
+    return os.path.join(root, 'objects', digest + '.csv')
+
+
+def _read_index(root):
+    try:
+        with open(_index_path(root), 'r') as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_index(root, index):
+    # Write to a temp file then move it over, so a killed run can't leave a half written index
+    os.makedirs(root, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=root, suffix='.json')
+    with os.fdopen(fd, 'w') as file:
+        json.dump(index, file, indent=2, sort_keys=True)
+    os.replace(temp_path, _index_path(root))
+
+
+def store_bytes(content, url, root=None):
+    """Put some file contents in the cache against the URL they came from, returns the cached path"""
+    root = root or cache_dir()
+    digest = hash_bytes(content)
+    path = _object_path(root, digest)
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, 'wb') as file:
+            file.write(content)
+        os.replace(temp_path, path)
+    index = _read_index(root)
+    if index.get(url) != digest:
+        index[url] = digest
+        _write_index(root, index)
+    return path
+
+
+def cached_path(url, root=None):
+    """Return the cached file for a URL, or None if it hasn't been fetched before"""
+    root = root or cache_dir()
+    digest = _read_index(root).get(url)
+    if digest is None:
+        return None
+    path = _object_path(root, digest)
+    return path if os.path.exists(path) else None
+
+
+def local_copy(url):
+    """Find the copy of a dataset that is kept in the repo data folder"""
+    path = os.path.normpath(os.path.join(LOCAL_DATA_DIR, os.path.basename(url)))
+    return path if os.path.exists(path) else None
+
+
+def fetch(url, root=None):
+    """Download a URL into the cache, returns the cached path"""
+    with urllib.request.urlopen(url, timeout=FETCH_TIMEOUT) as response:
+        content = response.read()
+    return store_bytes(content, url, root)
+
+
+def resolve(name_or_url, offline=None, refresh=False, root=None):
+    """
+    Work out which local file to read for a dataset.
+
+    Order of preference is: the content addressed cache, then a fresh download (unless offline), then the
+    copy in the repo data folder. refresh=True skips the cache and re-downloads, useful when the data has
+    been updated upstream.
+    """
+    url = source_url(name_or_url)
+    if os.path.exists(url):
+        return url
+
+    offline = is_offline() if offline is None else offline
+    key = (url, root or cache_dir())
+
+    if not refresh:
+        if key in _resolved_paths and os.path.exists(_resolved_paths[key]):
+            return _resolved_paths[key]
+        path = cached_path(url, root)
+        if path is not None:
+            _resolved_paths[key] = path
+            return path
+
+    if not offline:
+        try:
+            path = fetch(url, root)
+            _resolved_paths[key] = path
+            return path
+        except (URLError, OSError):
+            pass
+
+    path = local_copy(url)
+    if path is not None:
+        return path
+
+    raise DataUnavailableError(f'Could not find {name_or_url} in the cache, online or in {LOCAL_DATA_DIR}'
+                               + (' (offline mode is on)' if offline else ''))
+
+
+def read_dataset(name_or_url, offline=None, refresh=False, **read_csv_kwargs):
+    """Drop in replacement for pd.read_csv on one of the *_DATA URLs"""
+    import pandas as pd
+
+    label = os.path.basename(source_url(name_or_url))
+    with stage(f'fetch:{label}'):
+        path = resolve(name_or_url, offline=offline, refresh=refresh)
+    with stage(f'read_csv:{label}'):
+        return pd.read_csv(path, **read_csv_kwargs)
+
+
+def prefetch(names=None, root=None):
+    """
+    Pull every dataset into the cache, e.g. before leaving port. Returns {name: cached path}.
+
+    Unlike resolve() there is no falling back to the cache or the repo copies, a download that fails raises
+    DataUnavailableError naming the datasets that couldn't be fetched (the rest are still fetched first).
+    """
+    names = names or list(DATASETS)
+    fetched = {}
+    failed = []
+    for name in names:
+        url = source_url(name)
+        try:
+            fetched[name] = fetch(url, root)
+        except (URLError, OSError) as error:
+            failed.append(f'{name} ({error})')
+            continue
+        _resolved_paths[(url, root or cache_dir())] = fetched[name]
+    if failed:
+        raise DataUnavailableError('Could not download ' + ', '.join(failed))
+    return fetched
+
+
+def seed_from_local(names=None, root=None):
+    """Fill the cache from the repo data folder without touching the network"""
+    names = names or list(DATASETS)
+    seeded = {}
+    for name in names:
+        url = source_url(name)
+        path = local_copy(url)
+        if path is None:
+            continue
+        with open(path, 'rb') as file:
+            seeded[name] = store_bytes(file.read(), url, root)
+    return seeded
+
+
+def clear_cache(root=None):
+    root = root or cache_dir()
+    _resolved_paths.clear()
+    if os.path.isdir(root):
+        shutil.rmtree(root)
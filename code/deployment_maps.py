@@ -0,0 +1,289 @@
+"""
+CTD deployment maps for one voyage or a whole season of them
+
+in2020_e01_CTD_Deployment_Map.py used to draw one hard wired map from Windows paths. Here every voyage is a
+Voyage (a name, its station positions and optionally a title and extent; otherwise the extent is fitted to the
+stations), and render_voyages() draws any number of them:
+
+    voyages = load_voyages(['../data/ctd_deployment_locations.csv', 'in2021_v01_stations.csv'])
+    render_voyages(voyages, '../plots', gebco='GEBCO_2014_2D.nc', coastline='highres_aus.shp')
+
+The basemap layers are prepared once in this process before any map is drawn: one GEBCO window covering every
+voyage is read into the bathymetry tile cache and the coastline index is built once and clipped for each
+voyage into the coastline cache. The maps are then drawn in a process pool, where every worker reads its
+bathymetry as a slice of the same memory mapped tile and its coastline from the cache, so a season of maps
+costs about one basemap load.
+
+GEBCO and the coastline shapefile are large and not in the repo, give their paths as arguments or through
+DO_COMMISSIONING_GEBCO / DO_COMMISSIONING_COASTLINE. A layer whose file isn't given is left off the map.
+
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+
+import matplotlib as mpl
+import numpy as np
+
+from bathymetry import BathymetryReader, extent_bounds
+from coastline import add_coastline, coastline_geometries
+from data_access import LOCAL_DATA_DIR
+from isobaths import contour_set, isobath_paths
+from label_placement import place_labels, text_sizes
+from profiling import stage
+
+STATIONS_FILE = os.path.join(LOCAL_DATA_DIR, 'ctd_deployment_locations.csv')
+DEFAULT_MAP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'plots')
+
+MAP_STYLE = {'font.family': 'serif'}
+MAP_FIGSIZE = (15, 8)
+# Output resolution the isobaths and coastline are simplified to, the same for every map so the caches line up
+MAP_DPI = 100
+MAP_PIXELS = (MAP_FIGSIZE[0] * MAP_DPI, MAP_FIGSIZE[1] * MAP_DPI)
+
+OCEAN_COLOUR = '#bde1f1'
+STATION_COLOUR = '#f2f542'
+STATION_EDGE_COLOUR = '#dbd814'
+STATION_MARKER_SIZE = 14
+STATION_FONT_SIZE = 14
+LAND_COLOUR = '#c4c8ce'
+ISOBATH_LEVELS = (-6000, -5000, -4000, -3000, -2000, -1000, -500)
+ISOBATH_LABELS = {level: f'{-level}m' for level in ISOBATH_LEVELS}
+
+# Degrees added around the stations when the extent is fitted to them, and the smallest span of a fitted map
+EXTENT_MARGIN = 0.5
+MIN_SPAN = 1.0
+# GEBCO is read a little beyond the map so the isobaths run off the edges
+BATHYMETRY_MARGIN = 0.5
+
+# Reference points drawn on every map they fall inside: name -> (longitude, latitude, label position)
+LANDMARKS = {
+    'Hobart': (147.3294, -42.8794, (147.02, -42.871)),
+}
+
+
+@dataclass
+class Voyage:
+    name: str
+    stations: object  # DataFrame with Latitude, Longitude and optionally Deployment columns
+    title: str = None
+    extent: list = None
+
+    @property
+    def map_extent(self):
+        return self.extent if self.extent is not None else station_extent(self.stations)
+
+    @property
+    def map_title(self):
+        return self.title or f'{self.name} CTD Deployments'
+
+    @property
+    def file_name(self):
+        return f'{self.name}_dep_locations.svg'
+
+
+def gebco_path(path=None):
+    return path or os.environ.get('DO_COMMISSIONING_GEBCO') or None
+
+
+def coastline_path(path=None):
+    return path or os.environ.get('DO_COMMISSIONING_COASTLINE') or None
+
+
+def station_extent(stations, margin=EXTENT_MARGIN, min_span=MIN_SPAN):
+    """[lon_min, lon_max, lat_min, lat_max] around the stations, at least min_span degrees each way"""
+    bounds = []
+    for column in ('Longitude', 'Latitude'):
+        low, high = float(stations[column].min()) - margin, float(stations[column].max()) + margin
+        if high - low < min_span:
+            middle = (low + high) / 2
+            low, high = middle - min_span / 2, middle + min_span / 2
+        bounds += [low, high]
+    return bounds
+
+
+def padded_extent(extent, margin=BATHYMETRY_MARGIN):
+    lon_min, lon_max, lat_min, lat_max = extent_bounds(extent)
+    return [lon_min - margin, lon_max + margin, lat_min - margin, lat_max + margin]
+
+
+def union_extent(extents):
+    bounds = np.array([extent_bounds(extent) for extent in extents])
+    return [float(bounds[:, 0].min()), float(bounds[:, 1].max()), float(bounds[:, 2].min()), float(bounds[:, 3].max())]
+
+
+def load_voyages(paths, voyage_column='Voyage'):
+    """
+    Voyages from station CSVs. A file with a voyage_column gives one voyage per value in it, otherwise the whole
+    file is one voyage named after the file.
+    """
+    import pandas as pd
+
+    voyages = []
+    for path in paths:
+        stations = pd.read_csv(path, encoding='utf-8-sig')
+        if voyage_column in stations.columns:
+            voyages += [Voyage(str(name), group.reset_index(drop=True))
+                        for name, group in stations.groupby(voyage_column, sort=False)]
+        else:
+            voyages.append(Voyage(os.path.splitext(os.path.basename(path))[0], stations))
+    return voyages
+
+
+def make_map(extent, figsize=MAP_FIGSIZE):
+    """Figure and GeoAxes set to extent, with labelled gridlines (object oriented, no pyplot state)"""
+    import cartopy.crs as ccrs
+    from cartopy.mpl.gridliner import LATITUDE_FORMATTER, LONGITUDE_FORMATTER
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    lon_min, lon_max, lat_min, lat_max = extent_bounds(extent)
+    fig = Figure(figsize=figsize, dpi=MAP_DPI)
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot(projection=ccrs.PlateCarree())
+    ax.set_extent(extent, crs=ccrs.PlateCarree())
+    grid_lines = ax.gridlines(draw_labels=True, alpha=0.3, color='black',
+                              xlocs=np.linspace(lon_min, lon_max, 5),
+                              ylocs=np.linspace(lat_max, lat_min, 5))
+    grid_lines.top_labels = grid_lines.right_labels = False
+    grid_lines.xformatter = LONGITUDE_FORMATTER
+    grid_lines.yformatter = LATITUDE_FORMATTER
+    grid_lines.xlabel_style = {'size': 14}
+    grid_lines.ylabel_style = {'size': 14}
+    return fig, ax
+
+
+def draw_isobaths(ax, reader, extent, levels=ISOBATH_LEVELS, cache_root=None):
+    import cartopy.crs as ccrs
+
+    paths = isobath_paths(reader, padded_extent(extent), levels, MAP_PIXELS, root=cache_root)
+    contours = contour_set(ax, paths, vmax=5000, transform=ccrs.PlateCarree(), cmap='bone', linewidths=0.5,
+                           alpha=0.4)
+    # Label the isobars with a dictionary so it is pretty
+    if contours is not None:
+        ax.clabel(contours, contours.levels, fmt=ISOBATH_LABELS)
+    return contours
+
+
+def station_labels(stations):
+    if 'Deployment' in stations.columns:
+        return [f'Dep. {deployment}' for deployment in stations['Deployment']]
+    return [f'Dep. {number}' for number in range(1, len(stations) + 1)]
+
+
+def draw_stations(ax, stations, markersize=STATION_MARKER_SIZE, fontsize=STATION_FONT_SIZE):
+    """
+    All the stations as one scatter collection, with each label placed clear of the markers and the other labels
+    (see label_placement.py). Returns the number of labels that had room to be drawn.
+    """
+    longitudes = stations['Longitude'].to_numpy(dtype=np.float64)
+    latitudes = stations['Latitude'].to_numpy(dtype=np.float64)
+    ax.scatter(longitudes, latitudes, s=markersize ** 2, marker='o', c=STATION_COLOUR, edgecolors=STATION_EDGE_COLOUR,
+               linewidths=1.0, zorder=20)
+
+    labels = station_labels(stations)
+    pixels_per_point = ax.figure.dpi / 72
+    # The axes only shrink to the map's aspect ratio when drawn, so do that now or the pixel positions (and the
+    # bounds) the labels are placed against are those of the unshrunk axes
+    ax.apply_aspect()
+    points = ax.transData.transform(np.column_stack([longitudes, latitudes]))
+    offsets, placed = place_labels(points, text_sizes(ax.figure, labels, fontsize), markersize / 2 * pixels_per_point,
+                                   bounds=ax.bbox.extents)
+    for index in np.flatnonzero(placed):
+        ax.annotate(labels[index], (longitudes[index], latitudes[index]), xytext=offsets[index] / pixels_per_point,
+                    textcoords='offset points', ha='left', va='bottom', fontsize=fontsize, zorder=20)
+    return int(placed.sum())
+
+
+def draw_landmarks(ax, extent, landmarks=None):
+    lon_min, lon_max, lat_min, lat_max = extent_bounds(extent)
+    for name, (lon, lat, label_position) in (LANDMARKS if landmarks is None else landmarks).items():
+        if lon_min <= lon <= lon_max and lat_min <= lat <= lat_max:
+            ax.plot(lon, lat, marker='o', lw=0, mfc='#4272f5', mec='#1438db', ms=6, zorder=20)
+            ax.annotate(name, label_position, zorder=20, fontsize=14)
+
+
+def draw_deployment_map(voyage, bathymetry=None, coastline=None, out_path=None, cache_root=None):
+    """
+    Draw one voyage's map, saving it as SVG to out_path when given.
+
+    bathymetry is a BathymetryReader (or the path of a GEBCO file), coastline the path of the shapefile. Either
+    can be None to leave that layer off.
+    """
+    extent = voyage.map_extent
+    if isinstance(bathymetry, str):
+        bathymetry = BathymetryReader(bathymetry, root=cache_root)
+
+    with mpl.rc_context(MAP_STYLE):
+        with stage('make_map'):
+            fig, ax = make_map(extent)
+
+        if bathymetry is not None:
+            with stage('contour'):
+                draw_isobaths(ax, bathymetry, extent, cache_root=cache_root)
+
+        # You can add a ocean feature from Cartopy, but a cheating way is to just set the figure background
+        # color to match the ocean...
+        ax.set_facecolor(OCEAN_COLOUR)
+
+        if coastline is not None:
+            with stage('coastline'):
+                add_coastline(ax, coastline, extent, pixels=MAP_PIXELS, root=cache_root, facecolor=LAND_COLOUR,
+                              edgecolor='black', lw=0.5)
+
+        with stage('stations'):
+            draw_stations(ax, voyage.stations)
+            draw_landmarks(ax, extent)
+
+        ax.set_title(voyage.map_title, fontsize=20)
+
+        # Save as SVG and cut out any white space around the plot, this is so the raw SVG can be imported into Word
+        # and retain its nice scaling properties. Otherwise cropping in Word changes image type and it looks ugly.
+        if out_path is not None:
+            with stage('savefig'):
+                os.makedirs(os.path.dirname(os.path.abspath(out_path)), exist_ok=True)
+                fig.savefig(out_path, dpi=300, format='svg', bbox_inches='tight', pad_inches=0)
+    return fig
+
+
+def _render_task(task):
+    voyage, bathymetry, coastline, out_path, cache_root = task
+    draw_deployment_map(voyage, bathymetry, coastline, out_path, cache_root)
+    return voyage.name, out_path
+
+
+def prepare_basemap(voyages, gebco=None, coastline=None, cache_root=None):
+    """
+    Load the basemap layers once for every voyage: read one GEBCO window covering all of them into the tile
+    cache, and clip the coastline for each voyage into the coastline cache. Returns the BathymetryReader.
+    """
+    reader = None
+    if gebco is not None:
+        reader = BathymetryReader(gebco, root=cache_root)
+        with stage('gebco_read'):
+            reader.window(padded_extent(union_extent([voyage.map_extent for voyage in voyages])))
+    if coastline is not None:
+        with stage('coastline_clip'):
+            for voyage in voyages:
+                coastline_geometries(coastline, voyage.map_extent, MAP_PIXELS, root=cache_root)
+    return reader
+
+
+def render_voyages(voyages, out_dir=DEFAULT_MAP_DIR, gebco=None, coastline=None, processes=None, cache_root=None):
+    """
+    Draw the deployment map of every voyage into out_dir, in a process pool unless processes=1.
+
+    gebco and coastline default to DO_COMMISSIONING_GEBCO / DO_COMMISSIONING_COASTLINE. Returns {name: path}.
+    """
+    voyages = list(voyages)
+    gebco, coastline = gebco_path(gebco), coastline_path(coastline)
+    reader = prepare_basemap(voyages, gebco, coastline, cache_root)
+    tasks = [(voyage, reader, coastline, os.path.join(out_dir, voyage.file_name), cache_root) for voyage in voyages]
+
+    if processes == 1 or len(tasks) < 2:
+        written = [_render_task(task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            written = list(pool.map(_render_task, tasks))
+    return dict(written)
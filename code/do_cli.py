@@ -0,0 +1,291 @@
+"""
+Command line entry point for the DO commissioning tools
+
+DO_Commissioning.py is the notebook export and runs everything top to bottom, this is for running just the part
+that is needed, e.g. from cron during a voyage:
+
+    python do_cli.py load --store ../store       fetch/cache every dataset (and optionally convert to the store)
+    python do_cli.py stats --exclude Profile_Comp
+    python do_cli.py qc                          saturation QC of the atmospheric standards, exits 1 on a fail
+    python do_cli.py chart --standard iodate      add any new standards to the control charts, exits 1 on an alarm
+    python do_cli.py follow results.csv          watch an instrument's results file as it is written
+    python do_cli.py ttest --welch
+    python do_cli.py plot --out ../plots
+    python do_cli.py map                         CTD deployment maps, one per voyage in the station files given
+
+Only the standard library is imported up front. Each subcommand imports what it needs when it runs, so e.g.
+stats never imports matplotlib/seaborn and only map touches cartopy/netCDF4.
+
+"""
+
+import argparse
+import os
+import sys
+
+DEFAULT_PLOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'plots')
+DEFAULT_STATIONS = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'data',
+                                'ctd_deployment_locations.csv')
+# Dataset charted for each standard when --dataset isn't given
+STANDARD_DATASETS = {
+    'atmospheric': 'ATMOSPHERIC_DIFF_INSTRUMENTS_DATA',
+    'iodate': 'INDEPENDENT_IODATE_DATA',
+}
+
+
+def _print_frame(df, output_format):
+    if output_format == 'csv':
+        df.to_csv(sys.stdout)
+    elif output_format == 'json':
+        print(df.to_json(orient='table', indent=2))
+    else:
+        with _pandas().option_context('display.max_rows', None, 'display.width', 200):
+            print(df)
+
+
+def _pandas():
+    import pandas as pd
+
+    return pd
+
+
+def _load_frame(args):
+    from data_access import read_dataset
+
+    df = read_dataset(args.dataset, offline=args.offline)
+    if getattr(args, 'exclude', None):
+        df = df.loc[~df['Experiment'].isin(args.exclude)]
+    return df
+
+
+def run_load(args):
+    from data_access import DATASETS, is_offline, prefetch, resolve
+
+    offline = is_offline() if args.offline is None else args.offline
+    if args.refresh and not offline:
+        # Raises when a download fails rather than quietly carrying on with the old copies
+        paths = prefetch()
+    else:
+        paths = {name: resolve(name, offline=offline) for name in DATASETS}
+    for name, path in paths.items():
+        print(f'{name}: {path}')
+    if args.store:
+        from titration_store import ingest_all
+
+        for name, path in ingest_all(args.store, backend=args.backend, offline=args.offline).items():
+            print(f'{name} -> {path}')
+    return 0
+
+
+def run_stats(args):
+    from group_stats import describe_groups
+
+    _print_frame(describe_groups(_load_frame(args), by=args.by), args.format)
+    return 0
+
+
+def run_qc(args):
+    from saturation_qc import saturation_qc
+
+    df = _load_frame(args)
+    result = df.join(saturation_qc(df, salinity=args.salinity, temperature=args.temperature,
+                                   percent=args.percent, umol=args.umol))
+    if args.fails_only:
+        result = result.loc[~result['pass']]
+    _print_frame(result, args.format)
+    return 0 if result['pass'].all() else 1
+
+
+def run_chart(args):
+    from control_charts import ControlCharts
+
+    args.dataset = args.dataset or STANDARD_DATASETS[args.standard]
+    charts = ControlCharts.load(args.state, baseline=args.baseline)
+    result = charts.update(_load_frame(args), args.standard, source=args.dataset)
+    charts.save()
+    _print_frame(result if args.all_rows else charts.alarms, args.format)
+    return 1 if len(charts.alarms) else 0
+
+
+def run_follow(args):
+    from live_ingest import LiveSession, follow_session, write_rows
+
+    charts = None
+    if args.standard:
+        from control_charts import ControlCharts
+
+        charts = ControlCharts.load(args.state)
+    if args.replay:
+        import threading
+        from data_access import resolve
+
+        # Stand-in for the instrument, writes the rows of an existing dataset into the followed file
+        writer = threading.Thread(target=write_rows, args=(resolve(args.replay, offline=args.offline), args.path),
+                                  kwargs={'interval': args.replay_interval}, daemon=True)
+        writer.start()
+
+    session = LiveSession(args.path, experiment=args.experiment, figures=args.figures or (), out_dir=args.out,
+                          charts=charts, standard=args.standard, saturation=args.saturation)
+    try:
+        for update in follow_session(session, args.interval, args.duration):
+            if update.restarted:
+                print(f'{args.path} was replaced, reading it again from the top')
+            if update.qc is not None:
+                fails = update.qc.loc[~update.qc['pass']]
+                print(f'{len(update.rows)} new rows, {len(fails)} outside the QC limits')
+                if len(fails):
+                    _print_frame(update.rows.loc[fails.index].join(fails), args.format)
+            elif len(update.rows):
+                print(f'{len(update.rows)} new rows')
+            if update.alarms is not None and len(update.alarms):
+                _print_frame(update.alarms, args.format)
+            for file_name in update.rendered:
+                print(f'rendered {file_name}')
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if charts is not None:
+            charts.save()
+    _print_frame(session.summary.describe(), args.format)
+    return 0
+
+
+def run_ttest(args):
+    from pairwise_tests import pairwise_ttests
+
+    results = pairwise_ttests(_load_frame(args), by=args.by or None, equal_var=not args.welch,
+                              correction=None if args.correction == 'none' else args.correction, alpha=args.alpha)
+    _print_frame(results, args.format)
+    return 0
+
+
+def run_plot(args):
+    from build_cache import format_report
+    from figures import FIGURE_SPECS, render_all, render_matched_grid
+
+    export = None
+    if args.compact or args.svgz:
+        export = {'precision': args.precision, 'compress': args.svgz}
+    specs = [FIGURE_SPECS[name] for name in args.figures] if args.figures else None
+    rebuilt, skipped = render_all(args.out, specs=specs, processes=args.processes, offline=args.offline,
+                                  force=args.force, export=export)
+    if args.grid:
+        grid_rebuilt, grid_skipped = render_matched_grid(args.out, offline=args.offline, force=args.force,
+                                                         export=export)
+        rebuilt.update(grid_rebuilt)
+        skipped += grid_skipped
+    print(format_report(rebuilt, skipped))
+    return 0
+
+
+def run_map(args):
+    from deployment_maps import load_voyages, render_voyages
+
+    written = render_voyages(load_voyages(args.stations, args.voyage_column), args.out, gebco=args.gebco,
+                             coastline=args.coastline, processes=args.processes)
+    for name, path in written.items():
+        print(f'{name} -> {path}')
+    return 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description='Dissolved oxygen instrument commissioning tools')
+    parser.add_argument('--offline', action='store_true', default=None,
+                        help='never touch the network, use the cache or the repo data folder')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    def add_output(sub):
+        sub.add_argument('--format', choices=('text', 'csv', 'json'), default='text')
+
+    def add_dataset(sub, default):
+        sub.add_argument('--dataset', default=default, help='dataset name (e.g. COMBINED_DATA), URL or path')
+
+    load = subparsers.add_parser('load', help='fetch every dataset into the local cache')
+    load.add_argument('--refresh', action='store_true', help='re-download even if cached')
+    load.add_argument('--store', help='also convert the datasets into a typed columnar store in this folder')
+    load.add_argument('--backend', choices=('parquet', 'npy'), help='store backend (default: parquet if available)')
+    load.set_defaults(handler=run_load)
+
+    stats = subparsers.add_parser('stats', help='descriptive statistics for every group')
+    add_dataset(stats, 'COMBINED_DATA')
+    stats.add_argument('--by', nargs='+', default=['Experiment', 'Instrument'])
+    stats.add_argument('--exclude', nargs='+', help='experiments to leave out, e.g. Profile_Comp')
+    add_output(stats)
+    stats.set_defaults(handler=run_stats)
+
+    qc = subparsers.add_parser('qc', help='saturation QC of the atmospheric samples')
+    add_dataset(qc, 'ATMOSPHERIC_DIFF_INSTRUMENTS_DATA')
+    qc.add_argument('--salinity', default=0, type=float)
+    qc.add_argument('--temperature', default='DrawTemp', help='column name of the sample temperature')
+    qc.add_argument('--percent', default=1.0, type=float, help='percent limit either side of saturation')
+    qc.add_argument('--umol', default=1.0, type=float, help='µmol/L limit either side of saturation')
+    qc.add_argument('--fails-only', action='store_true')
+    add_output(qc)
+    qc.set_defaults(handler=run_qc)
+
+    chart = subparsers.add_parser('chart', help='control charts of the repeated standards')
+    add_dataset(chart, None)
+    chart.add_argument('--standard', choices=tuple(STANDARD_DATASETS), default='atmospheric')
+    chart.add_argument('--state', help='saved chart state (default: control_charts.json in the cache folder)')
+    chart.add_argument('--baseline', type=int, default=8, help='standards used to set the limits of a new chart')
+    chart.add_argument('--all-rows', action='store_true', help='print every charted row, not just the alarms')
+    add_output(chart)
+    chart.set_defaults(handler=run_chart)
+
+    follow = subparsers.add_parser('follow', help="follow an instrument's results file as rows are added")
+    follow.add_argument('path', help='results CSV the instrument appends to')
+    follow.add_argument('--experiment', help='Experiment label for the rows, when the file has no Experiment column')
+    follow.add_argument('--figures', nargs='+', help='names from figures.FIGURE_SPECS to keep up to date')
+    follow.add_argument('--out', default=DEFAULT_PLOT_DIR)
+    follow.add_argument('--standard', choices=tuple(STANDARD_DATASETS), help='also add the rows to this control chart')
+    follow.add_argument('--no-saturation', dest='saturation', action='store_false', default=None,
+                        help='skip the saturation QC (off already with --standard iodate)')
+    follow.add_argument('--state', help='saved chart state (default: control_charts.json in the cache folder)')
+    follow.add_argument('--interval', type=float, default=1.0, help='seconds between polls of the file')
+    follow.add_argument('--duration', type=float, help='stop after this many seconds (default: until Ctrl+C)')
+    follow.add_argument('--replay', help='dataset to write into path a row at a time, to try it out without an '
+                                         'instrument')
+    follow.add_argument('--replay-interval', type=float, default=1.0)
+    add_output(follow)
+    follow.set_defaults(handler=run_follow)
+
+    ttest = subparsers.add_parser('ttest', help='pairwise t-tests between instruments')
+    add_dataset(ttest, 'COMBINED_DATA')
+    ttest.add_argument('--by', nargs='*', default=['Experiment'], help='columns defining each comparison')
+    ttest.add_argument('--exclude', nargs='+')
+    ttest.add_argument('--welch', action='store_true', help="Welch's test instead of Student's")
+    ttest.add_argument('--correction', choices=('holm', 'bonferroni', 'fdr_bh', 'none'), default='holm')
+    ttest.add_argument('--alpha', type=float, default=0.05)
+    add_output(ttest)
+    ttest.set_defaults(handler=run_ttest)
+
+    plot = subparsers.add_parser('plot', help='render the report figures (only those out of date)')
+    plot.add_argument('--out', default=DEFAULT_PLOT_DIR)
+    plot.add_argument('--figures', nargs='+', help='names from figures.FIGURE_SPECS, default all')
+    plot.add_argument('--processes', type=int)
+    plot.add_argument('--force', action='store_true')
+    plot.add_argument('--compact', action='store_true', help='compact SVG output')
+    plot.add_argument('--svgz', action='store_true', help='compact, gzipped SVG output')
+    plot.add_argument('--precision', type=int, default=2)
+    plot.add_argument('--grid', action='store_true', help='also render the matched y scale table figure')
+    plot.set_defaults(handler=run_plot)
+
+    map_parser = subparsers.add_parser('map', help='draw the CTD deployment maps')
+    map_parser.add_argument('stations', nargs='*', default=[DEFAULT_STATIONS],
+                            help='station CSVs (Latitude, Longitude, optionally Deployment and Voyage columns)')
+    map_parser.add_argument('--voyage-column', default='Voyage', help='column splitting a file into voyages')
+    map_parser.add_argument('--out', default=DEFAULT_PLOT_DIR)
+    map_parser.add_argument('--gebco', help='GEBCO NetCDF file (default: DO_COMMISSIONING_GEBCO)')
+    map_parser.add_argument('--coastline', help='coastline shapefile (default: DO_COMMISSIONING_COASTLINE)')
+    map_parser.add_argument('--processes', type=int)
+    map_parser.set_defaults(handler=run_map)
+
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    return args.handler(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
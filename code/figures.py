@@ -0,0 +1,427 @@
+"""
+Figure specifications and renderer for the commissioning plots
+
+Every plot in the report is described by a FigureSpec in FIGURE_SPECS: which dataset it uses, what kind of plot
+it is, its labels and whether the saturation QC lines go on it. The drawing is done with the object oriented
+matplotlib API on the Agg canvas (no pyplot state machine), so specs can be rendered independently of each
+other and render_all() can fan them out across a process pool.
+
+    render_all('../plots')                  - regenerate every figure in plots/ and plots/matched_y_scale/ that is
+                                              out of date (see build_cache)
+    build_figure(FIGURE_SPECS[name], df)    - draw one figure from an already loaded frame, e.g. in the notebook
+    render_matched_grid('../plots')         - the matched y scale table as a single multi-panel figure, also
+                                              skipped when up to date
+
+"""
+
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import contextmanager
+from dataclasses import dataclass, replace
+
+import matplotlib as mpl
+import numpy as np
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+from build_cache import BuildCache, data_signature, params_signature, versions_signature
+from data_access import read_dataset
+from group_stats import VALUE_COLUMN, describe_groups
+from profiling import stage
+from saturation_qc import MEASURED_SALINITY, MEASURED_TEMPERATURE, saturation_limits
+from svg_export import save_compact_svg
+from titration_store import DATASET_EXPERIMENTS
+
+# Styling that used to be set globally at the top of the notebook, on top of the seaborn theme that
+# sns.set(style="whitegrid") applied there (see figure_style)
+STYLE = {
+    'font.family': 'serif',
+    'figure.figsize': [8, 5],
+}
+
+# Colours of the QC lines
+SATURATION_COLOUR = '#32a858'
+PERCENT_COLOUR = '#2c5aa3'
+UMOL_COLOUR = '#2c9fa3'
+
+# Half height of the y axis for the matched y scale versions of the plots, in µmol/L
+MATCHED_Y_SPAN = 2
+MATCHED_Y_SUBDIR = 'matched_y_scale'
+MATCHED_GRID_FILE = (MATCHED_Y_SUBDIR, 'in_table', 'matched_y_scale_table.svg')
+
+# Modules the figures are drawn and written with, a change to any of them rebuilds every figure
+SOURCE_FILES = [os.path.join(os.path.dirname(os.path.abspath(__file__)), name + '.py')
+                for name in ('figures', 'group_stats', 'saturation_qc', 'svg_export')]
+
+
+@dataclass(frozen=True)
+class FigureSpec:
+    name: str
+    dataset: str
+    kind: str
+    title: str
+    xlabel: str = 'Instrument'
+    ylabel: str = 'Concentration (uM)'
+    qc_lines: bool = False
+    y_span: float = None
+    subdir: str = ''
+    figsize: tuple = None
+    value: str = VALUE_COLUMN
+
+    @property
+    def file_name(self):
+        return os.path.join(self.subdir, self.name + '.svg')
+
+    def output_name(self, export=None):
+        """File name for the given export options, compressed output gets the .svgz extension"""
+        return _output_name(self.file_name, export)
+
+    @property
+    def experiment(self):
+        """The Experiment label of this figure's rows in combined.csv"""
+        return DATASET_EXPERIMENTS[self.dataset]
+
+
+def _output_name(file_name, export=None):
+    if export and export.get('compress'):
+        return file_name + 'z'
+    return file_name
+
+
+def _style_axes(ax, spec, scale=1.0):
+    ax.set_xlabel(spec.xlabel, fontsize=16 * scale)
+    ax.set_ylabel(spec.ylabel, fontsize=16 * scale)
+    ax.tick_params(axis='x', labelsize=14 * scale)
+    ax.tick_params(axis='y', labelsize=12 * scale)
+    ax.set_title(spec.title, fontsize=18 * scale)
+
+
+def _draw_boxplot(ax, spec, df):
+    import seaborn as sns
+
+    sns.boxplot(x=df['Instrument'], y=df[spec.value], ax=ax)
+    return -0.5, df['Instrument'].nunique() - 0.5
+
+
+def _draw_scatter(ax, spec, df):
+    ax.plot(range(len(df)), df[spec.value], lw=0, marker='o', ms=10)
+    x_range = (-1, len(df) + 1)
+    if spec.qc_lines:
+        ax.set_xlim(*x_range)
+    return x_range
+
+
+def _draw_profile(ax, spec, df):
+    new_a = df.loc[df['Instrument'] == 'New A']
+    old = df.loc[df['Instrument'] == 'Old']
+    ax.plot(new_a[spec.value], new_a['Pressure'], lw=0, marker='o', ms=14, mfc='none', mew=1.5, label='New A')
+    ax.plot(old[spec.value], old['Pressure'], lw=0, marker='.', ms=16, mfc='none', mew=1.5, label='Old')
+    ax.legend()
+    ax.invert_yaxis()
+    return None
+
+
+# Registry of the kinds of plot a spec can ask for
+PLOTTERS = {
+    'boxplot': _draw_boxplot,
+    'scatter': _draw_scatter,
+    'profile': _draw_profile,
+}
+
+# Columns (besides the spec's value column) each kind of plot reads, anything else can change without a re-render
+PLOT_COLUMNS = {
+    'boxplot': ['Instrument'],
+    'scatter': [],
+    'profile': ['Instrument', 'Pressure'],
+}
+
+
+def draw_qc_lines(ax, x_range, limits):
+    """Calculated saturation with the ±1% and ±1 µM lines and their labels at the right hand end"""
+    x_low, x_upp = x_range
+    ax.plot([x_low, x_upp], [limits['saturation']] * 2, color=SATURATION_COLOUR)
+    ax.plot([x_low, x_upp], [limits['percent_lower']] * 2, color=PERCENT_COLOUR)
+    ax.plot([x_low, x_upp], [limits['percent_upper']] * 2, color=PERCENT_COLOUR)
+    ax.plot([x_low, x_upp], [limits['umol_lower']] * 2, color=UMOL_COLOUR)
+    ax.plot([x_low, x_upp], [limits['umol_upper']] * 2, color=UMOL_COLOUR)
+
+    label_x = x_upp - (x_upp - x_low) * 0.01
+    ax.annotate('+1µM', xy=(label_x, limits['umol_upper'] - 0.25), ha='right')
+    ax.annotate('+1%', xy=(label_x, limits['percent_upper'] - 0.25), ha='right')
+    ax.annotate('Calc. Sat.', xy=(label_x, limits['saturation'] - 0.25), ha='right')
+
+
+@contextmanager
+def figure_style():
+    """
+    The notebook's sns.set(style="whitegrid") look without changing the global rcParams: the whitegrid style,
+    the 'notebook' context and the 'deep' palette, then STYLE on top so its serif font isn't overridden.
+    """
+    import seaborn as sns
+
+    with sns.axes_style('whitegrid'), sns.plotting_context('notebook'), sns.color_palette('deep'):
+        with mpl.rc_context(STYLE):
+            yield
+
+
+def _display_inline():
+    """
+    Let IPython show the figures returned to a notebook cell. They are drawn without pyplot, so the notebook's
+    inline backend doesn't pick them up the way it did the pyplot figures; outside IPython this does nothing.
+    """
+    ipython = sys.modules.get('IPython')
+    shell = ipython.get_ipython() if ipython is not None else None
+    if shell is not None:
+        from IPython.core.pylabtools import print_figure
+
+        shell.display_formatter.formatters['image/png'].for_type(Figure, lambda fig: print_figure(fig, 'png'))
+
+
+def build_figure(spec, df, out_dir=None, limits=None, y_centre=None, export=None):
+    """
+    Draw the figure for a spec from its data, saving it under out_dir when one is given.
+
+    limits are the saturation QC lines (worked out from the measured conditions if not given). y_centre sets
+    the middle of the y axis for specs with a y_span, otherwise the mean of the plotted values is used.
+    export is None for matplotlib's standard SVG, or a dict of save_compact_svg options (precision, simplify,
+    compress) for the compact output.
+    """
+    with stage(f'render:{spec.name}'), figure_style():
+        fig = Figure(figsize=spec.figsize or STYLE['figure.figsize'])
+        FigureCanvasAgg(fig)
+        ax = fig.add_subplot()
+        x_range = PLOTTERS[spec.kind](ax, spec, df)
+        _style_axes(ax, spec)
+
+        if spec.qc_lines:
+            draw_qc_lines(ax, x_range, limits or saturation_limits(MEASURED_SALINITY, MEASURED_TEMPERATURE))
+
+        fig.tight_layout()
+
+        if spec.y_span is not None:
+            centre = df[spec.value].mean() if y_centre is None else y_centre
+            ax.set_ylim(centre - spec.y_span, centre + spec.y_span)
+
+        if out_dir is not None:
+            with stage('savefig'):
+                _save(fig, os.path.join(out_dir, spec.output_name(export)), export)
+    _display_inline()
+    return fig
+
+
+def _save(fig, path, export=None):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if export is None:
+        fig.savefig(path, format='svg')
+    else:
+        save_compact_svg(fig, path, **export)
+
+
+def matched_y_version(spec, span=MATCHED_Y_SPAN):
+    return replace(spec, y_span=span, subdir=MATCHED_Y_SUBDIR)
+
+
+_BASE_SPECS = [
+    FigureSpec('independent_iodate_standards', 'INDEPENDENT_IODATE_DATA', 'boxplot',
+               'Independent Iodate Standard'),
+    FigureSpec('replicate_deep_samples_1_single', 'DEP_1_DEEP_REPLICATES_SINGLE_NISKINS_DATA', 'boxplot',
+               'D1 Replicate Samples: 1 Niskin ea'),
+    FigureSpec('replicate_deep_samples_1_shared', 'DEP_1_DEEP_REPLICATES_SHARED_NISKINS_DATA', 'boxplot',
+               'D1 Replicate Samples: 2 Niskin shared'),
+    FigureSpec('atmospheric_diff_instruments', 'ATMOSPHERIC_DIFF_INSTRUMENTS_DATA', 'boxplot',
+               'Atmospheric Saturated Sample'),
+    FigureSpec('atmospheric_diff_instruments_with_bars', 'ATMOSPHERIC_DIFF_INSTRUMENTS_DATA', 'boxplot',
+               'Atmospheric Saturated Sample w/QC Bars', qc_lines=True),
+    FigureSpec('atmospheric_one_instrument', 'ATMOSPHERIC_ONE_INSTRUMENT_DATA', 'scatter',
+               'Atmospheric Saturated Sample: Instrument New B', xlabel='Sample'),
+    FigureSpec('atmospheric_one_instrument_with_bars', 'ATMOSPHERIC_ONE_INSTRUMENT_DATA', 'scatter',
+               'Atmospheric Saturated Sample: Instrument New B', xlabel='Sample', qc_lines=True),
+    FigureSpec('atmospheric_one_instrument_with_bars-boxplot-version', 'ATMOSPHERIC_ONE_INSTRUMENT_DATA',
+               'boxplot', 'Atmospheric Saturated Sample: Instrument New B', xlabel='Sample', qc_lines=True),
+    FigureSpec('profile_comparison', 'PROFILE_COMPARISON_DATA', 'profile', 'Profile Comparison',
+               xlabel='Concentration (uM)', ylabel='Pressure (db)', figsize=(5, 8)),
+    FigureSpec('replicate_deep_samples_2', 'DEP_2_DEEP_REPLICATES_DATA', 'boxplot', 'D2 Replicate Samples'),
+]
+
+# The boxplots that also go in plots/matched_y_scale
+_MATCHED_Y_NAMES = [
+    'independent_iodate_standards',
+    'replicate_deep_samples_1_single',
+    'replicate_deep_samples_1_shared',
+    'atmospheric_diff_instruments',
+    'atmospheric_diff_instruments_with_bars',
+    'atmospheric_one_instrument_with_bars-boxplot-version',
+    'replicate_deep_samples_2',
+]
+
+FIGURE_SPECS = {spec.name: spec for spec in _BASE_SPECS}
+FIGURE_SPECS.update({MATCHED_Y_SUBDIR + '/' + name: matched_y_version(FIGURE_SPECS[name])
+                     for name in _MATCHED_Y_NAMES})
+
+
+def matched_y_centres(combined_df, value=VALUE_COLUMN):
+    """Centre of the y axis for every experiment's matched y scale panel (its mean), in one pass over the data"""
+    return describe_groups(combined_df, by=['Experiment'], value=value, quantiles=())['mean']
+
+
+def matched_y_span(combined_df, experiments=None, value=VALUE_COLUMN, minimum=MATCHED_Y_SPAN, step=0.5):
+    """
+    Smallest half height (rounded up to step) that fits every experiment's data around its own centre.
+
+    Never smaller than minimum, so the default ±2 µM scale is kept unless some experiment doesn't fit in it.
+    experiments limits this to the panels actually being drawn (the profile would otherwise swamp it).
+    """
+    stats = describe_groups(combined_df, by=['Experiment'], value=value, quantiles=())
+    if experiments is not None:
+        stats = stats.loc[stats.index.isin(experiments)]
+    reach = np.maximum(stats['max'] - stats['mean'], stats['mean'] - stats['min']).max()
+    return max(minimum, float(np.ceil(reach / step) * step))
+
+
+def _render_task(task):
+    spec, df, out_dir, limits, y_centre, export = task
+    build_figure(spec, df, out_dir, limits, y_centre=y_centre, export=export)
+    return spec.output_name(export)
+
+
+def figure_signature(spec, df, limits, versions, export=None, y_centre=None):
+    """What a figure depends on, for the build cache: its input rows, its parameters and the library versions"""
+    return {
+        'data': data_signature(df, PLOT_COLUMNS[spec.kind] + [spec.value]),
+        'spec': params_signature(spec, limits if spec.qc_lines else None, export, y_centre),
+        'versions': versions,
+    }
+
+
+@stage('render_all')
+def render_all(out_dir, specs=None, processes=None, offline=None, force=False, export=None):
+    """
+    Render the given specs (default: all of them) into out_dir.
+
+    Each dataset is read once in this process and handed to the workers with the specs that use it.
+    processes=1 renders serially in this process, otherwise a process pool is used (default: one worker per
+    core). Figures whose inputs, parameters and library versions haven't changed since the last build are
+    skipped unless force=True. export takes the same compact SVG options as build_figure().
+
+    Returns ({file: [reasons it was rebuilt]}, [files that were up to date]). If a figure fails, the ones that
+    were written are still recorded in the build cache before the error is raised.
+    """
+    specs = list(FIGURE_SPECS.values()) if specs is None else list(specs)
+    frames = {name: read_dataset(name, offline=offline) for name in {spec.dataset for spec in specs}}
+    limits = saturation_limits(MEASURED_SALINITY, MEASURED_TEMPERATURE)
+
+    # The matched y scale centres for every experiment come from one pass over the combined data
+    centres = {}
+    if any(spec.y_span is not None for spec in specs):
+        centres = matched_y_centres(read_dataset('COMBINED_DATA', offline=offline)).to_dict()
+
+    cache = BuildCache(out_dir)
+    versions = versions_signature(SOURCE_FILES)
+    rebuilt = {}
+    skipped = []
+    tasks = []
+    signatures = {}
+    for spec in specs:
+        output = spec.output_name(export)
+        y_centre = centres.get(spec.experiment) if spec.y_span is not None else None
+        signature = figure_signature(spec, frames[spec.dataset], limits, versions, export, y_centre)
+        reasons = ['forced'] if force else cache.reasons_to_build(output, signature)
+        if not reasons:
+            skipped.append(output)
+            continue
+        rebuilt[output] = reasons
+        signatures[output] = signature
+        tasks.append((spec, frames[spec.dataset], out_dir, limits, y_centre, export))
+
+    written = []
+    try:
+        if processes == 1 or len(tasks) < 2:
+            for task in tasks:
+                written.append(_render_task(task))
+                cache.record(written[-1], signatures[written[-1]])
+        else:
+            with ProcessPoolExecutor(max_workers=processes) as pool:
+                futures = [pool.submit(_render_task, task) for task in tasks]
+                failure = None
+                for future in as_completed(futures):
+                    try:
+                        written.append(future.result())
+                    except Exception as error:
+                        failure = failure or error
+                        continue
+                    cache.record(written[-1], signatures[written[-1]])
+                if failure is not None:
+                    raise failure
+    finally:
+        if written:
+            cache.save()
+    return rebuilt, skipped
+
+
+def build_matched_grid(combined_df, names=None, span=MATCHED_Y_SPAN, ncols=3, limits=None):
+    """
+    Draw the whole matched y scale comparison table as one multi-panel figure.
+
+    Every panel comes from the combined data filtered to its experiment, is centred on that experiment's mean
+    and gets the same y span, so the boxes can be compared by eye across the table. span='auto' picks the
+    smallest span that fits every panel (see matched_y_span).
+    """
+    specs = [FIGURE_SPECS[name] for name in (names or _MATCHED_Y_NAMES)]
+    centres = matched_y_centres(combined_df)
+    if span == 'auto':
+        span = matched_y_span(combined_df, {spec.experiment for spec in specs})
+    limits = limits or saturation_limits(MEASURED_SALINITY, MEASURED_TEMPERATURE)
+    rows_by_experiment = combined_df.groupby('Experiment', sort=False).indices
+
+    nrows = -(-len(specs) // ncols)
+    with figure_style():
+        fig = Figure(figsize=(5 * ncols, 4 * nrows))
+        FigureCanvasAgg(fig)
+        axes = fig.subplots(nrows, ncols, squeeze=False).ravel()
+        for ax, spec in zip(axes, specs):
+            df = combined_df.iloc[rows_by_experiment[spec.experiment]]
+            x_range = PLOTTERS[spec.kind](ax, spec, df)
+            _style_axes(ax, spec, scale=0.7)
+            if spec.qc_lines:
+                draw_qc_lines(ax, x_range, limits)
+            centre = centres[spec.experiment]
+            ax.set_ylim(centre - span, centre + span)
+        for ax in axes[len(specs):]:
+            ax.set_visible(False)
+        fig.tight_layout()
+    _display_inline()
+    return fig
+
+
+def grid_signature(specs, combined_df, span, ncols, limits, versions, export=None):
+    """figure_signature() for the matched y scale table, built from the combined data"""
+    columns = {column for spec in specs for column in PLOT_COLUMNS[spec.kind] + [spec.value]}
+    return {
+        'data': data_signature(combined_df, ['Experiment'] + sorted(columns)),
+        'spec': params_signature(*specs, span, ncols, limits, export),
+        'versions': versions,
+    }
+
+
+@stage('render_matched_grid')
+def render_matched_grid(out_dir, names=None, span=MATCHED_Y_SPAN, ncols=3, offline=None, force=False, export=None):
+    """
+    Render the matched y scale table to <out_dir>/matched_y_scale/in_table/, skipped like the figures in
+    render_all() when it is up to date in the build cache. Returns ({file: [reasons]}, [file]) like render_all().
+    """
+    specs = [FIGURE_SPECS[name] for name in (names or _MATCHED_Y_NAMES)]
+    combined_df = read_dataset('COMBINED_DATA', offline=offline)
+    limits = saturation_limits(MEASURED_SALINITY, MEASURED_TEMPERATURE)
+    output = _output_name(os.path.join(*MATCHED_GRID_FILE), export)
+
+    cache = BuildCache(out_dir)
+    signature = grid_signature(specs, combined_df, span, ncols, limits, versions_signature(SOURCE_FILES), export)
+    reasons = ['forced'] if force else cache.reasons_to_build(output, signature)
+    if not reasons:
+        return {}, [output]
+    fig = build_matched_grid(combined_df, [spec.name for spec in specs], span, ncols, limits)
+    _save(fig, os.path.join(out_dir, output), export)
+    cache.record(output, signature)
+    cache.save()
+    return {output: reasons}, []
@@ -0,0 +1,172 @@
+"""
+Registry of the calibrated sample flasks
+
+Every titration row carries its Bottle number and FlaskVol, and the same flasks turn up again and again across
+experiments and instruments, but nothing checked that a bottle always has the same volume. FlaskRegistry is
+built once from every data file: it keeps the history of volumes recorded for each bottle (which file, how
+many times) and a lookup table indexed directly by bottle number, so checking or filling the volumes of any
+number of rows is one array lookup rather than a filter per row.
+
+    registry = FlaskRegistry.from_datasets()
+    registry.check(df)                 volume recorded on each row against the registry, with flags
+    registry.fill(df)                  fill in missing FlaskVol from the registry
+    volume_drift(df, registry)         bottles whose volume implied by the titrations has moved
+
+"""
+
+import numpy as np
+import pandas as pd
+
+from titration_calc import (O2_ML_PER_EQUIVALENT, REAGENT_OXYGEN, REAGENT_VOLUME, calibration_for_rows,
+                            leave_out_calibration)
+
+# Difference from the registered volume (mL) before a row's FlaskVol is flagged
+VOLUME_TOLERANCE = 0.005
+
+# Difference (mL) between the median volume implied by a bottle's titrations and its registered volume before
+# the bottle is flagged. O2ml/L is reported to 3 decimal places which alone scatters single titrations by a few
+# hundredths of a mL, the in2020_e01 bottles all sit within 0.045 mL.
+DRIFT_TOLERANCE = 0.1
+
+# Decimal places volumes are compared at. The store keeps FlaskVol as float32, which is good to ~1e-5 mL for
+# these flasks, so 142.19 read from a CSV and 142.19 read back from the store are recorded as the same volume
+VOLUME_DECIMALS = 4
+
+HISTORY_COLUMNS = ['Bottle', 'FlaskVol', 'source', 'count']
+
+
+class FlaskRegistry:
+    """Calibrated volume of every bottle, with the history of volumes it has been recorded with"""
+
+    def __init__(self, history=None):
+        self.history = pd.DataFrame(columns=HISTORY_COLUMNS) if history is None else history[HISTORY_COLUMNS]
+        self._build_lookup()
+
+    def _build_lookup(self):
+        history = self.history
+        bottles = history['Bottle'].to_numpy(dtype=np.int64)
+        size = int(bottles.max()) + 1 if len(bottles) else 0
+        self.volumes = np.full(size, np.nan)
+        self.n_volumes = np.zeros(size, dtype=np.int64)
+        if not size:
+            return
+
+        # The registered volume is the one a bottle has been recorded with most often
+        totals = history.groupby(['Bottle', 'FlaskVol'], sort=False)['count'].sum().reset_index()
+        totals = totals.sort_values(['Bottle', 'count'], kind='stable')
+        registered = totals.drop_duplicates('Bottle', keep='last')
+        self.volumes[registered['Bottle'].to_numpy(dtype=np.int64)] = registered['FlaskVol'].to_numpy()
+        np.add.at(self.n_volumes, totals['Bottle'].to_numpy(dtype=np.int64), 1)
+
+    @classmethod
+    def from_frames(cls, frames):
+        """Build from {source name: titration frame}"""
+        registry = cls()
+        for source, df in frames.items():
+            registry.add(df, source, rebuild=False)
+        registry._build_lookup()
+        return registry
+
+    @classmethod
+    def from_datasets(cls, names=None, offline=None):
+        """Build from the data files (default: every per-experiment file, combined.csv repeats them)"""
+        from data_access import read_dataset
+        from titration_store import DATASET_EXPERIMENTS
+
+        names = list(DATASET_EXPERIMENTS) if names is None else names
+        return cls.from_frames({name: read_dataset(name, offline=offline) for name in names})
+
+    def add(self, df, source, rebuild=True):
+        """Record the bottle volumes seen in another frame, rows without a FlaskVol are left out"""
+        recorded = df.loc[df['Bottle'].notna() & df['FlaskVol'].notna(), ['Bottle', 'FlaskVol']]
+        recorded = recorded.assign(FlaskVol=recorded['FlaskVol'].to_numpy(dtype=np.float64).round(VOLUME_DECIMALS))
+        counts = recorded.groupby(['Bottle', 'FlaskVol']).size().rename('count').reset_index()
+        counts['Bottle'] = counts['Bottle'].astype(np.int64)
+        counts['source'] = source
+        frames = [frame for frame in (self.history, counts[HISTORY_COLUMNS]) if len(frame)]
+        self.history = pd.concat(frames, ignore_index=True) if frames else self.history
+        if rebuild:
+            self._build_lookup()
+
+    def lookup(self, bottles):
+        """Registered volume of each bottle, NaN for bottles the registry hasn't seen"""
+        bottles = np.asarray(bottles, dtype=np.float64)
+        known = np.isfinite(bottles) & (bottles >= 0) & (bottles < len(self.volumes))
+        volumes = np.full(bottles.shape, np.nan)
+        volumes[known] = self.volumes[bottles[known].astype(np.int64)]
+        return volumes
+
+    def check(self, df, tolerance=VOLUME_TOLERANCE):
+        """
+        Compare each row's FlaskVol with the registry.
+
+        Returns a frame on df's index with the registered volume, the difference, 'unknown bottle' for bottles not
+        in the registry and 'FlaskVol flag' for rows more than tolerance from the registered volume.
+        """
+        registered = self.lookup(df['Bottle'])
+        difference = df['FlaskVol'].to_numpy(dtype=np.float64) - registered
+        return pd.DataFrame({
+            'FlaskVol registry': registered,
+            'FlaskVol diff': difference,
+            'unknown bottle': np.isnan(registered),
+            'FlaskVol flag': np.abs(difference) > tolerance,
+        }, index=df.index)
+
+    def fill(self, df):
+        """Copy of df with missing FlaskVol values filled in from the registry"""
+        filled = df.copy()
+        missing = filled['FlaskVol'].isna().to_numpy()
+        if missing.any():
+            filled.loc[missing, 'FlaskVol'] = self.lookup(filled.loc[missing, 'Bottle'])
+        return filled
+
+    def inconsistent_bottles(self):
+        """History of the bottles that have been recorded with more than one volume"""
+        bottles = np.flatnonzero(self.n_volumes > 1)
+        return self.history.loc[self.history['Bottle'].isin(bottles)].sort_values(['Bottle', 'source'])
+
+    def save(self, path):
+        pd.to_pickle({'history': self.history}, path)
+
+    @classmethod
+    def load(cls, path):
+        return cls(pd.read_pickle(path)['history'])
+
+
+def implied_flask_volume(df, calibration, reagent_volume=REAGENT_VOLUME, reagent_oxygen=REAGENT_OXYGEN):
+    """
+    Flask volume each row's O2ml/L implies, given its titre and the instrument calibration. calibration is a
+    calibration table, or the (normality, blank) arrays for every row
+    """
+    normality, blank = calibration if isinstance(calibration, tuple) else calibration_for_rows(df, calibration)
+    titre20 = df['Titre20'].to_numpy(dtype=np.float64)
+    oxygen_ml = df['O2ml/L'].to_numpy(dtype=np.float64)
+    return (titre20 - blank) * normality * O2_ML_PER_EQUIVALENT / (oxygen_ml + reagent_oxygen) + reagent_volume
+
+
+def volume_drift(df, registry, calibration=None, tolerance=DRIFT_TOLERANCE):
+    """
+    Per bottle comparison of the volume implied by its titrations with its registered volume.
+
+    calibration defaults to leave_out_calibration(df): each bottle is checked against the calibration fitted from
+    every other bottle on its instrument, otherwise a bottle whose FlaskVol is off pulls the calibration towards
+    itself and hides part of its own drift (worst on the instruments with few bottles). Returns one row per
+    bottle with the number of titrations, the registered volume, the median implied volume, the drift between
+    them, how many volumes the bottle has been recorded with and whether it is flagged (drift beyond tolerance
+    or recorded with more than one volume).
+    """
+    calibration = leave_out_calibration(df, 'Bottle') if calibration is None else calibration
+    rows = pd.DataFrame({'Bottle': df['Bottle'].to_numpy(), 'implied': implied_flask_volume(df, calibration)})
+    rows = rows.loc[rows['Bottle'].notna()]
+    stats = rows.groupby('Bottle')['implied'].agg(['count', 'median'])
+    stats.columns = ['n', 'implied volume']
+    bottles = stats.index.to_numpy(dtype=np.int64)
+    stats.insert(1, 'registered volume', registry.lookup(bottles))
+    stats['drift'] = stats['implied volume'] - stats['registered volume']
+
+    recorded = np.zeros(len(bottles), dtype=np.int64)
+    in_registry = bottles < len(registry.n_volumes)
+    recorded[in_registry] = registry.n_volumes[bottles[in_registry]]
+    stats['recorded volumes'] = recorded
+    stats['flagged'] = (stats['drift'].abs() > tolerance) | (stats['recorded volumes'] > 1)
+    return stats
@@ -0,0 +1,299 @@
+"""
+Grouped statistics engine for the titration data
+
+Replaces the repeated groupby(['Instrument'])['O2µmol/L'].describe() / .median() / .std() calls in
+DO_Commissioning.py. describe_groups() gets count, mean, std, min, quartiles and max for every group (by default
+every Experiment + Instrument pair, add 'Pressure' for the profile) with one sort and a handful of bincounts over
+the whole table, instead of a python level loop per group.
+
+For summaries that need to be built up a voyage at a time there is GroupSummary. It keeps the mergeable parts of
+the statistics per group (Welford/Chan count, mean and sum of squared deviations, min, max plus a fixed width
+histogram sketch for the quantiles), so per-voyage summaries can be merged without going back to the raw rows.
+
+"""
+
+import numpy as np
+import pandas as pd
+
+from profiling import stage
+
+VALUE_COLUMN = 'O2µmol/L'
+DEFAULT_GROUP_KEYS = ['Experiment', 'Instrument']
+DEFAULT_QUANTILES = (0.25, 0.5, 0.75)
+
+# Width of the histogram bins used by GroupSummary, 0.001 µmol/L is well below the reporting precision
+DEFAULT_BIN_WIDTH = 0.001
+
+
+def _quantile_label(q):
+    return f'{q * 100:g}%'
+
+
+def group_codes(df, by, dropna=False):
+    """
+    Give every row an integer code for the group it falls in.
+
+    Returns (codes, group index). The groups are sorted the same way pandas groupby sorts them. With
+    dropna=False blank keys (e.g. Pressure for the bench top experiments) are kept as their own group, with
+    dropna=True those rows get a code of -1.
+    """
+    by = [by] if isinstance(by, str) else list(by)
+    key_codes = []
+    key_uniques = []
+    valid = np.ones(len(df), dtype=bool)
+    for key in by:
+        codes, uniques = pd.factorize(df[key], sort=True, use_na_sentinel=dropna)
+        if dropna:
+            valid &= codes >= 0
+        key_codes.append(np.where(codes >= 0, codes, 0))
+        key_uniques.append(uniques)
+
+    shape = tuple(max(len(uniques), 1) for uniques in key_uniques)
+    combined = np.ravel_multi_index(key_codes, shape)
+    observed, codes = np.unique(combined[valid], return_inverse=True)
+    row_codes = np.full(len(df), -1, dtype=np.int64)
+    row_codes[valid] = codes
+
+    positions = np.unravel_index(observed, shape)
+    levels = [np.asarray(uniques)[position] for uniques, position in zip(key_uniques, positions)]
+    if len(by) == 1:
+        index = pd.Index(levels[0], name=by[0])
+    else:
+        index = pd.MultiIndex.from_arrays(levels, names=by)
+    return row_codes, index
+
+
+def _segment_quantiles(sorted_values, starts, counts, q):
+    # Linear interpolation between the closest ranks, same as pandas/numpy default
+    position = (counts - 1) * q
+    lower = np.floor(position).astype(np.int64)
+    upper = np.minimum(lower + 1, counts - 1)
+    fraction = position - lower
+    low_values = sorted_values[starts + lower]
+    upp_values = sorted_values[starts + upper]
+    return low_values + (upp_values - low_values) * fraction
+
+
+@stage('describe_groups')
+def describe_groups(df, by=None, value=VALUE_COLUMN, quantiles=DEFAULT_QUANTILES, dropna=False):
+    """
+    Equivalent of df.groupby(by)[value].describe() computed in one vectorized pass.
+
+    The 50% column is the median. Counts are returned as floats to match pandas' describe output.
+    """
+    by = DEFAULT_GROUP_KEYS if by is None else by
+    codes, index = group_codes(df, by, dropna=dropna)
+    values = df[value].to_numpy(dtype=np.float64)
+
+    keep = (codes >= 0) & ~np.isnan(values)
+    codes = codes[keep]
+    values = values[keep]
+    n_groups = len(index)
+
+    counts = np.bincount(codes, minlength=n_groups)
+    sums = np.bincount(codes, weights=values, minlength=n_groups)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = sums / counts
+        deviations = np.bincount(codes, weights=(values - means[codes]) ** 2, minlength=n_groups)
+        stds = np.sqrt(deviations / (counts - 1))
+    stds[counts < 2] = np.nan
+
+    result = {'count': counts.astype(np.float64), 'mean': means, 'std': stds}
+
+    # One sort by (group, value) gives min, max and all the quantiles as lookups into each group's segment
+    order = np.lexsort((values, codes))
+    sorted_values = values[order]
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    occupied = counts > 0
+    safe_counts = np.where(occupied, counts, 1)
+    safe_starts = np.minimum(starts, max(len(sorted_values) - 1, 0))
+
+    def lookup(q):
+        if len(sorted_values) == 0:
+            return np.full(n_groups, np.nan)
+        return np.where(occupied, _segment_quantiles(sorted_values, safe_starts, safe_counts, q), np.nan)
+
+    result['min'] = lookup(0.0)
+    for q in quantiles:
+        result[_quantile_label(q)] = lookup(q)
+    result['max'] = lookup(1.0)
+
+    return pd.DataFrame(result, index=index)
+
+
+def group_medians(df, by=None, value=VALUE_COLUMN, dropna=False):
+    return describe_groups(df, by, value, quantiles=(0.5,), dropna=dropna)['50%'].rename('median')
+
+
+def group_stds(df, by=None, value=VALUE_COLUMN, dropna=False):
+    return describe_groups(df, by, value, quantiles=(), dropna=dropna)['std']
+
+
+def _batch_moments(df, by, value, dropna):
+    codes, index = group_codes(df, by, dropna=dropna)
+    values = df[value].to_numpy(dtype=np.float64)
+    keep = (codes >= 0) & ~np.isnan(values)
+    codes = codes[keep]
+    values = values[keep]
+    n_groups = len(index)
+
+    counts = np.bincount(codes, minlength=n_groups).astype(np.float64)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = np.bincount(codes, weights=values, minlength=n_groups) / counts
+    m2 = np.bincount(codes, weights=(values - means[codes]) ** 2, minlength=n_groups)
+    mins = np.full(n_groups, np.inf)
+    maxs = np.full(n_groups, -np.inf)
+    np.minimum.at(mins, codes, values)
+    np.maximum.at(maxs, codes, values)
+
+    moments = pd.DataFrame({'count': counts, 'mean': means, 'm2': m2, 'min': mins, 'max': maxs}, index=index)
+    return moments[moments['count'] > 0], codes, values, index
+
+
+def merge_moments(a, b):
+    """Combine two moment tables (count, mean, m2, min, max per group) using Chan's parallel update"""
+    groups = a.index.union(b.index)
+    a = a.reindex(groups)
+    b = b.reindex(groups)
+    n_a = a['count'].fillna(0).to_numpy()
+    n_b = b['count'].fillna(0).to_numpy()
+    mean_a = a['mean'].fillna(0).to_numpy()
+    mean_b = b['mean'].fillna(0).to_numpy()
+    n = n_a + n_b
+    delta = mean_b - mean_a
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.where(n > 0, mean_a + delta * n_b / n, np.nan)
+        m2 = a['m2'].fillna(0).to_numpy() + b['m2'].fillna(0).to_numpy() + delta ** 2 * n_a * n_b / n
+    return pd.DataFrame({
+        'count': n,
+        'mean': mean,
+        'm2': m2,
+        'min': np.fmin(a['min'].to_numpy(), b['min'].to_numpy()),
+        'max': np.fmax(a['max'].to_numpy(), b['max'].to_numpy()),
+    }, index=groups)
+
+
+class GroupSummary:
+    """
+    Mergeable per-group summary of a value column.
+
+    Moments are exact. Quantiles come from a fixed width histogram so they are accurate to within bin_width,
+    which keeps the sketch mergeable by just adding the bin counts together.
+    """
+
+    def __init__(self, by=None, value=VALUE_COLUMN, bin_width=DEFAULT_BIN_WIDTH, dropna=False):
+        self.by = list(DEFAULT_GROUP_KEYS if by is None else ([by] if isinstance(by, str) else by))
+        self.value = value
+        self.bin_width = bin_width
+        self.dropna = dropna
+        self.moments = pd.DataFrame(columns=['count', 'mean', 'm2', 'min', 'max'], dtype=np.float64)
+        self.histogram = pd.Series(dtype=np.int64)
+
+    @classmethod
+    def from_frame(cls, df, **kwargs):
+        summary = cls(**kwargs)
+        summary.update(df)
+        return summary
+
+    def _check_compatible(self, other):
+        if other.by != self.by or other.value != self.value or other.bin_width != self.bin_width:
+            raise ValueError('Can only merge summaries with the same group keys, value column and bin width')
+
+    def update(self, df):
+        """Fold a batch of rows (e.g. one voyage, or newly appended titrations) into the summary"""
+        moments, codes, values, index = _batch_moments(df, self.by, self.value, self.dropna)
+        if len(moments) == 0:
+            return self
+
+        bins = np.floor(values / self.bin_width).astype(np.int64)
+        pairs, pair_counts = np.unique(np.stack([codes, bins]), axis=1, return_counts=True)
+        group_keys = index[pairs[0]]
+        if isinstance(group_keys, pd.MultiIndex):
+            levels = [group_keys.get_level_values(i) for i in range(group_keys.nlevels)]
+        else:
+            levels = [group_keys]
+        histogram = pd.Series(pair_counts, index=pd.MultiIndex.from_arrays(levels + [pairs[1]],
+                                                                          names=self.by + ['bin']))
+        self._merge_state(moments, histogram)
+        return self
+
+    def merge(self, other):
+        """Merge another summary into this one, as if both batches of rows had been seen by this summary"""
+        self._check_compatible(other)
+        self._merge_state(other.moments, other.histogram)
+        return self
+
+    def _merge_state(self, moments, histogram):
+        if len(self.moments) == 0:
+            self.moments = moments.copy()
+        else:
+            self.moments = merge_moments(self.moments, moments)
+        if len(self.histogram) == 0:
+            self.histogram = histogram.copy()
+        else:
+            self.histogram = self.histogram.add(histogram, fill_value=0).astype(np.int64)
+
+    def quantiles(self, quantiles=DEFAULT_QUANTILES):
+        """
+        Approximate quantiles per group from the histogram sketch.
+
+        Uses the same linear interpolation between ranks as describe_groups(), with each order statistic read
+        off as the middle of the bin it falls in.
+        """
+        codes, index = group_codes(self.histogram.index.droplevel('bin').to_frame(index=False), self.by,
+                                   dropna=False)
+        bins = self.histogram.index.get_level_values('bin').to_numpy()
+        order = np.lexsort((bins, codes))
+        codes = codes[order]
+        centres = (bins[order] + 0.5) * self.bin_width
+        cumulative = np.cumsum(self.histogram.to_numpy()[order])
+
+        totals = np.bincount(codes, weights=self.histogram.to_numpy()[order]).astype(np.int64)
+        group_start = np.concatenate(([0], np.cumsum(totals)[:-1]))
+
+        def order_statistic(rank):
+            return centres[np.searchsorted(cumulative, group_start + rank, side='right')]
+
+        result = {}
+        for q in quantiles:
+            position = (totals - 1) * q
+            lower = np.floor(position).astype(np.int64)
+            upper = np.minimum(lower + 1, totals - 1)
+            low_values = order_statistic(lower)
+            result[_quantile_label(q)] = low_values + (order_statistic(upper) - low_values) * (position - lower)
+        return pd.DataFrame(result, index=index)
+
+    def describe(self, quantiles=DEFAULT_QUANTILES):
+        """Same columns as describe_groups(), with the quantiles taken from the sketch"""
+        if len(self.moments) == 0:
+            columns = ['count', 'mean', 'std', 'min'] + [_quantile_label(q) for q in quantiles] + ['max']
+            index = pd.MultiIndex.from_arrays([[] for _ in self.by], names=self.by)
+            return pd.DataFrame(columns=columns, index=index, dtype=np.float64)
+        # Put the groups in the same order group_codes() gives, which is the order the sketch comes back in
+        codes, index = group_codes(self.moments.index.to_frame(index=False), self.by, dropna=False)
+        moments = self.moments.iloc[np.argsort(codes)].set_axis(index)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            std = np.sqrt(moments['m2'] / (moments['count'] - 1))
+        std[moments['count'] < 2] = np.nan
+        table = pd.DataFrame({'count': moments['count'], 'mean': moments['mean'], 'std': std,
+                              'min': moments['min']})
+        if len(quantiles):
+            sketch = self.quantiles(quantiles).set_axis(index)
+            # The sketch can't place a quantile outside the real range of the data
+            for column in sketch.columns:
+                table[column] = sketch[column].clip(moments['min'], moments['max'])
+        table['max'] = moments['max']
+        return table
+
+    def save(self, path):
+        """Persist the summary so a later voyage can be merged into it"""
+        pd.to_pickle({'by': self.by, 'value': self.value, 'bin_width': self.bin_width, 'dropna': self.dropna,
+                      'moments': self.moments, 'histogram': self.histogram}, path)
+
+    @classmethod
+    def load(cls, path):
+        state = pd.read_pickle(path)
+        summary = cls(by=state['by'], value=state['value'], bin_width=state['bin_width'], dropna=state['dropna'])
+        summary.moments = state['moments']
+        summary.histogram = state['histogram']
+        return summary
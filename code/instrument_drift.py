@@ -0,0 +1,200 @@
+"""
+Titration times and instrument drift through a session
+
+TitreTime is written by the instruments as an HHMMSS number without the leading zeros (155700 is 15:57:00,
+2101 is 00:21:01) and nothing in DO_Commissioning.py used it. titration_timestamps() turns the whole column into
+times in one go, carrying the clock over midnight when a session runs past it, so the samples can be put in the
+order they were titrated and drift through a session shows up:
+
+    rolling_drift(df)                   rolling mean, std and slope of O2µmol/L, EndVolts and ThioTemp
+    rolling_drift(df, window='1h')      the same over the titrations in the last hour rather than the last 10
+    drift_summary(df)                   straight line fit through each whole session
+
+The rolling statistics are pandas rolling windows (added to and removed from one sample at a time) with the
+window bounds worked out up front for every row, so each instrument's series is split off without any per-row
+Python however many titrations there are.
+
+"""
+
+import numpy as np
+import pandas as pd
+import scipy.stats as sci_st
+from pandas.api.indexers import BaseIndexer
+
+from profiling import stage
+
+TIME_COLUMN = 'TitreTime'
+TIMESTAMP_COLUMN = 'Timestamp'
+
+# Rows from the same instrument in the same experiment were run as one session
+SESSION_COLUMNS = ['Experiment', 'Instrument']
+DRIFT_COLUMNS = ['O2µmol/L', 'EndVolts', 'ThioTemp']
+
+# Titrations are a few minutes apart, so a clock that goes back by more than this has passed midnight. Smaller
+# steps back are left alone, some files have a later batch of samples listed before an earlier one.
+ROLLOVER_GAP = pd.Timedelta(hours=12)
+
+# Number of titrations in a rolling window, and the fewest a statistic is given for
+DEFAULT_WINDOW = 10
+MIN_PERIODS = 3
+
+
+def seconds_of_day(titre_time):
+    """Seconds since midnight for HHMMSS values, NaN for anything that isn't a valid time of day"""
+    values = pd.to_numeric(pd.Series(np.asarray(titre_time).ravel()), errors='coerce').to_numpy(dtype=np.float64)
+    hours, rest = np.divmod(values, 10000)
+    minutes, seconds = np.divmod(rest, 100)
+    valid = (values >= 0) & (values == np.floor(values)) & (hours < 24) & (minutes < 60) & (seconds < 60)
+    return np.where(valid, hours * 3600 + minutes * 60 + seconds, np.nan)
+
+
+def _session_codes(df, session):
+    session = [column for column in ([session] if isinstance(session, str) else session) if column in df]
+    if not session:
+        return np.zeros(len(df), dtype=np.int64)
+    return df.groupby(session, observed=True, sort=False, dropna=False).ngroup().to_numpy()
+
+
+def titration_timestamps(df, run_date=None, session=SESSION_COLUMNS, time=TIME_COLUMN, gap=ROLLOVER_GAP):
+    """
+    Time of every titration from its TitreTime.
+
+    Rows are taken in file order within each session (the session columns that aren't in df are ignored) and a
+    day is added every time the clock goes back by more than gap. run_date is the date each session started on,
+    either one date for everything or the name of a column of df. Without it the times are Timedeltas from
+    midnight of the day the session started.
+    """
+    codes = _session_codes(df, session)
+    seconds = pd.Series(seconds_of_day(df[time]), index=df.index)
+
+    # Compare each time with the last valid one before it in the same session
+    previous = seconds.groupby(codes).ffill().groupby(codes).shift()
+    rolled_over = (seconds < previous - gap.total_seconds()).astype(np.int64)
+    days = rolled_over.groupby(codes).cumsum()
+    offsets = pd.to_timedelta(days * 86400 + seconds, unit='s')
+    if run_date is None:
+        return offsets.rename(TIMESTAMP_COLUMN)
+
+    if isinstance(run_date, str) and run_date in df:
+        dates = pd.to_datetime(df[run_date]).dt.normalize()
+    else:
+        dates = pd.Timestamp(run_date).normalize()
+    return (dates + offsets).rename(TIMESTAMP_COLUMN)
+
+
+def _hours(times):
+    """Timestamps or Timedeltas as float hours, NaN where missing"""
+    times = pd.Series(times)
+    if times.dtype.kind == 'M':
+        times = times - pd.Timestamp(0, tz=times.dt.tz)
+    if times.dtype.kind == 'm':
+        return times.dt.total_seconds().to_numpy(dtype=np.float64) / 3600
+    return times.to_numpy(dtype=np.float64)
+
+
+class _Windows(BaseIndexer):
+    """Precomputed window bounds, start and end are given to the constructor"""
+
+    def get_window_bounds(self, num_values=0, min_periods=None, center=None, closed=None, step=None):
+        return self.start, self.end
+
+
+def _window_bounds(codes, hours, window):
+    """Start (inclusive) and end (exclusive) of each sorted row's window, never reaching back past its group"""
+    n = len(codes)
+    positions = np.arange(n)
+    group_start = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]]) if n else np.zeros(0, dtype=np.int64)
+    first = np.repeat(group_start, np.diff(np.r_[group_start, n]))
+    if isinstance(window, (int, np.integer)):
+        if window < 1:
+            raise ValueError(f'window has to be at least 1, got {window}')
+        start = np.maximum(positions - window + 1, first)
+    else:
+        # Times only increase within a group, spacing the groups further apart than the window keeps them
+        # increasing across the whole array so one searchsorted finds every start: the window is (t - window, t]
+        length = pd.Timedelta(window) / pd.Timedelta(hours=1)
+        spacing = (np.nanmax(hours) - np.nanmin(hours) if n else 0) + 2 * length + 1
+        keys = codes * spacing + hours
+        start = np.maximum(np.searchsorted(keys, keys - length, side='right'), first)
+    return start.astype(np.int64), positions.astype(np.int64) + 1
+
+
+@stage('rolling_drift')
+def rolling_drift(df, columns=DRIFT_COLUMNS, by=SESSION_COLUMNS, window=DEFAULT_WINDOW, times=None, run_date=None,
+                  min_periods=MIN_PERIODS):
+    """
+    Rolling mean, standard deviation and slope of each column per instrument session.
+
+    window is either a number of titrations or a time span ('1h', pd.Timedelta(minutes=30)), ending at each
+    titration. times defaults to titration_timestamps(df, run_date), with run dates by can be just 'Instrument'
+    to follow each instrument across sessions. Returns a frame on df's index with the Timestamp, the number of
+    titrations in the window ('n window') and '<column> mean', '<column> std' and '<column> slope' (change per
+    hour) for every column, NaN when the window has fewer than min_periods values.
+    """
+    times = titration_timestamps(df, run_date) if times is None else pd.Series(times, index=df.index)
+    codes = _session_codes(df, by)
+    hours = _hours(times)
+
+    # Put every session's rows together in time order, rows without a time are left out
+    keep = np.flatnonzero(~np.isnan(hours))
+    order = keep[np.lexsort((hours[keep], codes[keep]))]
+    sorted_codes, sorted_hours = codes[order], hours[order]
+    if len(order):
+        # Hours from the start of each session keeps the sums small
+        group_first = pd.Series(sorted_hours).groupby(sorted_codes).transform('first').to_numpy()
+        sorted_hours = sorted_hours - group_first
+    start, end = _window_bounds(sorted_codes, sorted_hours, window)
+    windows = _Windows(start=start, end=end)
+
+    result = pd.DataFrame({TIMESTAMP_COLUMN: times}, index=df.index)
+    sorted_index = df.index[order]
+    elapsed = pd.Series(sorted_hours)
+    result['n window'] = pd.Series((end - start).astype(np.int64), index=sorted_index).reindex(df.index)
+    for column in columns:
+        values = pd.Series(df[column].to_numpy(dtype=np.float64)[order])
+        rolling = values.rolling(windows, min_periods=min_periods)
+        # Least squares slope against time, only over the titrations that have a value
+        slope = elapsed.rolling(windows, min_periods=min_periods).cov(values)
+        slope = slope / (elapsed + 0 * values).rolling(windows, min_periods=min_periods).var()
+        stats = pd.DataFrame({f'{column} mean': rolling.mean().to_numpy(), f'{column} std': rolling.std().to_numpy(),
+                              f'{column} slope': slope.to_numpy()}, index=sorted_index)
+        result = result.join(stats)
+    return result
+
+
+def drift_summary(df, columns=DRIFT_COLUMNS, by=SESSION_COLUMNS, times=None, run_date=None):
+    """
+    Straight line fit of each column against time over every whole session.
+
+    Returns one row per (session, column) with the number of titrations, the session length in hours, the
+    slope (per hour) with its standard error and p-value, and the change the slope adds up to over the session.
+    """
+    times = titration_timestamps(df, run_date) if times is None else pd.Series(times, index=df.index)
+    by = [column for column in ([by] if isinstance(by, str) else by) if column in df]
+    keys = df[by].reset_index(drop=True) if by else pd.DataFrame(index=range(len(df)))
+    hours = _hours(times)
+
+    frames = []
+    for column in columns:
+        values = df[column].to_numpy(dtype=np.float64)
+        valid = ~np.isnan(values) & ~np.isnan(hours)
+        data = keys.loc[valid].assign(t=hours[valid], y=values[valid])
+        groups = data.groupby(by, observed=True, sort=True) if by else data.groupby(np.zeros(len(data)))
+        # Centre on the session means before summing the products
+        data['t'] -= groups['t'].transform('mean')
+        data['y'] -= groups['y'].transform('mean')
+        data['tt'], data['ty'], data['yy'] = data['t'] ** 2, data['t'] * data['y'], data['y'] ** 2
+        groups = data.groupby(by, observed=True, sort=True) if by else data.groupby(np.zeros(len(data)))
+        sums = groups[['tt', 'ty', 'yy']].sum()
+        n = groups.size()
+        span = groups['t'].max() - groups['t'].min()
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            slope = sums['ty'] / sums['tt']
+            residual = (sums['yy'] - slope * sums['ty']).clip(lower=0)
+            stderr = np.sqrt(residual / (n - 2) / sums['tt'])
+            t_stat = slope / stderr
+        frame = pd.DataFrame({'column': column, 'n': n, 'hours': span, 'slope': slope, 'slope stderr': stderr,
+                              'p_value': 2 * sci_st.t.sf(np.abs(t_stat), n - 2), 'change': slope * span})
+        frames.append(frame.reset_index(drop=not by))
+    return pd.concat(frames, ignore_index=True)
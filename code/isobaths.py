@@ -0,0 +1,161 @@
+"""
+Cached, resolution adaptive isobath contours for the maps
+
+ax.contour() traces the isobaths over every point of the GEBCO block on every run, even though the extent and
+levels hardly ever change and a 30 arc second grid has far more points than the map has pixels once it spans
+more than a few degrees. Here the elevation grid is first reduced to about one point per output pixel through a
+pyramid of 2x2 block means, the isobaths are traced once on that level with contourpy (what matplotlib uses
+underneath) and the resulting paths are cached on disk keyed by (bathymetry file, extent, levels, output size).
+
+    paths = isobath_paths(BathymetryReader(GEBCO_PATH), extent, LEVELS, axes_pixels(ax))
+    contours = contour_set(ax, paths, transform=ccrs.PlateCarree(), cmap='bone', linewidths=0.5)
+    ax.clabel(contours, LEVELS, fmt=...)
+
+contour_set() gives back a normal matplotlib ContourSet, so clabel and colour mapping work as before.
+
+Cache layout:
+    <cache dir>/isobaths/<hash>.npz   - vertices and path offsets of every level
+
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+
+import numpy as np
+
+from data_access import cache_dir
+from profiling import stage
+
+# Isobaths drawn on the deployment map and their labels
+DEFAULT_LEVELS = (-6000, -5000, -4000, -3000, -2000, -1000, -500)
+
+# Default output size in pixels when there are no axes to measure, the 15 x 8 inch map at 100 dpi
+DEFAULT_PIXELS = (1500, 800)
+
+
+def isobath_dir(root=None):
+    return os.path.join(root or cache_dir(), 'isobaths')
+
+
+def axes_pixels(ax, dpi=None):
+    """Width and height of an axes in output pixels (at dpi, default the figure's own)"""
+    bbox = ax.get_position()
+    fig_width, fig_height = ax.figure.get_size_inches()
+    dpi = dpi or ax.figure.dpi
+    return int(round(bbox.width * fig_width * dpi)), int(round(bbox.height * fig_height * dpi))
+
+
+def decimation_factor(grid_shape, pixels):
+    """Largest power of two reduction that still leaves at least one grid point per pixel along both axes"""
+    rows, columns = grid_shape
+    width, height = pixels
+    factor = 1
+    while rows // (factor * 2) >= height and columns // (factor * 2) >= width:
+        factor *= 2
+    return factor
+
+
+def _block_mean(values, axis):
+    length = values.shape[axis] // 2 * 2
+    trimmed = np.take(values, np.arange(length), axis=axis)
+    shape = list(trimmed.shape)
+    shape[axis:axis + 1] = [length // 2, 2]
+    return trimmed.reshape(shape).mean(axis=axis + 1)
+
+
+class ElevationPyramid:
+    """A grid and its successive 2x2 block mean reductions, built as far down as they are asked for"""
+
+    def __init__(self, lon, lat, height):
+        self.levels = {1: (np.asarray(lon, dtype=np.float64), np.asarray(lat, dtype=np.float64),
+                           np.asarray(height, dtype=np.float32))}
+
+    @property
+    def shape(self):
+        return self.levels[1][2].shape
+
+    def level(self, factor):
+        """The grid reduced by factor (a power of two) along both axes"""
+        if factor not in self.levels:
+            lon, lat, height = self.level(factor // 2)
+            self.levels[factor] = (_block_mean(lon, 0), _block_mean(lat, 0),
+                                   _block_mean(_block_mean(height, 0), 1))
+        return self.levels[factor]
+
+
+def trace_isobaths(lon, lat, height, levels=DEFAULT_LEVELS):
+    """{level: [(n, 2) arrays of lon/lat vertices]} for every level"""
+    import contourpy
+
+    generator = contourpy.contour_generator(lon, lat, height, line_type=contourpy.LineType.Separate)
+    return {level: [np.asarray(line) for line in generator.lines(level)] for level in levels}
+
+
+def grid_isobaths(lon, lat, height, levels=DEFAULT_LEVELS, pixels=DEFAULT_PIXELS):
+    """Trace the isobaths on the pyramid level matching the output size"""
+    pyramid = ElevationPyramid(lon, lat, height)
+    return trace_isobaths(*pyramid.level(decimation_factor(pyramid.shape, pixels)), levels)
+
+
+def cache_key(source, extent, levels, pixels):
+    content = json.dumps([source, [float(value) for value in extent], [float(level) for level in levels],
+                          list(pixels)])
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()[:32]
+
+
+def save_paths(paths, path):
+    arrays = {}
+    for index, (level, lines) in enumerate(paths.items()):
+        arrays[f'level_{index}'] = np.array(level, dtype=np.float64)
+        arrays[f'vertices_{index}'] = np.concatenate(lines) if lines else np.empty((0, 2))
+        arrays[f'offsets_{index}'] = np.cumsum([0] + [len(line) for line in lines])
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.npz')
+    with os.fdopen(fd, 'wb') as file:
+        np.savez(file, **arrays)
+    os.replace(temp_path, path)
+
+
+def load_paths(path):
+    with np.load(path) as arrays:
+        count = sum(name.startswith('level_') for name in arrays.files)
+        paths = {}
+        for index in range(count):
+            level = arrays[f'level_{index}'].item()
+            vertices, offsets = arrays[f'vertices_{index}'], arrays[f'offsets_{index}']
+            paths[int(level) if level.is_integer() else level] = [vertices[start:stop]
+                                                                  for start, stop in zip(offsets[:-1], offsets[1:])]
+    return paths
+
+
+def isobath_paths(reader, extent, levels=DEFAULT_LEVELS, pixels=DEFAULT_PIXELS, root=None, cache=True):
+    """
+    Isobath paths for extent from a BathymetryReader, served from the cache when they have been traced before
+    for the same file, extent, levels and output size.
+    """
+    path = os.path.join(isobath_dir(root), cache_key(reader.source, extent, levels, pixels) + '.npz')
+    if cache and os.path.exists(path):
+        return load_paths(path)
+    with stage('gebco_read'):
+        grid = reader.window(extent)
+    with stage('trace_isobaths'):
+        paths = grid_isobaths(*grid, levels=levels, pixels=pixels)
+    if cache:
+        save_paths(paths, path)
+    return paths
+
+
+def contour_set(ax, paths, **kwargs):
+    """
+    A matplotlib ContourSet drawn from already traced paths, takes the same styling keywords as ax.contour.
+
+    Levels that don't appear anywhere in the extent are left out, None is returned when none of them do.
+    """
+    from matplotlib.contour import ContourSet
+
+    levels = sorted(level for level, lines in paths.items() if lines)
+    if not levels:
+        return None
+    return ContourSet(ax, levels, [paths[level] for level in levels], **kwargs)
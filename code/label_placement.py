@@ -0,0 +1,118 @@
+"""
+Greedy label placement for station maps
+
+Used to be one plt.plot + plt.annotate per station with the offsets tuned by hand (+0.02 for Deployment 1,
+-0.04 otherwise) so the two labels didn't overlap. place_labels() works in output pixels instead: every marker
+is put into a uniform grid of cells about one label in size, then each label tries a handful of positions
+around its station and takes the first that doesn't hit a marker, an already placed label or the edge of the
+axes. Checking a position only looks at the boxes in the cells it touches, so placing thousands of labels is
+close to linear. Labels with nowhere to go are left off rather than drawn over each other.
+
+"""
+
+import numpy as np
+
+# Candidate label positions around a station as (x, y) multiples of (marker radius + gap), tried in this order.
+# The label box is anchored so it sits clear of the marker on that side.
+CANDIDATES = ((1, 0), (1, 1), (1, -1), (-1, 0), (-1, 1), (-1, -1), (0, 1), (0, -1))
+
+# Space between a marker and its label, in pixels
+LABEL_GAP = 2.0
+# Extra space kept around each label, text is snapped to whole pixels when it is drawn
+LABEL_PADDING = 1.0
+
+_DIGITS_TO_ZERO = str.maketrans('123456789', '000000000')
+
+
+class BoxGrid:
+    """Axis aligned boxes bucketed into a uniform grid, for overlap queries"""
+
+    def __init__(self, cell_size):
+        self.cell_size = cell_size
+        self.cells = {}
+        self.boxes = []
+
+    def _cells(self, box):
+        x0, y0, x1, y1 = (int(np.floor(value / self.cell_size)) for value in box)
+        return ((i, j) for i in range(x0, x1 + 1) for j in range(y0, y1 + 1))
+
+    def add(self, box):
+        index = len(self.boxes)
+        self.boxes.append(box)
+        for cell in self._cells(box):
+            self.cells.setdefault(cell, []).append(index)
+
+    def overlaps(self, box):
+        x0, y0, x1, y1 = box
+        for cell in self._cells(box):
+            for index in self.cells.get(cell, ()):
+                bx0, by0, bx1, by1 = self.boxes[index]
+                if x0 < bx1 and bx0 < x1 and y0 < by1 and by0 < y1:
+                    return True
+        return False
+
+
+def _crowding_order(points, cell_size):
+    """Stations in the most crowded cells first, they have the fewest free positions left"""
+    cells = np.floor(points / cell_size).astype(np.int64)
+    _, inverse, counts = np.unique(cells, axis=0, return_inverse=True, return_counts=True)
+    return np.argsort(-counts[inverse.ravel()], kind='stable')
+
+
+def place_labels(points, sizes, marker_radius, bounds=None, candidates=CANDIDATES, gap=LABEL_GAP,
+                 padding=LABEL_PADDING):
+    """
+    Choose where each label goes.
+
+    points are the stations in pixels (n, 2), sizes the label (width, height) in pixels (n, 2), marker_radius the
+    marker radius in pixels and bounds (x0, y0, x1, y1) the area labels have to stay inside. Returns the offset
+    of each label's lower left corner from its station in pixels (n, 2) and a boolean mask of the labels that
+    found a free position.
+    """
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    sizes = np.asarray(sizes, dtype=np.float64).reshape(-1, 2)
+    offsets = np.zeros_like(points)
+    placed = np.zeros(len(points), dtype=bool)
+    if not len(points):
+        return offsets, placed
+
+    cell_size = max(float(sizes.max()), 2 * marker_radius, 1.0)
+    grid = BoxGrid(cell_size)
+    for x, y in points:
+        grid.add((x - marker_radius, y - marker_radius, x + marker_radius, y + marker_radius))
+
+    reach = marker_radius + gap
+    for index in _crowding_order(points, cell_size):
+        (x, y), (width, height) = points[index], sizes[index]
+        for dx, dy in candidates:
+            # Left edge of the label for dx = 1 / 0 / -1 (right of, centred on, left of the station), same for y
+            left = x + dx * reach - (width if dx < 0 else width / 2 if dx == 0 else 0)
+            bottom = y + dy * reach - (height if dy < 0 else height / 2 if dy == 0 else 0)
+            box = (left - padding, bottom - padding, left + width + padding, bottom + height + padding)
+            if bounds is not None and (left < bounds[0] or bottom < bounds[1] or
+                                       left + width > bounds[2] or bottom + height > bounds[3]):
+                continue
+            if not grid.overlaps(box):
+                grid.add(box)
+                offsets[index] = (left - x, bottom - y)
+                placed[index] = True
+                break
+    return offsets, placed
+
+
+def text_sizes(fig, labels, fontsize):
+    """(width, height) in pixels of each label as the figure's renderer would draw it"""
+    from matplotlib.font_manager import FontProperties
+
+    renderer = fig.canvas.get_renderer()
+    font = FontProperties(size=fontsize)
+    # matplotlib gives every line at least the height of 'lp', so the drawn box is never shorter than that
+    _, line_height, _ = renderer.get_text_width_height_descent('lp', font, ismath=False)
+    # Measuring text is the slow part, and the digits of the usual fonts all have the same width, so labels that
+    # only differ in their numbers ('Dep. 1', 'Dep. 7', ...) are measured once
+    shapes = [label.translate(_DIGITS_TO_ZERO) for label in labels]
+    sizes = {}
+    for shape in set(shapes):
+        width, height, _ = renderer.get_text_width_height_descent(shape, font, ismath=False)
+        sizes[shape] = (width, max(height, line_height))
+    return np.array([sizes[shape] for shape in shapes], dtype=np.float64).reshape(-1, 2)
@@ -0,0 +1,257 @@
+"""
+Following an instrument's results file while it is being written
+
+Everything else reads whole CSVs after the fact. During a voyage the instrument software appends a row to its
+results file after every titration, so a bad titration only gets noticed when someone next reruns the notebook.
+LiveSession follows the file instead: every poll reads just the bytes added since the last one (a half written
+last line is left for the next poll), parses those rows into the store dtypes and folds them into
+
+    - a GroupSummary per Experiment + Instrument, or per Instrument for a file without an Experiment column
+      (merged, not recomputed)
+    - the saturation QC flags of the new rows
+    - the control charts, when a ControlCharts and the standard are given
+    - the figures, re-rendered only when rows for their experiment came in, and at most every render_interval
+
+so a poll costs the same with 10 rows in the file or 10,000. If the file is replaced or truncated everything is
+started again from the top of the new file, except that standards already on the control charts (recognised by
+instrument, bottle and titration time) aren't charted a second time.
+
+    for update in follow('results.csv', experiment='Atmos_All', figures=['atmospheric_diff_instruments']):
+        print(update.qc.loc[~update.qc['pass']])
+
+write_rows() is a stand-in for the instrument, it appends the rows of an existing file a few at a time.
+
+"""
+
+import io
+import os
+import time
+from dataclasses import dataclass, field
+
+import pandas as pd
+
+from group_stats import DEFAULT_GROUP_KEYS, GroupSummary
+from profiling import stage
+from saturation_qc import saturation_qc
+from titration_store import apply_schema
+
+DEFAULT_ENCODING = 'utf-8-sig'
+
+# Seconds between polls of the file, and the shortest time between re-renders of the same figure
+POLL_INTERVAL = 1.0
+RENDER_INTERVAL = 10.0
+
+
+class TailReader:
+    """Reads the rows appended to a CSV since the last call"""
+
+    def __init__(self, path, encoding=DEFAULT_ENCODING):
+        self.path = path
+        self.encoding = encoding
+        self.reset()
+
+    def reset(self):
+        self.offset = 0
+        self.columns = None
+        self.rows = 0
+        self._file_id = None
+
+    def read_new(self):
+        """
+        DataFrame of the complete rows added since the last call (empty when there are none), indexed by row
+        number in the file. Sets self.restarted when the file was replaced or truncated and read from the top.
+        """
+        self.restarted = False
+        try:
+            status = os.stat(self.path)
+        except FileNotFoundError:
+            return self._empty()
+        file_id = (status.st_dev, status.st_ino)
+        if self._file_id is not None and (file_id != self._file_id or status.st_size < self.offset):
+            self.reset()
+            self.restarted = True
+        self._file_id = file_id
+        if status.st_size == self.offset:
+            return self._empty()
+
+        with open(self.path, 'rb') as file:
+            file.seek(self.offset)
+            data = file.read(status.st_size - self.offset)
+        # Only whole lines, the instrument may be part way through writing the last one
+        end = data.rfind(b'\n') + 1
+        if not end:
+            return self._empty()
+        self.offset += end
+        data = data[:end]
+
+        if self.columns is None:
+            header, _, data = data.partition(b'\n')
+            self.columns = pd.read_csv(io.BytesIO(header + b'\n'), encoding=self.encoding).columns.tolist()
+        if not data.strip():
+            return self._empty()
+        rows = pd.read_csv(io.BytesIO(data), header=None, names=self.columns, encoding='utf-8')
+        rows.index = pd.RangeIndex(self.rows, self.rows + len(rows))
+        self.rows += len(rows)
+        return rows
+
+    def _empty(self):
+        return pd.DataFrame(columns=self.columns or [], index=pd.RangeIndex(self.rows, self.rows))
+
+
+@dataclass
+class LiveUpdate:
+    """What changed in one poll"""
+
+    rows: pd.DataFrame
+    qc: pd.DataFrame = None
+    chart: pd.DataFrame = None
+    alarms: pd.DataFrame = None
+    rendered: list = field(default_factory=list)
+    restarted: bool = False
+
+
+class LiveSession:
+    """
+    The dataset, statistics and figures of a results file that is still being written.
+
+    experiment labels the rows when the file has no Experiment column. figures are names from
+    figures.FIGURE_SPECS, rendered into out_dir. charts (a ControlCharts) and standard ('atmospheric' or
+    'iodate') add the new rows to the control charts. saturation turns the saturation QC on or off, by default
+    it is on for everything except the iodate standards, which aren't air saturated.
+    """
+
+    def __init__(self, path, experiment=None, figures=(), out_dir=None, saturation=None, charts=None,
+                 standard=None, render_interval=RENDER_INTERVAL, summary_by=None):
+        from figures import FIGURE_SPECS
+
+        self.reader = TailReader(path)
+        self.experiment = experiment
+        self.specs = [FIGURE_SPECS[name] for name in figures]
+        if self.specs and out_dir is None:
+            raise ValueError('out_dir is needed to render figures')
+        self.out_dir = out_dir
+        self.saturation = standard != 'iodate' if saturation is None else saturation
+        self.charts = charts
+        self.standard = standard
+        self.render_interval = render_interval
+        self.summary_by = summary_by
+        self._reset()
+
+    def _reset(self):
+        self.chunks = []
+        self.summary = GroupSummary(by=self.summary_by)
+        self.qc_chunks = []
+        self._pending = set()
+        self._rendered_at = {}
+
+    @property
+    def frame(self):
+        """Every row read so far"""
+        if len(self.chunks) > 1:
+            # Joined up when asked for and kept joined, so appending a chunk never copies the whole dataset
+            self.chunks = [pd.concat(self.chunks)]
+        return self.chunks[0] if self.chunks else pd.DataFrame()
+
+    @property
+    def qc(self):
+        if len(self.qc_chunks) > 1:
+            self.qc_chunks = [pd.concat(self.qc_chunks)]
+        return self.qc_chunks[0] if self.qc_chunks else pd.DataFrame()
+
+    @stage('live_update')
+    def update(self, now=None):
+        """Read and process whatever has been added to the file, returns a LiveUpdate"""
+        new = self.reader.read_new()
+        if self.reader.restarted:
+            self._reset()
+        result = LiveUpdate(rows=new, restarted=self.reader.restarted)
+        if len(new):
+            rows = result.rows = apply_schema(new, self.experiment)
+            self.chunks.append(rows)
+            if not len(self.summary.moments):
+                self.summary = GroupSummary(by=self._summary_keys(rows))
+            self.summary.update(rows)
+            if self.saturation:
+                result.qc = saturation_qc(rows)
+                self.qc_chunks.append(result.qc)
+            if self.charts is not None and self.standard is not None:
+                result.chart = self.charts.update(rows, self.standard, source=self.reader.path,
+                                                  first_row=int(rows.index[0]))
+                result.alarms = self.charts.alarms
+            self._pending.update(self._affected_specs(rows))
+        result.rendered = self._render_due(time.monotonic() if now is None else now)
+        return result
+
+    def _summary_keys(self, rows):
+        if self.summary_by is not None:
+            return self.summary_by
+        # A raw instrument file has no Experiment column unless experiment labels its rows
+        return DEFAULT_GROUP_KEYS if 'Experiment' in rows else ['Instrument']
+
+    def _affected_specs(self, rows):
+        if 'Experiment' not in rows:
+            return {spec.name for spec in self.specs}
+        experiments = set(rows['Experiment'].astype(str).unique())
+        return {spec.name for spec in self.specs if spec.experiment in experiments}
+
+    def _render_due(self, now):
+        from figures import build_figure
+
+        rendered = []
+        for spec in self.specs:
+            last = self._rendered_at.get(spec.name)
+            if spec.name not in self._pending or (last is not None and now - last < self.render_interval):
+                continue
+            df = self.frame
+            if 'Experiment' in df:
+                df = df.loc[df['Experiment'].astype(str) == spec.experiment]
+            build_figure(spec, df, out_dir=self.out_dir)
+            self._pending.discard(spec.name)
+            self._rendered_at[spec.name] = now
+            rendered.append(spec.output_name())
+        return rendered
+
+    def flush(self):
+        """Render every figure still waiting on its render interval"""
+        return self._render_due(float('inf'))
+
+
+def follow(path, interval=POLL_INTERVAL, duration=None, **session_kwargs):
+    """
+    Poll a results file, yielding a LiveUpdate each time rows come in (or the file starts again).
+
+    Runs until duration seconds have gone by (forever when None), then renders anything still pending. Use
+    follow_session() with a LiveSession of your own to get at the dataset and summary afterwards.
+    """
+    session = LiveSession(path, **session_kwargs)
+    yield from follow_session(session, interval, duration)
+
+
+def follow_session(session, interval=POLL_INTERVAL, duration=None):
+    started = time.monotonic()
+    while duration is None or time.monotonic() - started < duration:
+        update = session.update()
+        if len(update.rows) or update.restarted or update.rendered:
+            yield update
+        time.sleep(interval)
+    rendered = session.flush()
+    if rendered:
+        yield LiveUpdate(rows=pd.DataFrame(), rendered=rendered)
+
+
+def write_rows(source, path, batch=1, interval=POLL_INTERVAL, encoding=DEFAULT_ENCODING):
+    """
+    Stand-in for the instrument: append the rows of source (a frame or CSV path) to path a batch at a time.
+
+    The header goes in first, then each batch is written and flushed every interval seconds, the same way the
+    instrument software adds a line after each titration.
+    """
+    df = pd.read_csv(source, encoding=encoding) if isinstance(source, (str, os.PathLike)) else source
+    with open(path, 'w', encoding=encoding, newline='') as file:
+        file.write(','.join(df.columns) + '\n')
+    for start in range(0, len(df), batch):
+        time.sleep(interval)
+        with open(path, 'a', encoding='utf-8', newline='') as file:
+            df.iloc[start:start + batch].to_csv(file, header=False, index=False, lineterminator='\n')
+            file.flush()
+    return path
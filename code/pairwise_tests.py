@@ -0,0 +1,133 @@
+"""
+Pairwise instrument comparisons for the titration data
+
+DO_Commissioning.py used to slice out each instrument with .loc and call sci_st.ttest_ind one pair at a time.
+pairwise_ttests() instead works out the count/mean/std of every group once (via group_stats) and then computes
+the t statistic for every instrument pair inside every stratum (Experiment, Experiment + Pressure, ...) as
+array operations on those moments. Student's (pooled variance, same as ttest_ind's default) and Welch's tests
+are supported, along with multiple comparison correction of the p-values.
+
+"""
+
+import numpy as np
+import pandas as pd
+import scipy.stats as sci_st
+
+from group_stats import VALUE_COLUMN, describe_groups
+from profiling import stage
+
+CORRECTIONS = ('bonferroni', 'holm', 'fdr_bh')
+
+
+def adjust_pvalues(p_values, method='holm'):
+    """Multiple comparison correction of an array of p-values, NaNs are left alone and not counted"""
+    p_values = np.asarray(p_values, dtype=np.float64)
+    adjusted = np.full_like(p_values, np.nan)
+    valid = ~np.isnan(p_values)
+    p = p_values[valid]
+    m = len(p)
+    if m == 0 or method is None:
+        adjusted[valid] = p
+        return adjusted
+
+    if method == 'bonferroni':
+        result = p * m
+    elif method == 'holm':
+        order = np.argsort(p)
+        stepped = np.maximum.accumulate(p[order] * (m - np.arange(m)))
+        result = np.empty(m)
+        result[order] = stepped
+    elif method == 'fdr_bh':
+        order = np.argsort(p)[::-1]
+        ranks = m - np.arange(m)
+        stepped = np.minimum.accumulate(p[order] * m / ranks)
+        result = np.empty(m)
+        result[order] = stepped
+    else:
+        raise ValueError(f'Unknown correction {method}, use one of {CORRECTIONS}')
+
+    adjusted[valid] = np.minimum(result, 1.0)
+    return adjusted
+
+
+def ttest_from_moments(n_a, mean_a, std_a, n_b, mean_b, std_b, equal_var=True):
+    """
+    Two sided independent t-test from group moments, works on whole arrays of pairs at once.
+
+    Returns (t statistic, degrees of freedom, p-value), matching sci_st.ttest_ind on the raw samples.
+    """
+    n_a, mean_a, var_a = np.asarray(n_a, float), np.asarray(mean_a, float), np.asarray(std_a, float) ** 2
+    n_b, mean_b, var_b = np.asarray(n_b, float), np.asarray(mean_b, float), np.asarray(std_b, float) ** 2
+    with np.errstate(invalid='ignore', divide='ignore'):
+        if equal_var:
+            dof = n_a + n_b - 2
+            pooled = ((n_a - 1) * var_a + (n_b - 1) * var_b) / dof
+            std_err = np.sqrt(pooled * (1 / n_a + 1 / n_b))
+        else:
+            se_a = var_a / n_a
+            se_b = var_b / n_b
+            std_err = np.sqrt(se_a + se_b)
+            dof = (se_a + se_b) ** 2 / (se_a ** 2 / (n_a - 1) + se_b ** 2 / (n_b - 1))
+        t_stat = (mean_a - mean_b) / std_err
+        p_value = 2 * sci_st.t.sf(np.abs(t_stat), dof)
+    return t_stat, dof, p_value
+
+
+@stage('pairwise_ttests')
+def pairwise_ttests(df, by=('Experiment',), between='Instrument', value=VALUE_COLUMN, equal_var=True,
+                    correction='holm', family_by=None, alpha=0.05):
+    """
+    t-test every pair of instruments within each stratum of the data.
+
+    by lists the columns that define a stratum, e.g. ['Experiment'] or ['Experiment', 'Pressure'] for the
+    profile depths. Pass by=None to compare the instruments across the whole frame. family_by sets which
+    columns define a family for the p-value correction, by default every test in the table is one family.
+
+    Returns a long table with one row per (stratum, instrument_a, instrument_b).
+    """
+    by = [] if by is None else ([by] if isinstance(by, str) else list(by))
+    stats = describe_groups(df, by=by + [between], value=value, quantiles=(), dropna=True)
+    stats = stats.loc[:, ['count', 'mean', 'std']].reset_index()
+
+    # Pair up the groups that share a stratum, keeping each unordered pair once
+    left = stats.rename(columns={between: 'instrument_a', 'count': 'n_a', 'mean': 'mean_a', 'std': 'std_a'})
+    right = stats.rename(columns={between: 'instrument_b', 'count': 'n_b', 'mean': 'mean_b', 'std': 'std_b'})
+    if by:
+        pairs = left.merge(right, on=by)
+    else:
+        pairs = left.merge(right, how='cross')
+    pairs = pairs.loc[pairs['instrument_a'].astype(str) < pairs['instrument_b'].astype(str)]
+    pairs = pairs.reset_index(drop=True)
+
+    t_stat, dof, p_value = ttest_from_moments(pairs['n_a'], pairs['mean_a'], pairs['std_a'],
+                                              pairs['n_b'], pairs['mean_b'], pairs['std_b'], equal_var=equal_var)
+    pairs['difference'] = pairs['mean_a'] - pairs['mean_b']
+    pairs['t'] = t_stat
+    pairs['dof'] = dof
+    pairs['p_value'] = p_value
+
+    if family_by:
+        family_by = [family_by] if isinstance(family_by, str) else list(family_by)
+        families = pairs.groupby(family_by, sort=False).indices.values()
+        adjusted = np.empty(len(pairs))
+        for rows in families:
+            adjusted[rows] = adjust_pvalues(p_value[rows], correction)
+    else:
+        adjusted = adjust_pvalues(p_value, correction)
+    pairs['p_adjusted'] = adjusted
+    pairs['significant'] = pairs['p_adjusted'] < alpha
+
+    columns = by + ['instrument_a', 'instrument_b', 'n_a', 'n_b', 'mean_a', 'mean_b', 'std_a', 'std_b',
+                    'difference', 't', 'dof', 'p_value', 'p_adjusted', 'significant']
+    return pairs[columns]
+
+
+def comparison_matrix(results, column='p_value', by=('Experiment',)):
+    """Pivot the long pairwise table into square instrument x instrument matrices, one block per stratum"""
+    by = [] if by is None else ([by] if isinstance(by, str) else list(by))
+    mirrored = results.rename(columns={'instrument_a': 'instrument_b', 'instrument_b': 'instrument_a'})
+    if column in ('difference', 't'):
+        # Signed columns flip when the pair is read the other way around
+        mirrored[column] = -mirrored[column]
+    both = pd.concat([results, mirrored], ignore_index=True)
+    return both.pivot_table(index=by + ['instrument_a'], columns='instrument_b', values=column, aggfunc='first')
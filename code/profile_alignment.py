@@ -0,0 +1,141 @@
+"""
+Depth aligned comparison of the instruments over profile casts
+
+Section 3.5 of DO_Commissioning.py picked out each depth with an exact Pressure == depth match and compared the
+instruments one depth at a time. compare_profiles() instead sorts each cast's pressures once and groups them into
+levels, either taking in every pressure within a tolerance of the shallowest in the level (the bottles fired at
+a nominal depth never all read exactly the same) or by fixed width bins. Every level of every cast is then
+compared in one go:
+
+    - an independent t-test between each pair of instruments at each level (pairwise_tests)
+    - a paired comparison of the samples that came out of the same Niskin bottle, matched on rosette position
+      (RP), which takes the water mass differences between bottles out of the instrument comparison
+
+    compare_profiles(profile_comparison_df)                       every level of the single cast
+    compare_profiles(voyage_df, by=['Station'], bin_width=10)     every level of every station
+
+"""
+
+import numpy as np
+import pandas as pd
+import scipy.stats as sci_st
+
+from group_stats import VALUE_COLUMN, group_codes
+from pairwise_tests import pairwise_ttests
+from profiling import stage
+
+PRESSURE_COLUMN = 'Pressure'
+RP_COLUMN = 'RP'
+LEVEL_COLUMN = 'PressureLevel'
+
+# Widest a level gets (db), pressures within this of the shallowest in a level are treated as the same level
+DEFAULT_TOLERANCE = 2.0
+
+
+def pressure_levels(pressure, tolerance=DEFAULT_TOLERANCE, bin_width=None, groups=None):
+    """
+    The level each sample belongs to, as the median pressure of the level (or the bin centre with bin_width).
+
+    Without bin_width the pressures are sorted and split into levels wherever the gap to the next one is more
+    than tolerance. A run of closely spaced pressures wider than tolerance is cut every tolerance db down from
+    its shallowest pressure as well, so no level is wider than tolerance however closely the bottles were fired.
+    groups are integer codes for the casts, each cast gets levels of its own. Missing pressures stay missing.
+    """
+    pressure = np.asarray(pressure, dtype=np.float64)
+    levels = np.full(pressure.shape, np.nan)
+    valid = ~np.isnan(pressure)
+    if bin_width is not None:
+        levels[valid] = np.round(pressure[valid] / bin_width) * bin_width
+        return levels
+
+    codes = np.zeros(len(pressure), dtype=np.int64) if groups is None else np.asarray(groups, dtype=np.int64)
+    valid_pressure, valid_codes = pressure[valid], codes[valid]
+    order = np.lexsort((valid_pressure, valid_codes))
+    ordered = valid_pressure[order]
+    if not len(ordered):
+        return levels
+    # Spacing the casts further apart than the tolerance keeps the keys increasing across the whole array, and
+    # puts a gap that always starts a new level between each cast and the next
+    spacing = ordered.max() - ordered.min() + tolerance + 1
+    keys = (valid_codes[order] - valid_codes.min()) * spacing + ordered
+    new_level = np.r_[True, np.diff(keys) > tolerance]
+    if tolerance > 0:
+        # Which tolerance wide step down from the shallowest pressure of its run each pressure is in, the first
+        # step includes the pressure exactly tolerance deeper
+        run_start = np.maximum.accumulate(np.where(new_level, keys, -np.inf))
+        step = np.maximum(np.ceil((keys - run_start) / tolerance) - 1, 0)
+        new_level[1:] |= step[1:] != step[:-1]
+    starts = np.flatnonzero(new_level)
+    counts = np.diff(np.r_[starts, len(ordered)])
+    medians = (ordered[starts + (counts - 1) // 2] + ordered[starts + counts // 2]) / 2
+
+    level_of_sorted = np.repeat(medians, counts)
+    valid_levels = np.empty(len(ordered))
+    valid_levels[order] = level_of_sorted
+    levels[valid] = valid_levels
+    return levels
+
+
+def paired_differences(df, between='Instrument', by=None, value=VALUE_COLUMN, rp=RP_COLUMN, level=LEVEL_COLUMN):
+    """
+    Differences between the instruments on samples from the same bottle.
+
+    Returns one row per (by, level, RP, instrument pair) where both instruments measured that bottle, replicates
+    from one bottle on one instrument are averaged first.
+    """
+    by = [] if by is None else ([by] if isinstance(by, str) else list(by))
+    keys = by + [level, rp]
+    wide = df.groupby(keys + [between], observed=True, sort=True)[value].mean().unstack(between)
+    instruments = sorted(wide.columns, key=str)
+
+    frames = []
+    for position, instrument_a in enumerate(instruments):
+        for instrument_b in instruments[position + 1:]:
+            difference = (wide[instrument_a] - wide[instrument_b]).dropna()
+            frames.append(pd.DataFrame({'instrument_a': instrument_a, 'instrument_b': instrument_b,
+                                        'paired_difference': difference}, index=difference.index))
+    if not frames:
+        return pd.DataFrame(columns=keys + ['instrument_a', 'instrument_b', 'paired_difference'])
+    return pd.concat(frames).reset_index()
+
+
+def _paired_stats(differences, keys):
+    stats = differences.groupby(keys + ['instrument_a', 'instrument_b'], observed=True, sort=False)
+    stats = stats['paired_difference'].agg(['count', 'mean', 'std']).reset_index()
+    stats = stats.rename(columns={'count': 'n_paired', 'mean': 'paired_mean', 'std': 'paired_std'})
+
+    # Paired t-test on the bottle differences, the same as sci_st.ttest_rel
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t_stat = stats['paired_mean'] / (stats['paired_std'] / np.sqrt(stats['n_paired']))
+    stats['paired_t'] = t_stat
+    stats['paired_p_value'] = 2 * sci_st.t.sf(np.abs(t_stat), stats['n_paired'] - 1)
+    return stats
+
+
+@stage('compare_profiles')
+def compare_profiles(df, between='Instrument', by=None, value=VALUE_COLUMN, tolerance=DEFAULT_TOLERANCE,
+                     bin_width=None, pressure=PRESSURE_COLUMN, rp=RP_COLUMN, equal_var=True, correction=None,
+                     alpha=0.05):
+    """
+    Compare every pair of instruments at every pressure level.
+
+    by lists the columns identifying a cast (e.g. ['Station']), each cast's levels are worked out from its own
+    pressures. The independent t-test columns are the same as pairwise_ttests(), with PressureLevel added to the
+    stratum, followed by the paired columns n_paired, paired_mean, paired_std, paired_t and paired_p_value (NaN
+    when no bottle was measured by both instruments).
+    """
+    by = [] if by is None else ([by] if isinstance(by, str) else list(by))
+    keys = by + [LEVEL_COLUMN]
+    casts = group_codes(df, by, dropna=False)[0] if by else None
+    data = df.assign(**{LEVEL_COLUMN: pressure_levels(df[pressure], tolerance, bin_width, casts)})
+    data = data.loc[data[LEVEL_COLUMN].notna()]
+
+    tests = pairwise_ttests(data, by=keys, between=between, value=value, equal_var=equal_var,
+                            correction=correction, alpha=alpha)
+    paired = _paired_stats(paired_differences(data, between, by, value, rp), keys)
+    for column in ('instrument_a', 'instrument_b'):
+        tests[column] = tests[column].astype(str)
+        paired[column] = paired[column].astype(str)
+    result = tests.merge(paired, on=keys + ['instrument_a', 'instrument_b'], how='left')
+    result['n_paired'] = result['n_paired'].fillna(0).astype(int)
+    return result
@@ -0,0 +1,148 @@
+"""
+Stage level timing and peak memory for the DO commissioning scripts
+
+Wrap each part of a script in a named stage, either as a context manager or a decorator:
+
+    with stage('gebco_read'):
+        height = ...
+
+    @stage('describe')
+    def describe(...):
+
+Stages nest, so 'render:profile_comparison' inside 'plots' is reported as plots;render:profile_comparison.
+Nothing is recorded (and no memory is traced) unless profiling is switched on with the
+DO_COMMISSIONING_PROFILE environment variable, set to 1 or to the path of the report to write. At exit the
+main process writes:
+
+    <report>.json     - calls, wall time and peak traced memory of every stage path
+    <report>.folded   - the same timings as collapsed stacks ('a;b;c <microseconds>'), which flamegraph.pl
+                        and speedscope read directly
+
+Peak memory comes from tracemalloc so it covers Python allocations (numpy and pandas buffers included), it
+slows allocation heavy code down a little which is why it is opt in.
+
+"""
+
+import atexit
+import json
+import os
+import time
+import tracemalloc
+from contextlib import ContextDecorator
+
+DEFAULT_REPORT = 'profile_report'
+
+
+def profile_target():
+    """Report path (without extension) from DO_COMMISSIONING_PROFILE, or None when profiling is off"""
+    value = os.environ.get('DO_COMMISSIONING_PROFILE', '').strip()
+    if value.lower() in ('', '0', 'false', 'no'):
+        return None
+    if value.lower() in ('1', 'true', 'yes'):
+        return DEFAULT_REPORT
+    return os.path.splitext(value)[0]
+
+
+class Profiler:
+    """Collects the time and peak memory of every stage path entered while it is enabled"""
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.stages = {}
+        self._stack = []
+        self._started = time.perf_counter()
+
+    def start(self):
+        self.enabled = True
+        self._started = time.perf_counter()
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def _fold_peak(self):
+        # tracemalloc only has the one peak counter, so before a stage resets it the peak so far is handed to
+        # every stage that is still open
+        if self._stack:
+            peak = tracemalloc.get_traced_memory()[1]
+            for frame in self._stack:
+                frame['peak'] = max(frame['peak'], peak)
+        tracemalloc.reset_peak()
+
+    def enter(self, name):
+        self._fold_peak()
+        path = f"{self._stack[-1]['path']};{name}" if self._stack else name
+        self._stack.append({'path': path, 'peak': 0, 'start': time.perf_counter(),
+                            'baseline': tracemalloc.get_traced_memory()[0]})
+
+    def exit(self):
+        elapsed = time.perf_counter()
+        self._fold_peak()
+        frame = self._stack.pop()
+        entry = self.stages.setdefault(frame['path'], {'calls': 0, 'seconds': 0.0, 'peak_bytes': 0,
+                                                       'peak_increase_bytes': 0})
+        entry['calls'] += 1
+        entry['seconds'] += elapsed - frame['start']
+        entry['peak_bytes'] = max(entry['peak_bytes'], frame['peak'])
+        entry['peak_increase_bytes'] = max(entry['peak_increase_bytes'], frame['peak'] - frame['baseline'])
+
+    def report(self):
+        """Stages in the order they were first entered, with their own (exclusive) time worked out"""
+        child_seconds = {}
+        for path, entry in self.stages.items():
+            parent = path.rpartition(';')[0]
+            if parent:
+                child_seconds[parent] = child_seconds.get(parent, 0.0) + entry['seconds']
+        stages = [dict(entry, stage=path, self_seconds=max(0.0, entry['seconds'] - child_seconds.get(path, 0.0)))
+                  for path, entry in self.stages.items()]
+        return {'total_seconds': time.perf_counter() - self._started, 'stages': stages}
+
+    def folded(self):
+        """Collapsed stack lines weighted by each stage's own time in microseconds"""
+        return [f'{stage["stage"]} {round(stage["self_seconds"] * 1e6)}' for stage in self.report()['stages']]
+
+    def write(self, target=DEFAULT_REPORT):
+        with open(target + '.json', 'w', encoding='utf-8') as file:
+            json.dump(self.report(), file, indent=2)
+        with open(target + '.folded', 'w', encoding='utf-8') as file:
+            file.write('\n'.join(self.folded()) + '\n')
+        return target + '.json'
+
+
+PROFILER = Profiler()
+
+
+class stage(ContextDecorator):
+    """Time (and track the peak memory of) a named stage, does nothing unless profiling is enabled"""
+
+    def __init__(self, name, profiler=None):
+        self.name = name
+        self.profiler = profiler or PROFILER
+
+    def __enter__(self):
+        if self.profiler.enabled:
+            self.profiler.enter(self.name)
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.profiler.enabled and self.profiler._stack:
+            self.profiler.exit()
+        return False
+
+
+def _write_at_exit(target):
+    import multiprocessing
+
+    # Pool workers inherit the environment but only the process that started profiling writes the report
+    if multiprocessing.parent_process() is None and PROFILER.stages:
+        print(f'Profile written to {PROFILER.write(target)}')
+
+
+def enable_from_env():
+    """Switch profiling on if DO_COMMISSIONING_PROFILE asks for it, returns the report path or None"""
+    target = profile_target()
+    if target is not None and not PROFILER.enabled:
+        PROFILER.start()
+        atexit.register(_write_at_exit, target)
+    return target
+
+
+enable_from_env()
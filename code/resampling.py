@@ -0,0 +1,152 @@
+"""
+Bootstrap and permutation comparisons of the instruments
+
+The replicate experiments only have 4 to 12 samples per instrument, too few to lean on the normality behind
+ttest_ind. resample_pairs() compares every pair of instruments within each stratum (same layout as
+pairwise_ttests) without that assumption:
+
+    - bootstrap confidence intervals for the difference in means and in standard deviations, each instrument's
+      samples resampled with replacement
+    - permutation p-values for the difference in means (samples shuffled between the two instruments) and in
+      standard deviations (the same, after taking each instrument's mean off its samples)
+
+Each block of resamples is drawn as one matrix of indices (or one matrix of shuffled positions) and reduced with
+array operations, there is no python loop per resample. Every pair gets its own child of the seed, so the
+results are the same whichever order the pairs are run in and however many processes they are split across.
+
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from group_stats import VALUE_COLUMN
+from profiling import stage
+
+DEFAULT_RESAMPLES = 10_000
+DEFAULT_CONFIDENCE = 0.95
+
+# Most values held in one block of resamples, keeps the index matrices to a few tens of MB however many are asked for
+BLOCK_VALUES = 2_000_000
+
+# Resampled statistics this close (µmol/L) to the observed one count as being as extreme, so ties from the
+# rounding of the values aren't lost to floating point noise
+TIE_TOLERANCE = 1e-9
+
+RESULT_COLUMNS = ['n_a', 'n_b', 'mean_difference', 'mean_ci_low', 'mean_ci_high', 'std_difference', 'std_ci_low',
+                  'std_ci_high', 'perm_p_mean', 'perm_p_std']
+
+
+def _row_stds(values):
+    n = values.shape[1]
+    if n < 2:
+        return np.full(values.shape[0], np.nan)
+    return values.std(axis=1, ddof=1)
+
+
+def _split_stats(shuffled, n_a):
+    """Differences in mean and std between the first n_a columns and the rest, for every row"""
+    a, b = shuffled[:, :n_a], shuffled[:, n_a:]
+    return a.mean(axis=1) - b.mean(axis=1), _row_stds(a) - _row_stds(b)
+
+
+def resample_pair(a, b, n_resamples=DEFAULT_RESAMPLES, seed=None, confidence=DEFAULT_CONFIDENCE):
+    """
+    Bootstrap intervals and permutation p-values for one pair of samples.
+
+    Returns a dict with the RESULT_COLUMNS. The std interval and p-value are NaN when either sample has fewer
+    than 2 values.
+    """
+    a = np.asarray(a, dtype=np.float64)
+    b = np.asarray(b, dtype=np.float64)
+    # Work relative to the pooled mean, the values are ~200 µmol/L with differences in the hundredths
+    centre = np.concatenate([a, b]).mean()
+    a, b = a - centre, b - centre
+    n_a, n_b = len(a), len(b)
+    n = n_a + n_b
+    rng = np.random.default_rng(seed)
+
+    observed_mean, observed_std = _split_stats(np.concatenate([a, b])[np.newaxis], n_a)
+    pooled = np.concatenate([a, b])
+    centred = np.concatenate([a - a.mean(), b - b.mean()])
+
+    boot_mean = np.empty(n_resamples)
+    boot_std = np.empty(n_resamples)
+    extreme_mean = extreme_std = 0
+    block = max(1, BLOCK_VALUES // n)
+    positions = np.arange(n)
+    for start in range(0, n_resamples, block):
+        size = min(block, n_resamples - start)
+        rows = slice(start, start + size)
+
+        resampled_a = a[rng.integers(0, n_a, (size, n_a))]
+        resampled_b = b[rng.integers(0, n_b, (size, n_b))]
+        boot_mean[rows] = resampled_a.mean(axis=1) - resampled_b.mean(axis=1)
+        boot_std[rows] = _row_stds(resampled_a) - _row_stds(resampled_b)
+
+        shuffles = rng.permuted(np.broadcast_to(positions, (size, n)), axis=1)
+        permuted_mean, _ = _split_stats(pooled[shuffles], n_a)
+        _, permuted_std = _split_stats(centred[shuffles], n_a)
+        extreme_mean += np.count_nonzero(np.abs(permuted_mean) >= np.abs(observed_mean[0]) - TIE_TOLERANCE)
+        extreme_std += np.count_nonzero(np.abs(permuted_std) >= np.abs(observed_std[0]) - TIE_TOLERANCE)
+
+    tail = (1 - confidence) / 2
+    mean_ci = np.quantile(boot_mean, [tail, 1 - tail])
+    has_std = min(n_a, n_b) >= 2
+    std_ci = np.quantile(boot_std, [tail, 1 - tail]) if has_std else (np.nan, np.nan)
+    return {
+        'n_a': n_a,
+        'n_b': n_b,
+        'mean_difference': observed_mean[0],
+        'mean_ci_low': mean_ci[0],
+        'mean_ci_high': mean_ci[1],
+        'std_difference': observed_std[0],
+        'std_ci_low': std_ci[0],
+        'std_ci_high': std_ci[1],
+        # The observed split counts as one of the permutations, so p is never 0
+        'perm_p_mean': (extreme_mean + 1) / (n_resamples + 1),
+        'perm_p_std': (extreme_std + 1) / (n_resamples + 1) if has_std else np.nan,
+    }
+
+
+def _pair_task(task):
+    return resample_pair(*task)
+
+
+@stage('resample_pairs')
+def resample_pairs(df, by=('Experiment',), between='Instrument', value=VALUE_COLUMN, n_resamples=DEFAULT_RESAMPLES,
+                   seed=0, confidence=DEFAULT_CONFIDENCE, processes=1):
+    """
+    Bootstrap and permutation comparison of every pair of instruments within each stratum of the data.
+
+    by works the same as in pairwise_ttests(). seed makes the results reproducible, the pairs are handed out
+    across a process pool when processes isn't 1 (None for one worker per core). Returns a long table with one
+    row per (stratum, instrument_a, instrument_b), differences are a minus b.
+    """
+    by = [] if by is None else ([by] if isinstance(by, str) else list(by))
+    data = df.loc[df[value].notna()]
+    samples = {key if isinstance(key, tuple) else (key,): group.to_numpy(dtype=np.float64)
+               for key, group in data.groupby(by + [between], observed=True, sort=True)[value]}
+
+    # Pair up the instruments that share a stratum, in the same order as pairwise_ttests
+    strata = {}
+    for key in samples:
+        strata.setdefault(key[:-1], []).append(key[-1])
+    pairs = [(stratum, instrument_a, instrument_b)
+             for stratum, instruments in strata.items()
+             for instrument_a in instruments for instrument_b in instruments
+             if str(instrument_a) < str(instrument_b)]
+
+    seeds = np.random.SeedSequence(seed).spawn(len(pairs))
+    tasks = [(samples[stratum + (instrument_a,)], samples[stratum + (instrument_b,)], n_resamples, child, confidence)
+             for (stratum, instrument_a, instrument_b), child in zip(pairs, seeds)]
+    if processes == 1 or len(tasks) < 2:
+        results = [_pair_task(task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            results = list(pool.map(_pair_task, tasks))
+
+    keys = pd.DataFrame([stratum + (instrument_a, instrument_b) for stratum, instrument_a, instrument_b in pairs],
+                        columns=by + ['instrument_a', 'instrument_b'])
+    return pd.concat([keys, pd.DataFrame(results, columns=RESULT_COLUMNS)], axis=1)
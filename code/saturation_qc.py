@@ -0,0 +1,85 @@
+"""
+Saturation QC for the atmospheric standards
+
+The atmospheric sections of DO_Commissioning.py work out sw.satO2(MEASURED_SALINITY, MEASURED_TEMPERATURE) * 44.66
+from hard coded constants and then just draw the ±1% and ±1 µM lines on the plots. saturation_qc() instead
+works out the saturation for every sample from its own DrawTemp (and salinity) and returns the deviation and
+pass/fail flags for each one, for a whole archive at once.
+
+sw.satO2 is a closed form polynomial in numpy, so it is evaluated for every sample in one vectorised call; at
+~20 ms per million rows that is cheaper than finding the distinct (salinity, temperature) pairs or
+interpolating a cached table would be.
+
+"""
+
+import numpy as np
+import pandas as pd
+import seawater as sw
+
+from profiling import stage
+from titration_calc import ML_TO_UMOL
+
+# Values used for the atmospheric samples on in2020_e01, fresh water at lab temperature
+MEASURED_SALINITY = 0
+MEASURED_TEMPERATURE = 21.5
+
+# QC limits either side of the calculated saturation
+PERCENT_LIMIT = 1.0
+UMOL_LIMIT = 1.0
+
+
+def saturation_umol(salinity, temperature):
+    """Oxygen saturation in µmol/L straight from sw.satO2, for single values or arrays"""
+    return sw.satO2(salinity, temperature) * ML_TO_UMOL
+
+
+def lookup_saturation(salinity, temperature):
+    """Saturation in µmol/L for arrays of salinity/temperature, salinity can be a single value for every row"""
+    temperature = np.asarray(temperature, dtype=np.float64)
+    salinity = np.broadcast_to(np.asarray(salinity, dtype=np.float64), temperature.shape)
+    return saturation_umol(salinity, temperature)
+
+
+def saturation_limits(salinity=MEASURED_SALINITY, temperature=MEASURED_TEMPERATURE, percent=PERCENT_LIMIT,
+                      umol=UMOL_LIMIT):
+    """The calculated saturation and the QC lines around it, as used on the atmospheric plots"""
+    saturation = float(saturation_umol(salinity, temperature))
+    percent_band = saturation * percent / 100
+    return {
+        'saturation': saturation,
+        'percent_lower': saturation - percent_band,
+        'percent_upper': saturation + percent_band,
+        'umol_lower': saturation - umol,
+        'umol_upper': saturation + umol,
+    }
+
+
+@stage('saturation_qc')
+def saturation_qc(df, salinity=MEASURED_SALINITY, temperature='DrawTemp', value='O2µmol/L', percent=PERCENT_LIMIT,
+                  umol=UMOL_LIMIT):
+    """
+    Compare every atmospheric sample against its calculated saturation.
+
+    salinity and temperature can each be a column name or a single value for all rows. Returns a frame on the
+    same index as df with the saturation, the deviation in µmol/L and percent, and flags for each limit.
+    A sample passes when it is inside both limits.
+    """
+    temperatures = df[temperature].to_numpy(dtype=np.float64) if isinstance(temperature, str) \
+        else np.full(len(df), temperature, dtype=np.float64)
+    salinities = df[salinity].to_numpy(dtype=np.float64) if isinstance(salinity, str) \
+        else np.full(len(df), salinity, dtype=np.float64)
+
+    saturation = lookup_saturation(salinities, temperatures)
+    deviation = df[value].to_numpy(dtype=np.float64) - saturation
+    deviation_percent = deviation / saturation * 100
+
+    within_percent = np.abs(deviation_percent) <= percent
+    within_umol = np.abs(deviation) <= umol
+    return pd.DataFrame({
+        'saturation': saturation,
+        'deviation': deviation,
+        'deviation_percent': deviation_percent,
+        'within_percent': within_percent,
+        'within_umol': within_umol,
+        'pass': within_percent & within_umol,
+    }, index=df.index)
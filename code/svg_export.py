@@ -0,0 +1,93 @@
+"""
+Compact SVG export for the report figures
+
+matplotlib's default SVG output draws every character as its own path and writes coordinates to 6 decimal
+places, which is why a boxplot with three boxes ends up 1,200+ lines long. save_compact_svg() saves a figure with:
+    - text kept as <text> elements using the document's fonts (svg.fonttype = none)
+    - markers written once in <defs> and placed with <use> (matplotlib does this for markers already)
+    - coordinates rounded to a set number of decimal places
+    - optional path simplification of lines with lots of vertices
+    - optional gzip compression to .svgz
+
+"""
+
+import gzip
+import io
+import re
+
+import matplotlib as mpl
+
+DEFAULT_PRECISION = 2
+
+# Fixed salt so the ids in <defs> don't change between runs, keeps the output diffable and cache friendly
+HASH_SALT = 'do_commissioning'
+
+# Attributes whose values are coordinates, only these get their numbers rounded (not the text of labels). In a
+# transform only the translate() offsets are coordinates, the scale/rotate/matrix terms are factors that rounding
+# would distort (a text scale of 0.14 going to 0.1), so they are left as matplotlib wrote them
+_COORDINATE_ATTRIBUTES = ('d', 'points', 'transform', 'x', 'y', 'x1', 'x2', 'y1', 'y2', 'cx', 'cy', 'r',
+                          'width', 'height', 'viewBox')
+_ATTRIBUTE_PATTERN = re.compile(r'\b(%s)="([^"]*)"' % '|'.join(re.escape(name) for name in _COORDINATE_ATTRIBUTES))
+_NUMBER_PATTERN = re.compile(r'-?\d+\.\d+(?:e-?\d+)?')
+_TRANSLATE_PATTERN = re.compile(r'translate\(([^)]*)\)')
+_BLANK_LINES = re.compile(r'\n\s*\n')
+
+
+def compact_rc(simplify=True, simplify_threshold=0.5):
+    return {
+        'svg.fonttype': 'none',
+        'svg.hashsalt': HASH_SALT,
+        'path.simplify': simplify,
+        'path.simplify_threshold': simplify_threshold if simplify else 0.0,
+    }
+
+
+def round_coordinates(svg_text, precision=DEFAULT_PRECISION):
+    """
+    Round every decimal number inside coordinate attributes (translate offsets only, for transforms) to precision
+    places, dropping trailing zeros
+    """
+    def round_number(match):
+        rounded = f'{float(match.group(0)):.{precision}f}'
+        if '.' in rounded:
+            rounded = rounded.rstrip('0').rstrip('.')
+        return '0' if rounded == '-0' else rounded
+
+    def round_numbers(text):
+        return _NUMBER_PATTERN.sub(round_number, text)
+
+    def round_attribute(match):
+        if match.group(1) == 'transform':
+            value = _TRANSLATE_PATTERN.sub(lambda term: f'translate({round_numbers(term.group(1))})', match.group(2))
+        else:
+            value = round_numbers(match.group(2))
+        return f'{match.group(1)}="{value}"'
+
+    return _ATTRIBUTE_PATTERN.sub(round_attribute, svg_text)
+
+
+def compact_svg_bytes(fig, precision=DEFAULT_PRECISION, simplify=True, **savefig_kwargs):
+    """Render a figure to compact SVG and return the encoded document"""
+    buffer = io.StringIO()
+    with mpl.rc_context(compact_rc(simplify)):
+        fig.savefig(buffer, format='svg', metadata={'Date': None}, **savefig_kwargs)
+    svg_text = buffer.getvalue()
+    if precision is not None:
+        svg_text = round_coordinates(svg_text, precision)
+    return _BLANK_LINES.sub('\n', svg_text).encode('utf-8')
+
+
+def save_compact_svg(fig, path, precision=DEFAULT_PRECISION, simplify=True, compress=None, **savefig_kwargs):
+    """
+    Save a figure as compact SVG.
+
+    compress defaults to True when the path ends in .svgz. Returns the number of bytes written.
+    """
+    content = compact_svg_bytes(fig, precision, simplify, **savefig_kwargs)
+    if compress is None:
+        compress = path.endswith('.svgz')
+    if compress:
+        content = gzip.compress(content, mtime=0)
+    with open(path, 'wb') as file:
+        file.write(content)
+    return len(content)
@@ -0,0 +1,115 @@
+"""
+Synthetic titration records for benchmarking
+
+generate_titrations() makes a frame in exactly the combined.csv schema at any size, with values that hang together
+the way the real instrument output does: each bottle keeps its flask volume, Titre20/O2ml/L/O2µmol/L are
+consistent with the RawTitre and ThioTemp through titration_calc, TitreTime counts up through the session in
+HHMMSS form and the profile samples get a pressure and rosette position.
+
+"""
+
+import numpy as np
+import pandas as pd
+
+from titration_calc import (ML_TO_UMOL, O2_ML_PER_EQUIVALENT, REAGENT_OXYGEN, REAGENT_VOLUME, oxygen_ml_per_litre,
+                             titre_at_20)
+
+COLUMNS = ['Experiment', 'Instrument', 'Bottle', 'FlaskVol', 'RawTitre', 'Titre20', 'O2ml/L', 'ThioTemp',
+           'DrawTemp', 'EndVolts', 'TitreTime', 'O2µmol/L', 'RP', 'Pressure']
+
+# Thiosulfate normality of each instrument, close to what fit_calibration() gives for the in2020_e01 data
+INSTRUMENT_NORMALITY = {'New A': 0.2421, 'New B': 0.2012, 'Old': 0.2199}
+
+# Experiment -> (mean O2 µmol/L, replicate std) for the bench top experiments, profile is handled separately
+EXPERIMENT_LEVELS = {
+    'Iodate': (221.6, 0.2),
+    'Atmos_All': (274.8, 0.15),
+    'Atmos_NewB': (277.1, 0.2),
+    'Dep1_Reps_Single': (187.2, 0.2),
+    'Dep1_Reps_Shared': (187.4, 0.3),
+    'Dep2_Reps': (186.3, 0.3),
+}
+PROFILE_EXPERIMENT = 'Profile_Comp'
+
+# Rough Southern Ocean / Tasman profile, pressure (db) -> O2 µmol/L and temperature
+PROFILE_PRESSURES = np.array([5, 40, 100, 200, 400, 600, 800, 1000, 1500, 2000, 3000, 4000])
+PROFILE_OXYGEN = np.array([256, 255, 253, 243, 239, 211, 199, 187, 180, 185, 200, 210], dtype=np.float64)
+PROFILE_TEMPERATURE = np.array([14, 14, 13, 12, 10, 8, 6.5, 5, 3.5, 2.5, 1.8, 1.2], dtype=np.float64)
+
+N_FLASKS = 1000
+NISKINS = 36
+
+
+def generate_titrations(n_rows, seed=0, profile_fraction=0.4):
+    """Make n_rows of synthetic titration records in the combined.csv schema"""
+    rng = np.random.default_rng(seed)
+
+    instrument_codes = rng.integers(0, len(INSTRUMENT_NORMALITY), n_rows)
+    normality = np.array(list(INSTRUMENT_NORMALITY.values()))[instrument_codes]
+
+    # Flask volumes belong to the bottle, not the sample
+    flask_volumes = np.round(rng.normal(142.0, 3.0, N_FLASKS), 2)
+    bottle = rng.integers(0, N_FLASKS, n_rows)
+    flask_vol = flask_volumes[bottle]
+    bottle = bottle + 100
+
+    # Experiments are kept as codes, the profile is the code after the bench top ones
+    is_profile = rng.random(n_rows) < profile_fraction
+    bench_names = list(EXPERIMENT_LEVELS)
+    bench_codes = rng.integers(0, len(bench_names), n_rows)
+    experiment_codes = np.where(is_profile, len(bench_names), bench_codes)
+    is_atmospheric = np.isin(experiment_codes, [bench_names.index('Atmos_All'), bench_names.index('Atmos_NewB')])
+    is_deep = np.isin(experiment_codes, [bench_names.index(name) for name in bench_names if name.startswith('Dep')])
+
+    level_means = np.array([EXPERIMENT_LEVELS[name][0] for name in bench_names])[bench_codes]
+    level_stds = np.array([EXPERIMENT_LEVELS[name][1] for name in bench_names])[bench_codes]
+    depth_codes = rng.integers(0, len(PROFILE_PRESSURES), n_rows)
+    oxygen = np.where(is_profile, PROFILE_OXYGEN[depth_codes], level_means) + rng.normal(0, 1, n_rows) * np.where(
+        is_profile, 0.4, level_stds)
+    pressure = np.where(is_profile, PROFILE_PRESSURES[depth_codes].astype(np.float64), np.nan)
+    rp = np.where(is_profile, NISKINS - depth_codes * NISKINS // len(PROFILE_PRESSURES),
+                  np.where(is_deep, rng.integers(1, NISKINS + 1, n_rows), 0)).astype(np.float64)
+    rp[rp == 0] = np.nan
+
+    draw_temp = np.where(is_profile, PROFILE_TEMPERATURE[depth_codes], 20.0)
+    draw_temp = np.where(is_atmospheric, 21.5, draw_temp)
+    draw_temp = np.where(is_deep, 7.0, draw_temp)
+    draw_temp = np.round(draw_temp + rng.normal(0, 0.3, n_rows), 1)
+
+    thio_temp = np.round(rng.normal(20.5, 0.8, n_rows), 2)
+
+    # Work back from the concentration to the titre the instrument would have dispensed
+    oxygen_ml = oxygen / ML_TO_UMOL
+    titre20 = (oxygen_ml + REAGENT_OXYGEN) * (flask_vol - REAGENT_VOLUME) / (normality * O2_ML_PER_EQUIVALENT)
+    raw_titre = titre20 / titre_at_20(1.0, thio_temp)
+    raw_titre = np.round(raw_titre, 5)
+    titre20 = titre_at_20(raw_titre, thio_temp)
+    oxygen_ml = oxygen_ml_per_litre(titre20, flask_vol, normality)
+
+    # Titrations about every 3 minutes through the session, written as HHMMSS without leading zeros
+    seconds = (15 * 3600 + np.cumsum(rng.integers(120, 300, n_rows))) % 86400
+    titre_time = (seconds // 3600) * 10000 + (seconds % 3600 // 60) * 100 + seconds % 60
+
+    df = pd.DataFrame({
+        'Experiment': pd.Categorical.from_codes(experiment_codes, bench_names + [PROFILE_EXPERIMENT]),
+        'Instrument': pd.Categorical.from_codes(instrument_codes, list(INSTRUMENT_NORMALITY)),
+        'Bottle': bottle,
+        'FlaskVol': flask_vol,
+        'RawTitre': raw_titre,
+        'Titre20': np.round(titre20, 5),
+        'O2ml/L': np.round(oxygen_ml, 3),
+        'ThioTemp': thio_temp,
+        'DrawTemp': draw_temp,
+        'EndVolts': np.round(rng.normal(2.3, 0.15, n_rows), 3),
+        'TitreTime': titre_time,
+        'O2µmol/L': np.round(oxygen_ml * ML_TO_UMOL, 4),
+        'RP': rp,
+        'Pressure': pressure,
+    })
+    return df[COLUMNS]
+
+
+def write_titrations_csv(path, n_rows, seed=0):
+    """Write synthetic records as a BOM prefixed CSV, the same as the instrument files"""
+    generate_titrations(n_rows, seed).to_csv(path, index=False, encoding='utf-8-sig')
+    return path
@@ -0,0 +1,217 @@
+"""
+Recomputation of the oxygen concentrations from the raw titration columns
+
+The instrument software writes Titre20, O2ml/L and O2µmol/L into the results files and DO_Commissioning.py just
+uses them as is. This module redoes the calculation from RawTitre, ThioTemp and FlaskVol with numpy array
+operations over a whole voyage (or archive) at a time, so the concentrations can be reprocessed when a
+calibration constant changes and rows that don't agree with the stored values can be flagged.
+
+The calculation follows Carpenter (1965) as used by the Scripps instruments:
+    Titre20  = RawTitre * (1 - THIO_EXPANSION * (ThioTemp - 20))
+    O2 ml/L  = (Titre20 - blank) * normality * O2_ML_PER_EQUIVALENT / (FlaskVol - REAGENT_VOLUME) - REAGENT_OXYGEN
+    O2 µmol/L = O2 ml/L * ml_to_umol
+
+The thiosulfate normality, blank and ml_to_umol come from a calibration table, one row per instrument (or per
+instrument + experiment when the thiosulfate was restandardised). fit_calibration() back-solves that table from
+the stored values, which is handy as a starting point before changing a constant.
+
+The instruments don't convert with the 44.66 DO_Commissioning.py uses for the saturation: the stored O2µmol/L
+is the unrounded O2 ml/L times 44.645 (New A), 44.678 (New B) and 44.682 (Old) for the in2020_e01 data, a
+systematic 0.05% apart. So ml_to_umol is fitted per instrument like the normality, and the tolerances below
+are close to what the rounding of the stored columns leaves, rather than loose enough to hide an offset.
+
+"""
+
+import numpy as np
+import pandas as pd
+
+from group_stats import group_codes
+
+# Thermal expansion of the thiosulfate solution (taken as water) around 20 degrees, per degree C
+THIO_EXPANSION = 0.000207
+REFERENCE_TEMPERATURE = 20.0
+
+# ml of O2 per equivalent of thiosulfate
+O2_ML_PER_EQUIVALENT = 5598.0
+# ml of MnCl2 + NaI/NaOH reagent displaced from the flask, and the O2 they carry in (ml/L)
+REAGENT_VOLUME = 2.0
+REAGENT_OXYGEN = 0.017
+
+# Same conversion DO_Commissioning.py uses for the saturation, and the ml_to_umol of calibration tables that
+# don't have their own
+ML_TO_UMOL = 44.66
+
+# Differences bigger than these between the stored and recomputed values get flagged. With a fitted calibration
+# the in2020_e01 rows are within 0.000011 / 0.0014 ml/L / 0.06 µmol/L (the stored columns are rounded to 5 dp
+# / 3 dp / 4 dp and fitted through that rounding), while a 0.05% error in a normality or conversion is ~0.0025
+# ml/L / ~0.11 µmol/L
+DEFAULT_TOLERANCES = {
+    'Titre20': 0.00002,
+    'O2ml/L': 0.002,
+    'O2µmol/L': 0.08,
+}
+
+
+def titre_at_20(raw_titre, thio_temp, expansion=THIO_EXPANSION):
+    """Correct the thiosulfate volume dispensed at ThioTemp to its volume at 20 degrees"""
+    return np.asarray(raw_titre, dtype=np.float64) * (
+        1 - expansion * (np.asarray(thio_temp, dtype=np.float64) - REFERENCE_TEMPERATURE))
+
+
+def oxygen_ml_per_litre(titre20, flask_vol, normality, blank=0.0, reagent_volume=REAGENT_VOLUME,
+                        reagent_oxygen=REAGENT_OXYGEN):
+    titre20 = np.asarray(titre20, dtype=np.float64)
+    flask_vol = np.asarray(flask_vol, dtype=np.float64)
+    return (titre20 - blank) * normality * O2_ML_PER_EQUIVALENT / (flask_vol - reagent_volume) - reagent_oxygen
+
+
+def _calibration_rows(df, calibration, columns):
+    keys = list(calibration.index.names)
+    if len(keys) == 1:
+        positions = calibration.index.get_indexer(df[keys[0]])
+    else:
+        positions = calibration.index.get_indexer(pd.MultiIndex.from_frame(df[keys]))
+    missing = positions < 0
+    values = []
+    for column in columns:
+        column_values = calibration[column].to_numpy(dtype=np.float64)[positions]
+        column_values[missing] = np.nan
+        values.append(column_values)
+    return values
+
+
+def calibration_for_rows(df, calibration):
+    """
+    Line each row up with its normality and blank from the calibration table.
+
+    The table is indexed by the columns it is keyed on (e.g. Instrument, or Instrument + Experiment). Returns
+    two arrays, rows with no calibration get NaN.
+    """
+    return tuple(_calibration_rows(df, calibration, ['normality', 'blank']))
+
+
+def conversion_for_rows(df, calibration):
+    """ml/L to µmol/L factor of each row, ML_TO_UMOL for every row when the calibration doesn't have one"""
+    if 'ml_to_umol' not in calibration:
+        return np.full(len(df), ML_TO_UMOL)
+    return _calibration_rows(df, calibration, ['ml_to_umol'])[0]
+
+
+def _calibration_line(df, keep, reagent_volume, reagent_oxygen):
+    x = df['Titre20'].to_numpy(dtype=np.float64)[keep]
+    y = ((df['O2ml/L'].to_numpy(dtype=np.float64)[keep] + reagent_oxygen)
+         * (df['FlaskVol'].to_numpy(dtype=np.float64)[keep] - reagent_volume) / O2_ML_PER_EQUIVALENT)
+    return x, y
+
+
+def _line_from_sums(n, sum_x, sum_y, sum_xx, sum_xy):
+    """Normality (the slope) and blank of the least squares line through the calibration points"""
+    with np.errstate(invalid='ignore', divide='ignore'):
+        slope = (n * sum_xy - sum_x * sum_y) / (n * sum_xx - sum_x ** 2)
+        intercept = (sum_y - slope * sum_x) / n
+        blank = -intercept / slope
+    return slope, blank
+
+
+def fit_calibration(df, by=('Instrument',), reagent_volume=REAGENT_VOLUME, reagent_oxygen=REAGENT_OXYGEN):
+    """
+    Back-solve the thiosulfate normality and blank for each group from the stored O2ml/L values.
+
+    Rearranging the O2 ml/L equation gives a straight line in Titre20,
+        (O2ml/L + reagent_oxygen) * (FlaskVol - reagent_volume) / 5598 = normality * Titre20 - normality * blank
+    which is fitted by least squares for every group at once from bincount sums. ml_to_umol is the least squares
+    factor (through the origin) from the stored O2ml/L to O2µmol/L, when df has both.
+    """
+    by = [by] if isinstance(by, str) else list(by)
+    codes, index = group_codes(df, by, dropna=True)
+    keep = codes >= 0
+    codes = codes[keep]
+    x, y = _calibration_line(df, keep, reagent_volume, reagent_oxygen)
+
+    n_groups = len(index)
+    n = np.bincount(codes, minlength=n_groups).astype(np.float64)
+    sum_x = np.bincount(codes, weights=x, minlength=n_groups)
+    sum_y = np.bincount(codes, weights=y, minlength=n_groups)
+    sum_xx = np.bincount(codes, weights=x * x, minlength=n_groups)
+    sum_xy = np.bincount(codes, weights=x * y, minlength=n_groups)
+    slope, blank = _line_from_sums(n, sum_x, sum_y, sum_xx, sum_xy)
+    calibration = pd.DataFrame({'normality': slope, 'blank': blank, 'n': n}, index=index)
+    if 'O2µmol/L' in df:
+        oxygen_ml = df['O2ml/L'].to_numpy(dtype=np.float64)[keep]
+        oxygen_umol = df['O2µmol/L'].to_numpy(dtype=np.float64)[keep]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            calibration['ml_to_umol'] = (np.bincount(codes, weights=oxygen_ml * oxygen_umol, minlength=n_groups)
+                                         / np.bincount(codes, weights=oxygen_ml ** 2, minlength=n_groups))
+    return calibration
+
+
+def leave_out_calibration(df, leave_out='Bottle', by=('Instrument',), reagent_volume=REAGENT_VOLUME,
+                          reagent_oxygen=REAGENT_OXYGEN):
+    """
+    Normality and blank for every row as fit_calibration() would give them without the rows that share its
+    leave_out value (e.g. its own bottle), so each row can be checked against a calibration it didn't pull on.
+
+    Every row's fit is its group's bincount sums minus those of its (group, leave_out) pair, so it is still one
+    pass over the data. Returns two arrays like calibration_for_rows(), NaN where nothing else is left to fit.
+    """
+    by = [by] if isinstance(by, str) else list(by)
+    codes, index = group_codes(df, by, dropna=True)
+    left_out, left_out_index = group_codes(df, [leave_out], dropna=True)
+    keep = codes >= 0
+    codes, left_out = codes[keep], left_out[keep]
+    x, y = _calibration_line(df, keep, reagent_volume, reagent_oxygen)
+
+    # Rows without a leave_out value go in pair slot 0 of their group, which is never subtracted
+    n_groups = len(index)
+    n_pairs = n_groups * (len(left_out_index) + 1)
+    pairs = codes * (len(left_out_index) + 1) + left_out + 1
+    has_pair = left_out >= 0
+    sums = []
+    for weights in (np.ones(len(x)), x, y, x * x, x * y):
+        total = np.bincount(codes, weights=weights, minlength=n_groups)[codes]
+        own = np.bincount(pairs, weights=weights, minlength=n_pairs)[pairs]
+        sums.append(total - np.where(has_pair, own, 0))
+
+    normality = np.full(len(df), np.nan)
+    blank = np.full(len(df), np.nan)
+    normality[keep], blank[keep] = _line_from_sums(*sums)
+    return normality, blank
+
+
+def recompute(df, calibration, expansion=THIO_EXPANSION, reagent_volume=REAGENT_VOLUME,
+              reagent_oxygen=REAGENT_OXYGEN, ml_to_umol=None, tolerances=None):
+    """
+    Recalculate Titre20, O2ml/L and O2µmol/L for every row and compare them to the stored values.
+
+    Returns a frame with the same index as df holding, for each of the three columns, the recomputed value
+    ('<col> calc'), the difference from the stored value ('<col> diff') and a flag when the difference is over
+    tolerance ('<col> flag'), plus an overall 'flagged' column. ml_to_umol defaults to the calibration's own
+    (see conversion_for_rows).
+    """
+    tolerances = {**DEFAULT_TOLERANCES, **(tolerances or {})}
+    normality, blank = calibration_for_rows(df, calibration)
+
+    titre20 = titre_at_20(df['RawTitre'], df['ThioTemp'], expansion)
+    oxygen_ml = oxygen_ml_per_litre(titre20, df['FlaskVol'], normality, blank, reagent_volume, reagent_oxygen)
+    oxygen_umol = oxygen_ml * (conversion_for_rows(df, calibration) if ml_to_umol is None else ml_to_umol)
+
+    result = pd.DataFrame(index=df.index)
+    flagged = np.zeros(len(df), dtype=bool)
+    for column, values in (('Titre20', titre20), ('O2ml/L', oxygen_ml), ('O2µmol/L', oxygen_umol)):
+        difference = values - df[column].to_numpy(dtype=np.float64)
+        flag = np.abs(difference) > tolerances[column]
+        result[f'{column} calc'] = values
+        result[f'{column} diff'] = difference
+        result[f'{column} flag'] = flag
+        flagged |= flag
+    result['flagged'] = flagged
+    return result
+
+
+def reprocess(df, calibration, **kwargs):
+    """Return a copy of df with the stored concentration columns replaced by the recomputed ones"""
+    recomputed = recompute(df, calibration, **kwargs)
+    df = df.copy()
+    for column in ('Titre20', 'O2ml/L', 'O2µmol/L'):
+        df[column] = recomputed[f'{column} calc']
+    return df
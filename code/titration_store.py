@@ -0,0 +1,230 @@
+"""
+Typed columnar store for the titration records
+
+The instrument CSVs get parsed into float64/object frames every time they are read, which is fine for 136 rows
+but not for an archive of voyages. ingest() converts a CSV once into a compact typed store: categorical
+Instrument/Experiment, small ints for Bottle/RP and float32 for the columns that only carry 2-5 significant
+figures. O2µmol/L stays float64 as it is reported to 4 decimal places.
+
+Two storage backends are supported:
+    parquet - a single .parquet file, used when pyarrow is installed
+    npy     - a folder of memory mapped .npy files (one per column) plus a small meta.json, numpy only
+
+read_store() supports column projection and simple predicate pushdown for both, filters are given in the
+pyarrow style, e.g. [('Instrument', '==', 'New A'), ('Pressure', '>=', 800)]
+
+"""
+
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from data_access import DATASETS, resolve
+
+# Column name -> storage dtype. Nullable ints are used for RP as it is blank for the bench top experiments
+TITRATION_SCHEMA = {
+    'Experiment': 'category',
+    'Instrument': 'category',
+    'Bottle': 'int16',
+    'FlaskVol': 'float32',
+    'RawTitre': 'float32',
+    'Titre20': 'float32',
+    'O2ml/L': 'float32',
+    'ThioTemp': 'float32',
+    'DrawTemp': 'float32',
+    'EndVolts': 'float32',
+    'TitreTime': 'int32',
+    'O2µmol/L': 'float64',
+    'RP': 'Int8',
+    'Pressure': 'float32',
+}
+
+# The Experiment label each per-experiment file has in combined.csv
+DATASET_EXPERIMENTS = {
+    'INDEPENDENT_IODATE_DATA': 'Iodate',
+    'DEP_1_DEEP_REPLICATES_SINGLE_NISKINS_DATA': 'Dep1_Reps_Single',
+    'DEP_1_DEEP_REPLICATES_SHARED_NISKINS_DATA': 'Dep1_Reps_Shared',
+    'ATMOSPHERIC_DIFF_INSTRUMENTS_DATA': 'Atmos_All',
+    'ATMOSPHERIC_ONE_INSTRUMENT_DATA': 'Atmos_NewB',
+    'PROFILE_COMPARISON_DATA': 'Profile_Comp',
+    'DEP_2_DEEP_REPLICATES_DATA': 'Dep2_Reps',
+}
+
+_OPERATORS = {
+    '==': np.equal,
+    '=': np.equal,
+    '!=': np.not_equal,
+    '<': np.less,
+    '<=': np.less_equal,
+    '>': np.greater,
+    '>=': np.greater_equal,
+}
+
+
+def have_pyarrow():
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def default_backend():
+    return 'parquet' if have_pyarrow() else 'npy'
+
+
+def apply_schema(df, experiment=None):
+    """Cast a freshly read titration frame to the store dtypes, adding the Experiment column if it is missing"""
+    df = df.copy()
+    if 'Experiment' not in df.columns and experiment is not None:
+        df.insert(0, 'Experiment', experiment)
+    for column, dtype in TITRATION_SCHEMA.items():
+        if column not in df.columns:
+            continue
+        if dtype.startswith('int') and df[column].isna().any():
+            # Fall back to the nullable version of the int if there are blanks
+            dtype = dtype.capitalize()
+        df[column] = df[column].astype(dtype)
+    return df
+
+
+def read_titration_csv(path, experiment=None):
+    """Read one of the BOM prefixed instrument CSVs straight into the store dtypes"""
+    df = pd.read_csv(path, encoding='utf-8-sig')
+    return apply_schema(df, experiment)
+
+
+def store_path(out_dir, name, backend=None):
+    backend = backend or default_backend()
+    return os.path.join(out_dir, name + ('.parquet' if backend == 'parquet' else '.npystore'))
+
+
+def write_store(df, path, backend=None):
+    backend = backend or default_backend()
+    if backend == 'parquet':
+        df.to_parquet(path, index=False)
+    elif backend == 'npy':
+        _write_npy_store(df, path)
+    else:
+        raise ValueError(f'Unknown store backend: {backend}')
+    return path
+
+
+def ingest(source, out_dir, name=None, experiment=None, backend=None, registry=None, register=True, offline=None):
+    """
+    Convert one titration CSV into the columnar store.
+
+    source can be a path, URL or one of the dataset names from data_access (e.g. 'COMBINED_DATA'). The
+    experiment label is worked out from the dataset name when it isn't given. With a FlaskRegistry, the bottle
+    volumes recorded in the file are added to it (unless register is False) and then any missing FlaskVol
+    values are filled in from it. offline is passed on to data_access.resolve().
+    """
+    if experiment is None:
+        experiment = DATASET_EXPERIMENTS.get(source)
+    if name is None:
+        name = os.path.splitext(os.path.basename(DATASETS.get(source, source)))[0]
+    df = read_titration_csv(resolve(source, offline=offline), experiment)
+    if registry is not None:
+        # Added before filling, the filled in volumes came from the registry and weren't measured in this file
+        if register:
+            registry.add(df, name)
+        df = registry.fill(df)
+    os.makedirs(out_dir, exist_ok=True)
+    return write_store(df, store_path(out_dir, name, backend), backend)
+
+
+def ingest_all(out_dir, backend=None, registry=None, offline=None):
+    """
+    Convert combined.csv and all of the per-experiment files, returns {dataset name: store path}
+
+    combined.csv repeats the per-experiment files, so with a registry its bottles are only filled in, not
+    added a second time.
+    """
+    return {name: ingest(name, out_dir, backend=backend, registry=registry, register=name in DATASET_EXPERIMENTS,
+                         offline=offline)
+            for name in DATASETS}
+
+
+def read_store(path, columns=None, filters=None):
+    """Read a store written by ingest(), only loading the requested columns and rows"""
+    if os.path.isdir(path):
+        return _read_npy_store(path, columns, filters)
+    return pd.read_parquet(path, columns=columns, filters=filters)
+
+
+def _write_npy_store(df, path):
+    os.makedirs(path, exist_ok=True)
+    meta = {'rows': len(df), 'columns': {}}
+    for i, column in enumerate(df.columns):
+        series = df[column]
+        file_name = f'{i:03d}.npy'
+        entry = {'file': file_name, 'dtype': str(series.dtype)}
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            entry['categories'] = series.cat.categories.tolist()
+            values = series.cat.codes.to_numpy()
+        elif isinstance(series.dtype, pd.api.extensions.ExtensionDtype):
+            # Nullable ints are stored as the numpy int plus a separate mask
+            entry['mask'] = f'{i:03d}.mask.npy'
+            np.save(os.path.join(path, entry['mask']), series.isna().to_numpy())
+            values = series.fillna(0).to_numpy(dtype=series.dtype.numpy_dtype)
+        else:
+            values = series.to_numpy()
+        np.save(os.path.join(path, file_name), values)
+        meta['columns'][column] = entry
+    with open(os.path.join(path, 'meta.json'), 'w', encoding='utf-8') as file:
+        json.dump(meta, file, ensure_ascii=False, indent=2)
+
+
+def _load_npy_column(path, entry, rows=None):
+    values = np.load(os.path.join(path, entry['file']), mmap_mode='r')
+    if rows is not None:
+        values = values[rows]
+    if 'categories' in entry:
+        return pd.Categorical.from_codes(np.asarray(values), categories=entry['categories'])
+    if 'mask' in entry:
+        mask = np.load(os.path.join(path, entry['mask']), mmap_mode='r')
+        if rows is not None:
+            mask = mask[rows]
+        return pd.arrays.IntegerArray(np.array(values), np.array(mask))
+    return np.array(values)
+
+
+def _filter_mask(path, meta, filters):
+    mask = np.ones(meta['rows'], dtype=bool)
+    for column, op, value in filters:
+        entry = meta['columns'][column]
+        values = np.load(os.path.join(path, entry['file']), mmap_mode='r')
+        if 'categories' in entry:
+            # Compare against the category codes rather than building the strings
+            categories = entry['categories']
+            if op in ('in', 'not in'):
+                codes = [categories.index(v) for v in value if v in categories]
+                hit = np.isin(values, codes)
+                mask &= hit if op == 'in' else ~hit
+                continue
+            if op not in ('==', '=', '!='):
+                raise ValueError(f'Only equality filters are supported on categorical column {column}')
+            code = categories.index(value) if value in categories else -2
+            mask &= _OPERATORS[op](values, code)
+            continue
+        if op == 'in':
+            hit = np.isin(values, list(value))
+        elif op == 'not in':
+            hit = ~np.isin(values, list(value))
+        else:
+            hit = _OPERATORS[op](values, value)
+        if 'mask' in entry and op != 'not in':
+            # Blanks only match 'not in', same as pyarrow
+            hit &= ~np.load(os.path.join(path, entry['mask']), mmap_mode='r')
+        mask &= hit
+    return mask
+
+
+def _read_npy_store(path, columns=None, filters=None):
+    with open(os.path.join(path, 'meta.json'), 'r', encoding='utf-8') as file:
+        meta = json.load(file)
+    columns = columns or list(meta['columns'])
+    rows = np.flatnonzero(_filter_mask(path, meta, filters)) if filters else None
+    return pd.DataFrame({column: _load_npy_column(path, meta['columns'][column], rows) for column in columns})
@@ -0,0 +1,307 @@
+"""
+Variance components of the replicate experiments
+
+Section 3.7.2 of DO_Commissioning.py ran an F-test on the per-experiment standard deviations of each instrument,
+which throws away the individual samples, and nothing used the rosette position (RP) of the Niskin each sample
+came from. variance_components() splits the O2µmol/L variance of every experiment into
+
+    Instrument   differences between the instruments
+    RP           differences between the Niskins the samples were drawn from
+    Replicate    replicate samples from the same Niskin on the same instrument
+
+How the Niskins come in depends on how the experiment was run:
+
+    nested    every Niskin was only sampled by one instrument, the RP term is the spread of the Niskins within
+              each instrument and the instrument term is tested against it. ANOVA (method of moments)
+              estimators for an unbalanced nested design.
+    crossed   instruments sampled the same Niskins (Dep1_Reps_Shared, the shared depths of Profile_Comp), so
+              differences between the Niskins are common to every instrument and an Instrument x RP
+              interaction is added. Unweighted means analysis over the Niskins every instrument sampled, the
+              main effects are tested against the interaction.
+
+It is all closed form: the count, mean and sum of squared deviations of every (stratum, instrument, Niskin)
+cell come from two bincounts over the rows, everything after that is arithmetic on the cells.
+homogeneity_tests() adds Levene's (Brown-Forsythe) and Bartlett's tests for equal variances across the
+instruments, also for every stratum at once.
+
+Rows without an RP (the bench top experiments) are all one Niskin per instrument, the RP term is then NaN and
+the instrument term is tested against the replicates. Where every Niskin was only sampled once (Dep2_Reps) the
+RP and replicate terms can't be told apart, both are NaN and the instrument term is tested against the Niskins.
+In Dep1_Reps_Single each instrument sampled a single Niskin of its own, so the RP term is NaN there too and
+the instrument term holds any difference between those three Niskins as well as between the instruments, it
+is not a clean test of the instruments.
+
+"""
+
+import numpy as np
+import pandas as pd
+import scipy.stats as sci_st
+
+from group_stats import VALUE_COLUMN, describe_groups, group_codes
+from profiling import stage
+
+DEFAULT_LEVELS = ('Instrument', 'RP')
+
+_STRATUM = '_stratum'
+
+
+def _strata(df, by):
+    """by as a list, with a stand-in column when the whole frame is one stratum"""
+    by = [] if by is None else ([by] if isinstance(by, str) else list(by))
+    if by:
+        return df, by
+    return df.assign(**{_STRATUM: 0}), [_STRATUM]
+
+
+def _cell_moments(df, keys, value):
+    """Count, mean and sum of squared deviations of value for every group of keys, in two passes over the rows"""
+    codes, index = group_codes(df, keys, dropna=False)
+    values = df[value].to_numpy(dtype=np.float64)
+    keep = ~np.isnan(values)
+    codes, values = codes[keep], values[keep]
+    n_cells = len(index)
+
+    counts = np.bincount(codes, minlength=n_cells).astype(np.float64)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = np.bincount(codes, weights=values, minlength=n_cells) / counts
+    m2 = np.bincount(codes, weights=(values - means[codes]) ** 2, minlength=n_cells)
+    cells = pd.DataFrame({'n': counts, 'mean': means, 'm2': m2}, index=index).reset_index()
+    return cells.loc[cells['n'] > 0]
+
+
+def _pooled_level(cells, keys):
+    """Combine cells up to the groups of keys: n, mean, the spread of the cell means around it and sum n_cell^2"""
+    cells = cells.assign(weighted=cells['n'] * cells['mean'], n_squared=cells['n'] ** 2)
+    level = cells.groupby(keys, observed=True, sort=False, dropna=False)[['n', 'weighted', 'n_squared']].sum()
+    level['mean'] = level['weighted'] / level['n']
+    cells = cells.join(level['mean'].rename('level_mean'), on=keys)
+    level['between'] = (cells['n'] * (cells['mean'] - cells['level_mean']) ** 2).groupby(
+        [cells[key] for key in keys], observed=True, sort=False, dropna=False).sum()
+    return level.drop(columns='weighted').reset_index()
+
+
+def _in_crossed_strata(cells, by, instrument, niskin):
+    """Mask of the cells in strata where at least one Niskin was sampled by more than one instrument"""
+    instruments = cells.groupby(by + [niskin], observed=True, sort=False, dropna=False)[instrument].transform('nunique')
+    shared = (instruments > 1) & cells[niskin].notna()
+    return shared.groupby([cells[key] for key in by], observed=True, sort=False, dropna=False).transform('any')
+
+
+def _f_test(numerator, denominator, df_numerator, df_denominator):
+    with np.errstate(invalid='ignore', divide='ignore'):
+        f = numerator / denominator
+    return f, sci_st.f.sf(f, df_numerator, df_denominator)
+
+
+def _table(keys, design, sources, df_e):
+    """Long table from (source, df, SS, MS, variance, F, p) arrays of every stratum"""
+    components = np.clip(np.vstack([source[4] for source in sources]), 0, None)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        # Without replicates the total isn't known, so there is nothing to give a percentage of
+        percent = np.where(df_e > 0, components / np.nansum(components, axis=0) * 100, np.nan)
+    frames = []
+    for row, (source, dof, ss, ms, _, f, p) in enumerate(sources):
+        frames.append(keys.assign(design=design, source=source, df=dof, SS=np.where(dof > 0, ss, np.nan), MS=ms,
+                                  variance=components[row], percent=percent[row], F=f, p_value=p))
+    return pd.concat(frames, ignore_index=True)
+
+
+def _nested_components(cells, by, instrument, niskin):
+    """Niskins nested within the instruments, ANOVA estimators for unbalanced nested data"""
+    instruments = _pooled_level(cells, by + [instrument])
+    instruments['n_squared_over_n'] = instruments['n_squared'] / instruments['n']
+    strata = _pooled_level(instruments, by)
+
+    grouped_cells = cells.groupby(by, observed=True, sort=False, dropna=False)
+    grouped_instruments = instruments.groupby(by, observed=True, sort=False, dropna=False)
+    strata = strata.set_index(by).join(pd.DataFrame({
+        'n_cells': grouped_cells.size(),
+        'n_instruments': grouped_instruments.size(),
+        'ss_replicate': grouped_cells['m2'].sum(),
+        'ss_niskin': grouped_instruments['between'].sum(),
+        'cell_n_squared': grouped_instruments['n_squared'].sum(),
+        'cell_n_squared_over_n': grouped_instruments['n_squared_over_n'].sum(),
+    }))
+
+    n = strata['n'].to_numpy()
+    a = strata['n_instruments'].to_numpy(dtype=np.float64)
+    b = strata['n_cells'].to_numpy(dtype=np.float64)
+    df_a, df_b, df_e = a - 1, b - a, n - b
+    ss_a, ss_b, ss_e = strata['between'].to_numpy(), strata['ss_niskin'].to_numpy(), strata['ss_replicate'].to_numpy()
+    within = strata['cell_n_squared_over_n'].to_numpy()
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        ms_a = np.where(df_a > 0, ss_a / df_a, np.nan)
+        ms_b = np.where(df_b > 0, ss_b / df_b, np.nan)
+        ms_e = np.where(df_e > 0, ss_e / df_e, np.nan)
+        # Coefficients of the expected mean squares for unbalanced nested data
+        n0_b = (n - within) / df_b
+        n0_ab = (within - strata['cell_n_squared'].to_numpy() / n) / df_a
+        n0_a = (n - strata['n_squared'].to_numpy() / n) / df_a
+
+        var_e = ms_e
+        var_b = (ms_b - ms_e) / n0_b
+        # What MS_A is expected to be with no instrument effect, built from MS_B and MS_E
+        weight = np.where(df_b > 0, n0_ab / n0_b, 0.0)
+        replicate_part = np.where(df_e > 0, (1 - weight) * ms_e, 0.0)
+        niskin_part = np.where(df_b > 0, weight * ms_b, 0.0)
+        denominator = replicate_part + niskin_part
+        dof_denominator = denominator ** 2 / (np.where(df_e > 0, replicate_part ** 2 / df_e, 0.0)
+                                              + np.where(df_b > 0, niskin_part ** 2 / df_b, 0.0))
+        var_a = (ms_a - denominator) / n0_a
+
+    f_a, p_a = _f_test(ms_a, denominator, df_a, dof_denominator)
+    f_b, p_b = _f_test(ms_b, ms_e, df_b, df_e)
+    sources = [(instrument, df_a, ss_a, ms_a, var_a, f_a, p_a),
+               (niskin, df_b, ss_b, ms_b, var_b, f_b, p_b),
+               ('Replicate', df_e, ss_e, ms_e, var_e, np.nan, np.nan)]
+    return _table(strata.index.to_frame(index=False), 'nested', sources, df_e)
+
+
+def _crossed_components(cells, by, instrument, niskin):
+    """
+    Instruments crossed with the Niskins, unweighted means analysis over the Niskins every instrument sampled.
+
+    The replicate term is pooled over every cell, Niskins only some of the instruments sampled add to it but
+    not to the instrument or Niskin terms.
+    """
+    grouped_cells = cells.groupby(by, observed=True, sort=False, dropna=False)
+    strata = pd.DataFrame({'n': grouped_cells['n'].sum(), 'n_cells': grouped_cells.size(),
+                           'ss_replicate': grouped_cells['m2'].sum(),
+                           'n_instruments': grouped_cells[instrument].nunique()})
+
+    sampled = cells.loc[cells[niskin].notna()]
+    sampled = sampled.join(strata['n_instruments'], on=by)
+    sampled_by = sampled.groupby(by + [niskin], observed=True, sort=False)[instrument].transform('nunique')
+    complete = sampled.loc[sampled_by == sampled['n_instruments']]
+
+    # Two way table of the cell means: instrument, Niskin and grand means are unweighted means of the cells
+    means = {}
+    for name, keys in (('instrument_mean', by + [instrument]), ('niskin_mean', by + [niskin]), ('grand_mean', by)):
+        means[name] = complete.groupby(keys, observed=True, sort=False)['mean'].mean()
+        complete = complete.join(means[name].rename(name), on=keys)
+    residual = complete['mean'] - complete['instrument_mean'] - complete['niskin_mean'] + complete['grand_mean']
+    complete = complete.assign(inverse_n=1 / complete['n'], interaction=residual ** 2)
+    for name, level in (('instrument_mean', instrument), ('niskin_mean', niskin)):
+        spread = means[name].rename('level_mean').reset_index().join(means['grand_mean'].rename('grand'), on=by)
+        complete = complete.join((spread['level_mean'] - spread['grand']).pow(2).groupby(
+            [spread[key] for key in by], sort=False).sum().rename(f'{level} spread'), on=by)
+
+    grouped = complete.groupby(by, observed=True, sort=False)
+    strata = strata.join(pd.DataFrame({
+        'a': grouped[instrument].nunique(),
+        'b': grouped[niskin].nunique(),
+        # Harmonic mean of the cell counts stands in for the number of replicates per cell
+        'n_h': grouped.size() / grouped['inverse_n'].sum(),
+        'instrument_spread': grouped[f'{instrument} spread'].first(),
+        'niskin_spread': grouped[f'{niskin} spread'].first(),
+        'ss_interaction': grouped['interaction'].sum(),
+    }))
+
+    a = strata['a'].to_numpy(dtype=np.float64)
+    b = strata['b'].to_numpy(dtype=np.float64)
+    n_h = strata['n_h'].to_numpy()
+    df_a, df_b, df_ab = a - 1, b - 1, (a - 1) * (b - 1)
+    df_e = strata['n'].to_numpy() - strata['n_cells'].to_numpy(dtype=np.float64)
+    ss_a = n_h * b * strata['instrument_spread'].to_numpy()
+    ss_b = n_h * a * strata['niskin_spread'].to_numpy()
+    ss_ab = n_h * strata['ss_interaction'].to_numpy()
+    ss_e = strata['ss_replicate'].to_numpy()
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        ms_a = np.where(df_a > 0, ss_a / df_a, np.nan)
+        ms_b = np.where(df_b > 0, ss_b / df_b, np.nan)
+        ms_ab = np.where(df_ab > 0, ss_ab / df_ab, np.nan)
+        ms_e = np.where(df_e > 0, ss_e / df_e, np.nan)
+        # Random effects expected mean squares: the main effects are tested against the interaction
+        var_a = (ms_a - ms_ab) / (n_h * b)
+        var_b = (ms_b - ms_ab) / (n_h * a)
+        var_ab = (ms_ab - ms_e) / n_h
+
+    f_a, p_a = _f_test(ms_a, ms_ab, df_a, df_ab)
+    f_b, p_b = _f_test(ms_b, ms_ab, df_b, df_ab)
+    f_ab, p_ab = _f_test(ms_ab, ms_e, df_ab, df_e)
+    sources = [(instrument, df_a, ss_a, ms_a, var_a, f_a, p_a),
+               (niskin, df_b, ss_b, ms_b, var_b, f_b, p_b),
+               (f'{instrument} x {niskin}', df_ab, ss_ab, ms_ab, var_ab, f_ab, p_ab),
+               ('Replicate', df_e, ss_e, ms_e, ms_e, np.nan, np.nan)]
+    return _table(strata.index.to_frame(index=False), 'crossed', sources, df_e)
+
+
+@stage('variance_components')
+def variance_components(df, by=('Experiment',), levels=DEFAULT_LEVELS, value=VALUE_COLUMN):
+    """
+    Variance components of value within each stratum.
+
+    levels are the instrument and the Niskin column. Where every Niskin was sampled by only one instrument the
+    Niskin is nested within the instrument, where instruments shared Niskins the two are crossed and an
+    instrument x Niskin interaction is added (the design column says which). Returns a long table with one row
+    per (stratum, source) with the degrees of freedom, sums of squares, mean squares, the estimated variance
+    component (negative estimates are set to 0), its percentage of the total and the F-test of that source.
+    Nested terms are tested against the term below them (Satterthwaite's approximation for the instrument term
+    when the design is unbalanced), crossed main effects against the interaction.
+    """
+    data, by = _strata(df, by)
+    instrument, niskin = levels
+    cells = _cell_moments(data, by + [instrument, niskin], value)
+
+    in_crossed = _in_crossed_strata(cells, by, instrument, niskin).to_numpy(dtype=bool)
+    frames = [frame(cells.loc[rows], by, instrument, niskin)
+              for frame, rows in ((_nested_components, ~in_crossed), (_crossed_components, in_crossed)) if rows.any()]
+    if not frames:
+        return _nested_components(cells, by, instrument, niskin).drop(columns=_STRATUM, errors='ignore')
+    result = pd.concat(frames, ignore_index=True).sort_values(by, kind='stable').reset_index(drop=True)
+    return result.drop(columns=_STRATUM, errors='ignore')
+
+
+@stage('homogeneity_tests')
+def homogeneity_tests(df, by=('Experiment',), between='Instrument', value=VALUE_COLUMN, center='median'):
+    """
+    Levene's and Bartlett's tests for equal variances across the instruments in each stratum.
+
+    center='median' is the Brown-Forsythe version of Levene's test (scipy's default), 'mean' the original.
+    Instruments with fewer than 2 samples are left out. Returns one row per stratum with the number of
+    instruments, the statistics and their p-values, matching sci_st.levene and sci_st.bartlett.
+    """
+    if center not in ('median', 'mean'):
+        raise ValueError(f"center has to be 'median' or 'mean', got {center!r}")
+    data, by = _strata(df, by)
+    keys = by + [between]
+    data = data.loc[data[value].notna()]
+    data = data.loc[data.groupby(keys, observed=True)[value].transform('size') >= 2]
+
+    codes, _ = group_codes(data, keys, dropna=True)
+    groups = describe_groups(data, by=keys, value=value, quantiles=(0.5,), dropna=True)
+    counts = groups['count'].to_numpy()
+
+    # Levene's statistic is a one way ANOVA of the absolute deviations from each instrument's centre
+    centres = groups['50%' if center == 'median' else 'mean'].to_numpy()
+    deviations = np.abs(data[value].to_numpy(dtype=np.float64) - centres[codes])
+    deviation_means = np.bincount(codes, weights=deviations, minlength=len(groups)) / counts
+    deviation_within = np.bincount(codes, weights=(deviations - deviation_means[codes]) ** 2, minlength=len(groups))
+
+    variances = groups['std'].to_numpy() ** 2
+    with np.errstate(divide='ignore'):
+        log_variances = np.log(variances)
+    table = groups.index.to_frame(index=False)[by].assign(
+        n=counts, weighted=counts * deviation_means, deviation_mean=deviation_means, within=deviation_within,
+        dof_variance=(counts - 1) * variances, dof_log_variance=(counts - 1) * log_variances,
+        inverse_dof=1 / (counts - 1))
+    strata = table.groupby(by, sort=True)
+    sums = strata[['n', 'weighted', 'within', 'dof_variance', 'dof_log_variance', 'inverse_dof']].sum()
+    k = strata.size()
+    n = sums['n']
+
+    table = table.join((sums['weighted'] / n).rename('grand'), on=by)
+    between_ss = (table['n'] * (table['deviation_mean'] - table['grand']) ** 2).groupby(
+        [table[key] for key in by], sort=True).sum()
+    with np.errstate(invalid='ignore', divide='ignore'):
+        levene = (n - k) / (k - 1) * between_ss / sums['within']
+        pooled = sums['dof_variance'] / (n - k)
+        correction = 1 + (sums['inverse_dof'] - 1 / (n - k)) / (3 * (k - 1))
+        bartlett = ((n - k) * np.log(pooled) - sums['dof_log_variance']) / correction
+
+    result = pd.DataFrame({'instruments': k, 'n': n, 'levene': levene, 'levene_p': sci_st.f.sf(levene, k - 1, n - k),
+                           'bartlett': bartlett, 'bartlett_p': sci_st.chi2.sf(bartlett, k - 1)})
+    result.loc[result['instruments'] < 2, ['levene', 'levene_p', 'bartlett', 'bartlett_p']] = np.nan
+    return result.reset_index().drop(columns=_STRATUM, errors='ignore')
@@ -0,0 +1,7 @@
+import os
+import sys
+
+# The modules in code/ are imported the same way the notebook and do_cli.py import them
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'code'))
+os.environ.setdefault('DO_COMMISSIONING_OFFLINE', '1')
+os.environ.setdefault('MPLBACKEND', 'Agg')
@@ -0,0 +1,32 @@
+import pandas as pd
+import pytest
+
+from control_charts import ALARM_COLUMNS, MIN_SIGMA, ControlCharts
+
+
+def iodate_rows(values, instrument='New A'):
+    return pd.DataFrame({'Instrument': instrument, 'Bottle': range(len(values)), 'TitreTime': range(len(values)),
+                         'O2µmol/L': values})
+
+
+def test_alarms_before_any_update(tmp_path):
+    charts = ControlCharts(str(tmp_path / 'charts.json'))
+    assert charts.alarms.empty
+    assert list(charts.alarms.columns) == ALARM_COLUMNS
+
+
+def test_constant_baseline_still_charts(tmp_path):
+    charts = ControlCharts(str(tmp_path / 'charts.json'), baseline=4)
+    charts.update(iodate_rows([221.5] * 4), 'iodate')
+    chart = charts.chart('iodate', 'New A')
+    assert chart.sigma == MIN_SIGMA
+    assert chart.charting
+
+    result = charts.update(iodate_rows([221.5, 222.0]).assign(Bottle=[10, 11]), 'iodate', source='next')
+    assert result['z'].notna().all()
+    assert (charts.alarms['rule'] == 'beyond 3 sigma').any()
+
+
+def test_baseline_needs_two_standards(tmp_path):
+    with pytest.raises(ValueError):
+        ControlCharts(str(tmp_path / 'charts.json'), baseline=1)
@@ -0,0 +1,30 @@
+import pytest
+
+import figures
+from build_cache import BuildCache
+from figures import FIGURE_SPECS, render_all, render_matched_grid
+
+
+def test_render_all_records_figures_written_before_a_failure(tmp_path, monkeypatch):
+    def fail(ax, spec, df):
+        raise RuntimeError('profile plot failed')
+
+    monkeypatch.setitem(figures.PLOTTERS, 'profile', fail)
+    specs = [FIGURE_SPECS['independent_iodate_standards'], FIGURE_SPECS['profile_comparison']]
+    with pytest.raises(RuntimeError):
+        render_all(str(tmp_path), specs=specs, processes=1, offline=True)
+
+    assert list(BuildCache(str(tmp_path)).entries) == [specs[0].output_name()]
+    rebuilt, skipped = render_all(str(tmp_path), specs=specs[:1], processes=1, offline=True)
+    assert not rebuilt and skipped == [specs[0].output_name()]
+
+
+def test_matched_grid_skipped_when_up_to_date(tmp_path):
+    rebuilt, skipped = render_matched_grid(str(tmp_path), offline=True)
+    assert list(rebuilt.values()) == [['new output']] and not skipped
+
+    rebuilt, skipped = render_matched_grid(str(tmp_path), offline=True)
+    assert not rebuilt and skipped == list(BuildCache(str(tmp_path)).entries)
+
+    rebuilt, _ = render_matched_grid(str(tmp_path), span=3, offline=True)
+    assert list(rebuilt.values()) == [['plot parameters changed']]
@@ -0,0 +1,35 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from flask_registry import FlaskRegistry, volume_drift
+from titration_calc import fit_calibration, leave_out_calibration
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'data')
+
+
+@pytest.fixture(scope='module')
+def combined():
+    return pd.read_csv(os.path.join(DATA_DIR, 'combined.csv'), encoding='utf-8-sig')
+
+
+def test_leave_out_calibration_matches_refit_without_the_bottle(combined):
+    normality, blank = leave_out_calibration(combined, 'Bottle')
+    bottle = combined['Bottle'].dropna().iloc[0]
+    rows = np.flatnonzero((combined['Bottle'] == bottle).to_numpy())
+    refit = fit_calibration(combined.loc[combined['Bottle'] != bottle]).loc[combined['Instrument'].iloc[rows]]
+    np.testing.assert_allclose(normality[rows], refit['normality'], rtol=1e-12)
+    np.testing.assert_allclose(blank[rows], refit['blank'], atol=1e-12)
+
+
+def test_bottle_does_not_calibrate_itself(combined):
+    registry = FlaskRegistry.from_frames({'combined': combined})
+    assert not volume_drift(combined, registry)['flagged'].any()
+
+    # A FlaskVol typo on one bottle's rows, the stored concentrations still imply the registered volume
+    bottle = combined['Bottle'].dropna().iloc[0]
+    typo = combined.assign(FlaskVol=combined['FlaskVol'].where(combined['Bottle'] != bottle,
+                                                               combined['FlaskVol'] + 0.5))
+    assert abs(volume_drift(typo, registry).loc[bottle, 'drift']) < 0.005
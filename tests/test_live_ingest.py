@@ -0,0 +1,62 @@
+import os
+
+import pandas as pd
+
+import do_cli
+from live_ingest import LiveSession
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'data')
+RAW_FILE = os.path.join(DATA_DIR, 'atmospheric_diff_instruments.csv')
+
+
+def test_follow_header_only_file(tmp_path, capsys):
+    path = tmp_path / 'results.csv'
+    header = pd.read_csv(RAW_FILE, encoding='utf-8-sig', nrows=0)
+    header.to_csv(path, index=False, encoding='utf-8-sig')
+
+    session = LiveSession(str(path))
+    update = session.update()
+    assert len(update.rows) == 0
+    assert session.summary.describe().empty
+
+    assert do_cli.main(['follow', str(path), '--duration', '0.05', '--interval', '0.01']) == 0
+    assert 'Empty DataFrame' in capsys.readouterr().out
+
+
+def test_follow_file_without_experiment_column(tmp_path):
+    raw = pd.read_csv(RAW_FILE, encoding='utf-8-sig')
+    assert 'Experiment' not in raw
+    path = tmp_path / 'results.csv'
+    raw.to_csv(path, index=False, encoding='utf-8-sig')
+
+    session = LiveSession(str(path))
+    update = session.update()
+    assert len(update.rows) == len(raw)
+
+    stats = session.summary.describe()
+    assert stats.index.names == ['Instrument']
+    assert stats['count'].sum() == len(raw)
+    assert sorted(stats.index) == sorted(raw['Instrument'].unique())
+
+
+def test_rewritten_file_is_not_charted_twice(tmp_path):
+    from control_charts import ControlCharts
+
+    raw = pd.read_csv(os.path.join(DATA_DIR, 'independent_iodate.csv'), encoding='utf-8-sig')
+    path = tmp_path / 'results.csv'
+    raw.iloc[:8].to_csv(path, index=False, encoding='utf-8-sig')
+    charts = ControlCharts(str(tmp_path / 'charts.json'), baseline=2)
+    session = LiveSession(str(path), experiment='Iodate', charts=charts, standard='iodate')
+    assert len(session.update().chart) == 8
+
+    # The writer replaces the file with the old rows plus new ones, only the new ones get charted
+    replacement = tmp_path / 'replacement.csv'
+    raw.to_csv(replacement, index=False, encoding='utf-8-sig')
+    os.replace(replacement, path)
+    update = session.update()
+    assert update.restarted
+    assert len(update.chart) == len(raw) - 8
+    assert sum(chart.baseline_n + chart.n for chart in charts.charts.values()) == len(raw)
+
+    # Iodate isn't air saturated, so it isn't put through the saturation QC
+    assert update.qc is None
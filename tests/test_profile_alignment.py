@@ -0,0 +1,19 @@
+import numpy as np
+
+from profile_alignment import pressure_levels
+
+
+def test_levels_split_at_gaps_and_per_cast():
+    pressure = [10.2, 9.8, 500.4, 10.0, 499.6, np.nan, 10.1]
+    casts = [0, 0, 0, 0, 0, 0, 1]
+    levels = pressure_levels(pressure, groups=casts)
+    np.testing.assert_array_equal(levels, [10.0, 10.0, 500.0, 10.0, 500.0, np.nan, 10.1])
+
+
+def test_closely_spaced_run_cut_at_tolerance():
+    pressure = np.arange(0, 10.01, 0.5)
+    levels = pressure_levels(pressure, tolerance=2.0)
+    for level in np.unique(levels):
+        members = pressure[levels == level]
+        assert members.max() - members.min() <= 2.0
+    assert np.unique(levels).tolist() == [1.0, 3.25, 5.25, 7.25, 9.25]
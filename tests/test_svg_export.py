@@ -0,0 +1,14 @@
+from svg_export import round_coordinates
+
+
+def test_coordinates_rounded_but_not_label_text():
+    svg = '<path d="M 1.23456 -0.001 L 2.5 3.10001"/><text x="10.12345" y="4.5">1.2345</text>'
+    assert round_coordinates(svg) == '<path d="M 1.23 0 L 2.5 3.1"/><text x="10.12" y="4.5">1.2345</text>'
+
+
+def test_only_translate_terms_of_transforms_rounded():
+    svg = '<g transform="translate(12.3456 7.891011) rotate(-90.123456) scale(0.141414 -0.141414)"/>'
+    rounded = '<g transform="translate(12.35 7.89) rotate(-90.123456) scale(0.141414 -0.141414)"/>'
+    assert round_coordinates(svg) == rounded
+    matrix = '<use transform="matrix(0.123456 0 0 0.123456 10.12345 20.6789)"/>'
+    assert round_coordinates(matrix) == matrix
@@ -0,0 +1,30 @@
+import os
+
+import pandas as pd
+import pytest
+
+from titration_calc import ML_TO_UMOL, fit_calibration, recompute
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'data')
+
+
+@pytest.fixture(scope='module')
+def combined():
+    return pd.read_csv(os.path.join(DATA_DIR, 'combined.csv'), encoding='utf-8-sig')
+
+
+def test_stored_values_recompute_within_tolerance(combined):
+    calibration = fit_calibration(combined)
+    assert not recompute(combined, calibration)['flagged'].any()
+
+
+def test_instrument_conversion_is_fitted(combined):
+    calibration = fit_calibration(combined)
+    assert (calibration['ml_to_umol'] - ML_TO_UMOL).abs().max() > 0.01
+    assert recompute(combined, calibration.drop(columns='ml_to_umol'))['O2µmol/L flag'].any()
+
+
+def test_small_calibration_offset_is_flagged(combined):
+    calibration = fit_calibration(combined)
+    calibration['ml_to_umol'] *= 1.0005
+    assert recompute(combined, calibration)['O2µmol/L flag'].mean() > 0.5